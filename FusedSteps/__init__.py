@@ -0,0 +1,140 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It runs step1, step2, step3 and step4 in a single activity, passing the data
+# between steps in memory instead of through the blob storage.
+
+import datetime
+import logging
+import os
+from dataclasses import asdict
+
+from .. import step1, step2, step3, step4
+from ..common import (
+    PHASE_CACHE,
+    PHASE_TRANSFORM,
+    BlobStorageClient,
+    StepCache,
+    get_blob_storage_client,
+    load_schema,
+    profile_span,
+    profile_step,
+    reset_on_auth_error,
+    sampling_options,
+)
+
+
+def persist_intermediate() -> bool:
+    """
+    Whether the step 1 to step 3 outputs are written to the blob storage,
+    set with the FusedPersistIntermediate app setting.
+    The final step 4 output is always written.
+    """
+    return os.getenv("FusedPersistIntermediate", "false").lower() == "true"
+
+
+def main(fusedInput) -> list:
+    # The input is either the filename or a dict with the filename, the path of the
+    # schema of its dataset, the seed of the run, the options of the data generated by
+    # step1, the sampling options per step and the force_refresh flag
+    if isinstance(fusedInput, dict):
+        filename = fusedInput["filename"]
+        schema_path = fusedInput.get("schema")
+        seed = fusedInput.get("seed")
+        generation = fusedInput.get("generation") or {}
+        sampling = fusedInput.get("sampling") or {}
+        force_refresh = bool(fusedInput.get("force_refresh"))
+    else:
+        filename = fusedInput
+        schema_path = None
+        seed = None
+        generation = {}
+        sampling = {}
+        force_refresh = False
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python FusedSteps function started at {utc_timestamp} with filename {filename}"
+    )
+
+    try:
+        with profile_step("FusedSteps", filename) as profile:
+            # Reuse the pooled container client shared by all activities in this worker
+            blob_client: BlobStorageClient = get_blob_storage_client()
+            persist = persist_intermediate()
+            step1_params = {"filename": filename, "seed": seed, **generation}
+
+            # Reuse the cached results if neither the input file nor the steps changed
+            cache = StepCache(blob_client)
+            with profile_span(PHASE_CACHE):
+                cache_key, cached = cache.lookup(
+                    "FusedSteps",
+                    "-".join(step.STEP_VERSION for step in (step1, step2, step3, step4)),
+                    filename,
+                    {
+                        **step1.cache_params(step1_params),
+                        "sampling": sampling,
+                        "persist": persist,
+                    },
+                    force_refresh,
+                )
+            if cached:
+                *results, result4 = cached["results"]
+                return [*results, {**result4, "perf": profile.summary(cache_hit=True)}]
+
+            # Step 1: generate data from the shape of the input file
+            schema = load_schema(blob_client, schema_path)
+            columns, row_count = step1.read_input_shape(blob_client, filename, schema)
+            with profile_span(PHASE_TRANSFORM):
+                data1 = step1.transform(columns, **step1.transform_kwargs(step1_params))
+            output1 = step1.output_path(filename)
+            if persist:
+                blob_client.upload_pd_dataframe(data1, output1)
+            result1 = step1.output(
+                step1_output_filename=output1 if persist else None,
+                col_count=len(columns),
+                row_count=row_count,
+            )
+
+            # Step 2 to step 4: sample the output of the previous step
+            with profile_span(PHASE_TRANSFORM):
+                data2, rows1 = step2.transform([data1], **sampling_options(sampling.get("step2", {})))
+            output2 = step2.output_path(output1)
+            if persist:
+                blob_client.upload_pd_dataframe(data2, output2)
+            result2 = step2.output(
+                step2_output_filename=output2 if persist else None,
+                col_count=data2.shape[1],
+                row_count=rows1,
+            )
+
+            with profile_span(PHASE_TRANSFORM):
+                data3, rows2 = step3.transform([data2], **sampling_options(sampling.get("step3", {})))
+            output3 = step3.output_path(output2)
+            if persist:
+                blob_client.upload_pd_dataframe(data3, output3)
+            result3 = step3.output(
+                step3_output_filename=output3 if persist else None,
+                col_count=data3.shape[1],
+                row_count=rows2,
+            )
+
+            with profile_span(PHASE_TRANSFORM):
+                data4, rows3 = step4.transform([data3], **sampling_options(sampling.get("step4", {})))
+            output4 = step4.output_path(output3)
+            blob_client.upload_pd_dataframe(data4, output4)
+            result4 = step4.output(
+                step4_output_filename=output4,
+                col_count=data4.shape[1],
+                row_count=rows3,
+                # The profile covers all four steps
+                perf=profile.summary(),
+            )
+
+            # Return the same results as the chained steps
+            results = [asdict(result1), asdict(result2), asdict(result3), asdict(result4)]
+            cache.put(cache_key, {"results": results, "step4_output_filename": output4})
+            return results
+    except Exception as e:
+        logging.exception("EXCEPTION while running FusedSteps", exc_info=e)
+        reset_on_auth_error(e)
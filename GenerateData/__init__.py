@@ -4,35 +4,118 @@
 import datetime
 import logging
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING
 
-import pandas as pd
-from azure.storage.blob import BlobServiceClient
-from mimesis import Address, Datetime, Person
-from mimesis.enums import Gender
+from ..common import (
+    SCHEMA_SAMPLE_ROWS,
+    BlobStorageClient,
+    get_blob_storage_client,
+    infer_schema,
+    reset_on_auth_error,
+    save_schema,
+)
 
-from ..common import BlobStorageClient
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
+# Number of values drawn from each mimesis provider, rows are built by sampling from these pools
+DEFAULT_POOL_SIZE = 1000
+MAX_UPLOAD_THREADS = 8
+# Files generated but not uploaded yet, each is held in memory as a CSV string until its upload completes
+MAX_PENDING_UPLOADS = 2 * MAX_UPLOAD_THREADS
+# Range of the generated attribute5 timestamps, in seconds since the epoch (2000-01-01 to 2022-01-01)
+TIMESTAMP_RANGE = (946684800, 1640995200)
 
-def create_rows_mimesis(num=1):
-    person = Person("en")
-    addess = Address()
-    datetime = Datetime()
-    output = [
+
+def build_value_pools(seed: int, pool_size: int = DEFAULT_POOL_SIZE) -> dict:
+    """
+    Call each mimesis provider pool_size times up front, so rows can be built
+    in bulk with NumPy indexing instead of calling mimesis once per row.
+    """
+    # Imported on the first call rather than when the worker loads the function
+    import numpy as np
+    from mimesis import Address, Person
+
+    person = Person("en", seed=seed)
+    addess = Address(seed=seed)
+
+    def pool(provider):
+        return np.array([provider() for _ in range(pool_size)], dtype=object)
+
+    return {
+        "first_name": pool(person.first_name),
+        "last_name": pool(person.last_name),
+        "email": pool(person.email),
+        "telephone": pool(person.telephone),
+        "blood_type": pool(person.blood_type),
+        "nationality": pool(person.nationality),
+        "city": pool(addess.city),
+        "state": pool(addess.state),
+        "postal_code": pool(addess.postal_code),
+    }
+
+
+def create_rows(
+    rng: "np.random.Generator", pools: dict, num_rows: int, num_columns: int = None
+) -> "pd.DataFrame":
+    """
+    Build num_rows rows column by column from the value pools.
+    With num_columns, the standard columns are cut or padded with random integer
+    attribute columns to that many columns.
+    """
+    import numpy as np
+    import pandas as pd
+
+    def sample(name):
+        values = pools[name]
+        return values[rng.integers(0, len(values), size=num_rows)]
+
+    timestamps = rng.integers(*TIMESTAMP_RANGE, size=num_rows).astype("datetime64[s]")
+    rows = pd.DataFrame(
         {
-            "pii_name": person.full_name(),
-            "pii_email": person.email(),
-            "pii_mobile": person.telephone(),
-            "attribute1": person.age(),
-            "attribute2": person.blood_type(),
-            "attribute3": addess.city(),
-            "attribute4": addess.state(),
-            "attribute5": datetime.datetime().isoformat(),
-            "attribute6": person.nationality(),
-            "attribute7": addess.postal_code(),
+            "pii_name": sample("first_name") + " " + sample("last_name"),
+            "pii_email": sample("email"),
+            "pii_mobile": sample("telephone"),
+            "attribute1": rng.integers(16, 67, size=num_rows),
+            "attribute2": sample("blood_type"),
+            "attribute3": sample("city"),
+            "attribute4": sample("state"),
+            "attribute5": np.datetime_as_string(timestamps),
+            "attribute6": sample("nationality"),
+            "attribute7": sample("postal_code"),
         }
-        for x in range(num)
-    ]
-    return output
+    )
+    if num_columns is None:
+        return rows
+    rows = rows.iloc[:, :num_columns]
+    extra_columns = [f"attribute{i}" for i in range(rows.shape[1] - 2, num_columns - 2)]
+    if extra_columns:
+        extra = rng.integers(0, 99999, size=(num_rows, len(extra_columns)))
+        rows = pd.concat([rows, pd.DataFrame(extra, columns=extra_columns)], axis=1)
+    return rows
+
+
+def generate_file(
+    seed_sequence: "np.random.SeedSequence", pools: dict, num_rows: int, num_columns: int = None
+) -> str:
+    """
+    Generate the CSV content of one file, runs in a worker process.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed_sequence)
+    return create_rows(rng, pools, num_rows, num_columns).to_csv(index=False)
+
+
+def generator_workers(num_files: int) -> int:
+    """
+    Number of generator processes, at most one per file and one per CPU.
+    """
+    cpu_count = os.cpu_count() or 1
+    requested = int(os.getenv("GenerateDataMaxWorkers") or cpu_count)
+    return max(1, min(num_files, requested, cpu_count))
 
 
 def main(httpPostInput: dict) -> list:
@@ -44,23 +127,64 @@ def main(httpPostInput: dict) -> list:
     )
 
     try:
+        import numpy as np
+
         f_path = httpPostInput["rawDataPath"]
         num_files = int(httpPostInput["numFiles"])
         num_rows = int(httpPostInput["numRows"])
+        num_columns = httpPostInput.get("numColumns")
+        num_columns = int(num_columns) if num_columns else None
+        pool_size = int(httpPostInput.get("poolSize", DEFAULT_POOL_SIZE))
+        seed = httpPostInput.get("seed")
+
+        # The same seed always generates the same files, one independent stream per file
+        root_seed = np.random.SeedSequence(int(seed) if seed not in (None, "") else None)
+        pool_seed, *file_seeds = root_seed.spawn(num_files + 1)
+        pools = build_value_pools(int(pool_seed.generate_state(1)[0]), pool_size)
 
-        # Create the BlobServiceClient object which will be used to create a container client
-        blob_service_client = BlobServiceClient.from_connection_string(
-            os.getenv("DataStorage")
-        )
-        container_client = blob_service_client.get_container_client(
-            os.getenv("DataContainer")
-        )
-        blob_client: BlobStorageClient = BlobStorageClient(container_client)
-        # Generate input data for testing
-        for i in range(num_files):
-            df = pd.DataFrame(create_rows_mimesis(num_rows))
-            logging.info(f"Generating file {f_path}/{i}.csv")
-            blob_client.upload_pd_dataframe(df, f"{f_path}/{i}.csv")
-        return {"rawDataPath": f_path, "numFiles": num_files, "numRows": num_rows}
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+        # Generate input data for testing, files are generated in parallel processes
+        # and uploaded concurrently as soon as they are ready. A file is only submitted
+        # for generation while fewer than MAX_PENDING_UPLOADS files wait for their upload,
+        # so slow uploads bound the CSV strings held in memory instead of piling them up
+        pending = iter(enumerate(file_seeds))
+        with ProcessPoolExecutor(max_workers=generator_workers(num_files)) as generators, ThreadPoolExecutor(
+            max_workers=MAX_UPLOAD_THREADS
+        ) as uploaders:
+            generating, uploading = {}, set()
+            while True:
+                while len(generating) + len(uploading) < MAX_PENDING_UPLOADS:
+                    i, file_seed = next(pending, (None, None))
+                    if file_seed is None:
+                        break
+                    future = generators.submit(generate_file, file_seed, pools, num_rows, num_columns)
+                    generating[future] = f"{f_path}/{i}.csv"
+                if not generating and not uploading:
+                    break
+                done, _ = wait([*generating, *uploading], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in uploading:
+                        uploading.remove(future)
+                        future.result()
+                        continue
+                    file_name = generating.pop(future)
+                    logging.info(f"Generating file {file_name}")
+                    uploading.add(uploaders.submit(blob_client.upload_blob_content, future.result(), file_name))
+
+        # Declare the schema of the generated dataset from rows drawn from the same pools,
+        # so the postal codes stay strings and the pooled columns are read as categoricals
+        if num_files:
+            sample = create_rows(
+                np.random.default_rng(pool_seed), pools, SCHEMA_SAMPLE_ROWS, num_columns
+            )
+            save_schema(blob_client, f_path, infer_schema(sample))
+        return {
+            "rawDataPath": f_path,
+            "numFiles": num_files,
+            "numRows": num_rows,
+            "seed": str(root_seed.entropy),
+        }
     except Exception as e:
         logging.exception("EXCEPTION while getting list", exc_info=e)
+        reset_on_auth_error(e)
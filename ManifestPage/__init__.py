@@ -0,0 +1,74 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It reads one page of the file manifest written by step0 and turns it into the
+# work items of the orchestrator.
+
+import datetime
+import json
+import logging
+from typing import TYPE_CHECKING
+
+from ..common import BlobStorageClient, get_blob_storage_client, pack_groups, reset_on_auth_error
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def work_items(manifest_page: "pd.DataFrame", group_cost: float = None) -> list:
+    """
+    Work items of a manifest page, one per sub-orchestration, costliest first.
+    An item is a filename, a dict with the header size and byte ranges of a file
+    split by step0, or a dict with the filenames of a group of small files that
+    together cost about group_cost seconds.
+    """
+    items = []
+    costs = []
+    small_files = []
+    for row in manifest_page.itertuples(index=False):
+        if isinstance(row.byte_ranges, str):
+            items.append(
+                {
+                    "filename": row.name,
+                    "headerSize": int(row.header_size),
+                    "byteRanges": json.loads(row.byte_ranges),
+                }
+            )
+            costs.append(row.cost)
+        elif group_cost and row.cost < group_cost:
+            small_files.append(row)
+        else:
+            items.append(row.name)
+            costs.append(row.cost)
+
+    for group in pack_groups([row.cost for row in small_files], group_cost) if small_files else []:
+        names = [small_files[index].name for index in group]
+        items.append(names[0] if len(names) == 1 else {"filenames": names})
+        costs.append(sum(small_files[index].cost for index in group))
+
+    order = sorted(range(len(items)), key=lambda index: -costs[index])
+    return [items[index] for index in order]
+
+
+def main(page) -> list:
+    # The input is either the page path or a dict with the page path and the
+    # groupCost in seconds small files are packed up to
+    params = page if isinstance(page, dict) else {"page": page}
+    page = params["page"]
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python ManifestPage function started at {utc_timestamp} with page {page}"
+    )
+
+    try:
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        manifest_page = blob_client.download_pd_dataframe(
+            page, usecols=["name", "header_size", "byte_ranges", "cost"]
+        )
+        return work_items(manifest_page, params.get("groupCost"))
+    except Exception as e:
+        logging.exception("EXCEPTION while reading manifest page", exc_info=e)
+        reset_on_auth_error(e)
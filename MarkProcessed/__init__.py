@@ -0,0 +1,58 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It records that raw files went through all steps, so incremental runs skip them.
+
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from ..common import BlobStorageClient, get_blob_storage_client, reset_on_auth_error
+
+MAX_STATUS_THREADS = 16
+
+
+def stamp_files(blob_client: BlobStorageClient, filenames: list) -> list:
+    """
+    Stamp the files as processed in their metadata in parallel.
+    Returns the files stamped, a failed file does not stop the others.
+    """
+
+    def stamp(filename):
+        try:
+            blob_client.set_blob_status(filename)
+            return filename
+        except Exception as e:
+            logging.warning(f"Failed to stamp {filename} as processed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=MAX_STATUS_THREADS) as executor:
+        return [filename for filename in executor.map(stamp, filenames) if filename]
+
+
+def main(processed: dict) -> list:
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python MarkProcessed function started at {utc_timestamp} for {len(processed['filenames'])} files"
+    )
+
+    try:
+        filenames = processed["filenames"]
+        archive_path = processed.get("archivePath")
+
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        # Either move the files out of the raw data folder or stamp them in their metadata
+        if not archive_path:
+            return stamp_files(blob_client, filenames)
+
+        results = blob_client.move_blobs(filenames, archive_path)
+        for result in results:
+            if not result["moved"]:
+                logging.warning(f"Failed to archive {result['source']}: {result['error']}")
+        return [result["source"] for result in results if result["moved"]]
+    except Exception as e:
+        logging.exception("EXCEPTION while marking files as processed", exc_info=e)
+        reset_on_auth_error(e)
@@ -0,0 +1,68 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It merges the step 1 outputs of the byte ranges of a file split by step0
+# into the step 1 output of the whole file, which the next steps read as usual.
+
+import datetime
+import logging
+from dataclasses import asdict
+
+from .. import step1
+from ..common import (
+    PHASE_TRANSFORM,
+    BlobStorageClient,
+    get_blob_storage_client,
+    profile_span,
+    profile_step,
+    reset_on_auth_error,
+)
+
+
+def main(ranges: dict) -> dict:
+    # The input is a dict with the filename and the step 1 results of its byte ranges, in file order
+    filename = ranges["filename"]
+    range_results = ranges["results"]
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python MergeRanges function started at {utc_timestamp} with filename {filename} "
+        f"and {len(range_results)} byte ranges"
+    )
+
+    try:
+        # Imported on the first call rather than when the worker loads the function
+        import pandas as pd
+
+        with profile_step("MergeRanges", filename) as profile:
+            if not range_results or not all(range_results):
+                raise Exception(f"Step 1 failed for some byte ranges of {filename}")
+            if len({result["col_count"] for result in range_results}) != 1:
+                raise Exception(f"The byte ranges of {filename} do not have the same columns")
+
+            # Reuse the pooled container client shared by all activities in this worker
+            blob_client: BlobStorageClient = get_blob_storage_client()
+
+            # The range outputs are kept, so the step cache reuses them when the file did not change
+            frames = [
+                blob_client.download_pd_dataframe(result["step1_output_filename"])
+                for result in range_results
+            ]
+            with profile_span(PHASE_TRANSFORM):
+                merged = pd.concat(frames, ignore_index=True)
+            output_filename = step1.output_path(filename)
+            blob_client.upload_pd_dataframe(merged, output_filename)
+
+            # The row count of the file is the sum of the row counts of its ranges
+            result = asdict(
+                step1.output(
+                    step1_output_filename=output_filename,
+                    col_count=range_results[0]["col_count"],
+                    row_count=sum(range_result["row_count"] for range_result in range_results),
+                    perf=profile.summary(ranges=len(range_results)),
+                )
+            )
+            return {**result, "range_perf": [range_result.get("perf") for range_result in range_results]}
+    except Exception as e:
+        logging.exception("EXCEPTION while merging the byte ranges", exc_info=e)
+        reset_on_auth_error(e)
@@ -1,6 +1,102 @@
 # This function is not intended to be invoked directly. Instead it will be
 # triggered by an HTTP starter function.
+import datetime
+
 import azure.durable_functions as df
+from azure.durable_functions.models.Task import TaskState
+
+# Maximum number of sub-orchestrations running at the same time
+DEFAULT_MAX_IN_FLIGHT = 100
+# Number of files processed before the orchestration restarts itself with continue_as_new,
+# which keeps the orchestration history and its replay cost bounded
+DEFAULT_MAX_FILES_PER_GENERATION = 1000
+# Failed files listed in the orchestration output, the run manifest has all of them
+MAX_REPORTED_FAILURES = 100
+
+
+def item_filenames(item) -> list:
+    """
+    Names of the files of a work item of a manifest page: a filename, a file split into
+    byte ranges as a dict with its ranges, or a group of small files.
+    """
+    if isinstance(item, dict):
+        return item["filenames"] if "filenames" in item else [item["filename"]]
+    return [item]
+
+
+def item_input(item, file_options: dict) -> dict:
+    """
+    Input of the sub-orchestration of a work item, a group gets the input of each of its files.
+    """
+    if isinstance(item, dict) and "filenames" in item:
+        return {"files": [{"filename": filename, **file_options} for filename in item["filenames"]]}
+    return {**(item if isinstance(item, dict) else {"filename": item}), **file_options}
+
+
+def item_results(item, result) -> list:
+    """
+    Results of each file of a work item, a group returns the list of its file results.
+    """
+    if isinstance(item, dict) and "filenames" in item:
+        return result or [None] * len(item["filenames"])
+    return [result]
+
+
+class RunProgress:
+    """
+    Progress of the run, published as the custom status of the orchestration so the
+    status query shows it while the run goes on. Times come from the orchestration
+    clock, so a replay publishes the same status.
+    """
+
+    def __init__(self, context: df.DurableOrchestrationContext, state: dict):
+        self.__context = context
+        self.started_at = state.get("startedAt") or context.current_utc_datetime.isoformat()
+        self.file_total = 0
+        self.files_done = int(state.get("fileCount", 0))
+        self.files_failed = int(state.get("failedCount", 0))
+        self.rows = int(state.get("rowCount", 0))
+
+    def item_done(self, item, result):
+        """
+        Count the files of a completed work item and the rows their step 1 read.
+        """
+        for file_result in item_results(item, result):
+            self.files_done += 1
+            if not file_result or not all(file_result):
+                self.files_failed += 1
+            elif file_result[0]:
+                self.rows += file_result[0].get("row_count") or 0
+
+    def publish(self, phase: str, in_flight: int = 0):
+        elapsed = (
+            self.__context.current_utc_datetime - datetime.datetime.fromisoformat(self.started_at)
+        ).total_seconds()
+        files_per_second = self.files_done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.file_total - self.files_done, 0)
+        self.__context.set_custom_status(
+            {
+                "phase": phase,
+                "filesTotal": self.file_total,
+                "filesDone": self.files_done,
+                "filesFailed": self.files_failed,
+                "inFlight": in_flight,
+                "rowsPerSecond": round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+                "etaSeconds": round(remaining / files_per_second) if files_per_second else None,
+                "elapsedSeconds": round(elapsed),
+            }
+        )
+
+    def state(self) -> dict:
+        """
+        Counters carried over to the next generation with continue_as_new.
+        """
+        return {
+            "startedAt": self.started_at,
+            "fileCount": self.files_done,
+            "failedCount": self.files_failed,
+            "rowCount": self.rows,
+        }
 
 
 def orchestrator_function(context: df.DurableOrchestrationContext):
@@ -11,19 +107,211 @@ def orchestrator_function(context: df.DurableOrchestrationContext):
             "A root directory, number of rows and number of columns per file is required as input"
         )
 
-    # Generate input data for testing
-    data_gen_path = yield context.call_activity("GenerateData", httpPostInput)
+    # Counters of the files done so far, carried over from the previous generations
+    progress = RunProgress(context, httpPostInput)
+
+    if "manifest" in httpPostInput:
+        # Continued from a previous generation, pick up the manifest of files from step0
+        manifest = httpPostInput["manifest"]
+    else:
+        # Generate input data for testing
+        progress.publish("generating")
+        data_gen_path = yield context.call_activity("GenerateData", httpPostInput)
+
+        # Pass to step 0 to write a manifest of the files from folder to process
+        step0_input = {
+            **data_gen_path,
+            "runId": context.instance_id,
+            "shardPrefixes": httpPostInput.get("shardPrefixes"),
+            "pageSize": httpPostInput.get("pageSize"),
+            "incremental": httpPostInput.get("incremental"),
+            "splitSize": httpPostInput.get("splitSize"),
+        }
+        progress.publish("listing")
+        manifest = yield context.call_activity(
+            "step0", {key: value for key, value in step0_input.items() if value is not None}
+        )
+    progress.file_total = manifest["fileCount"]
+
+    # The cursor is the manifest page and the offset of the next file in that page
+    page_index = int(httpPostInput.get("pageCursor", 0))
+    page_offset = int(httpPostInput.get("pageOffset", 0))
+    result_parts = int(httpPostInput.get("resultParts", 0))
+    failures = httpPostInput.get("failures", [])
+    max_in_flight = int(httpPostInput.get("maxInFlight", DEFAULT_MAX_IN_FLIGHT))
+    remaining = int(
+        httpPostInput.get("maxFilesPerGeneration", DEFAULT_MAX_FILES_PER_GENERATION)
+    )
+
+    # for each file in the manifest from step0, process step1, step2, step3 and step4 as SubOrchestrator
+    pipeline_mode = httpPostInput.get("pipelineMode", "chained")
+    sampling = httpPostInput.get("sampling") or {}
+    force_refresh = bool(httpPostInput.get("forceRefresh"))
+    incremental = bool(httpPostInput.get("incremental"))
+    archive_path = httpPostInput.get("archivePath")
+    mark_failures = int(httpPostInput.get("markFailures", 0))
+    group_cost = float(httpPostInput.get("groupCost") or 0)
+    file_options = {
+        "pipelineMode": pipeline_mode,
+        "schema": manifest.get("schema"),
+        "seed": httpPostInput.get("seed"),
+        "generation": httpPostInput.get("generation") or {},
+        "sampling": sampling,
+        "forceRefresh": force_refresh,
+    }
+    pages = manifest["pages"]
+
+    def save_batch(batch: dict) -> list:
+        """
+        Tasks saving the results of a batch in the run manifest rather than carrying
+        them in the history and, in incremental runs, marking its processed files.
+        """
+        nonlocal result_parts, failures
+        filenames = [filename for item in batch["items"] for filename in item_filenames(item)]
+        batch_results = [
+            result
+            for item, result in zip(batch["items"], batch["outputs"])
+            for result in item_results(item, result)
+        ]
+        tasks = [
+            (
+                context.call_activity(
+                    "SaveRunResults",
+                    {
+                        "manifest": manifest["manifest"],
+                        "part": result_parts,
+                        "filenames": filenames,
+                        "results": batch_results,
+                    },
+                ),
+                None,
+            )
+        ]
+        result_parts += 1
+        processed = [
+            filename for filename, result in zip(filenames, batch_results) if result and all(result)
+        ]
+        failed = [
+            filename for filename, result in zip(filenames, batch_results) if not result or not all(result)
+        ]
+        failures = (failures + failed)[:MAX_REPORTED_FAILURES]
+        if incremental and processed:
+            # Mark the batch files that went through all steps with one activity, the
+            # others are retried by the next incremental run
+            marking = context.call_activity(
+                "MarkProcessed", {"filenames": processed, "archivePath": archive_path}
+            )
+            tasks.append((marking, len(processed)))
+        return tasks
 
-    # Pass to step 0 to get a list of files from folder to process
-    files = yield context.call_activity("step0", data_gen_path)
-    tasks = []
-    # for each file in the list from step0, process step1, step2, step3 and step4 as SubOrchestrator
-    for file in files:
-        tasks.append(context.call_sub_orchestrator("SubOrchestratorFunc", file))
+    # The files of a page form a batch. The window of sub-orchestrations is refilled with
+    # the files of the next page while the last ones of the previous page still run, the
+    # next page being read as soon as the files of the current one are all started.
+    # step0 orders the files costliest first, the page items keep that order so the
+    # largest files start first and the small ones fill the gaps at the end
+    batch = None
+    page_task = None
+    running = []
+    bookkeeping = []
+    while True:
+        while batch and batch["next"] < len(batch["items"]) and len(running) < max_in_flight:
+            index = batch["next"]
+            task = context.call_sub_orchestrator(
+                "SubOrchestratorFunc", item_input(batch["items"][index], file_options)
+            )
+            running.append((task, batch, index))
+            batch["next"] += 1
+        dispatched = batch is None or batch["next"] >= len(batch["items"])
+        if dispatched and page_task is None and remaining > 0 and page_index < len(pages):
+            page_task = context.call_activity(
+                "ManifestPage", {"page": pages[page_index], "groupCost": group_cost}
+            )
+        progress.publish("processing", len(running))
 
-    results = yield context.task_all(tasks)
+        tasks = [task for task, _, _ in running] + [task for task, _ in bookkeeping]
+        if page_task is not None:
+            tasks.append(page_task)
+        if not tasks:
+            break
+        completed = yield context.task_any(tasks)
+
+        if completed is page_task:
+            page_task = None
+            if completed.state is TaskState.FAILED:
+                raise completed.result
+            items = completed.result
+            batch = {"items": items[page_offset : page_offset + remaining], "next": 0}
+            batch["outputs"] = [None] * len(batch["items"])
+            batch["left"] = len(batch["items"])
+            remaining -= len(batch["items"])
+            page_offset += len(batch["items"])
+            if page_offset >= len(items):
+                page_index += 1
+                page_offset = 0
+            if not batch["items"]:
+                batch = None
+            continue
+
+        for position, (task, task_batch, index) in enumerate(running):
+            if task is completed:
+                del running[position]
+                # The result of a failed sub-orchestration is its exception, count it as a failed file
+                result = None if task.state is TaskState.FAILED else task.result
+                task_batch["outputs"][index] = result
+                task_batch["left"] -= 1
+                progress.item_done(task_batch["items"][index], result)
+                if not task_batch["left"]:
+                    bookkeeping.extend(save_batch(task_batch))
+                break
+        else:
+            for position, (task, processed_count) in enumerate(bookkeeping):
+                if task is completed:
+                    del bookkeeping[position]
+                    if task.state is TaskState.FAILED:
+                        raise task.result
+                    if processed_count is not None:
+                        mark_failures += processed_count - len(task.result or [])
+                    break
+
+    if page_index < len(pages):
+        # Restart with a fresh history and carry over the manifest cursor
+        context.continue_as_new(
+            {
+                **httpPostInput,
+                "manifest": manifest,
+                "pageCursor": page_index,
+                "pageOffset": page_offset,
+                "resultParts": result_parts,
+                **progress.state(),
+                "failures": failures,
+                "markFailures": mark_failures,
+            }
+        )
+        return
+
+    # Move the watermark forward only when every file was processed, otherwise the
+    # failed files would be skipped by the next incremental run
+    if incremental and manifest.get("watermark") and not progress.files_failed and not mark_failures:
+        yield context.call_activity(
+            "SaveWatermark",
+            {"rawDataPath": manifest["rawDataPath"], "watermark": manifest["watermark"]},
+        )
 
-    return results
+    # Aggregate the perf profiles saved in the run manifest into a run level summary,
+    # the output only holds counts, the first failures and where the manifest is
+    progress.publish("summarizing")
+    summary = yield context.call_activity("SummarizeRun", {"manifest": manifest["manifest"]})
+    progress.publish("completed")
+    return {
+        "fileCount": progress.files_done,
+        "succeededCount": progress.files_done - progress.files_failed,
+        "failedCount": progress.files_failed,
+        "failures": failures,
+        "markFailures": mark_failures,
+        "runManifest": manifest["manifest"],
+        "resultParts": result_parts,
+        "summary": summary,
+    }
 
 
 main = df.Orchestrator.create(orchestrator_function)
@@ -0,0 +1,31 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It saves the step results of a batch of files as a part of the run manifest.
+
+import datetime
+import logging
+
+from ..common import BlobStorageClient, get_blob_storage_client, reset_on_auth_error, save_results_part
+
+
+def main(batch: dict) -> str:
+    # The input is a dict with the manifest folder of the run, the part number,
+    # the filenames of the batch and their results, in the same order
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python SaveRunResults function started at {utc_timestamp} with part {batch['part']} "
+        f"of {batch['manifest']} and {len(batch['filenames'])} files"
+    )
+
+    try:
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        return save_results_part(
+            blob_client, batch["manifest"], batch["part"], batch["filenames"], batch["results"]
+        )
+    except Exception as e:
+        logging.exception("EXCEPTION while saving run results", exc_info=e)
+        reset_on_auth_error(e)
@@ -0,0 +1,37 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It saves the last modified watermark of an incremental run that completed without failures.
+
+import datetime
+import json
+import logging
+
+from ..common import BlobStorageClient, get_blob_storage_client, reset_on_auth_error
+from ..step0 import watermark_path
+
+
+def main(watermark: dict) -> str:
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python SaveWatermark function started at {utc_timestamp} with input args {watermark}"
+    )
+
+    try:
+        from azure.storage.blob import ContentSettings
+
+        path = watermark_path(watermark["rawDataPath"])
+
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        blob_client.upload_blob_content(
+            json.dumps({"last_modified": watermark["watermark"], "saved_at": utc_timestamp}),
+            path,
+            content_settings=ContentSettings(content_type="application/json"),
+        )
+        return path
+    except Exception as e:
+        logging.exception("EXCEPTION while saving watermark", exc_info=e)
+        reset_on_auth_error(e)
@@ -6,20 +6,171 @@ import logging
 
 import azure.durable_functions as df
 
+CHAINED = "chained"
+FUSED = "fused"
+# Keys of a step result only kept for the run manifest, they are not passed on to the next step
+PROFILE_KEYS = ("perf", "range_perf")
+
 
 def orchestrator_function(context: df.DurableOrchestrationContext):
-    fileNameToProcess: str = context.get_input()
+    subOrchestratorInput = context.get_input()
+
+    # A group of small files packed together by ManifestPage is processed one file after
+    # the other, with the filenames replaced by the per file inputs
+    if isinstance(subOrchestratorInput, dict) and "files" in subOrchestratorInput:
+        files = subOrchestratorInput["files"]
+        results = []
+        for fileInput in files:
+            groupStatus = {"filesDone": len(results), "files": len(files)}
+            results.append((yield from process_file(context, fileInput, groupStatus)))
+        return results
+
+    return (yield from process_file(context, subOrchestratorInput))
+
+
+def publish_step(context: df.DurableOrchestrationContext, filename: str, step: str, status: dict = None):
+    """
+    Publish the file and the step being run as the custom status of the sub-orchestration.
+    """
+    context.set_custom_status({**(status or {}), "filename": filename, "step": step})
+
+
+def step_input(result: dict) -> dict:
+    """
+    The input of the next step built from the result of the previous one, without its profiles
+    so they are not recorded again in the history of every following activity.
+    """
+    return {key: value for key, value in result.items() if key not in PROFILE_KEYS}
+
+
+def process_file(context: df.DurableOrchestrationContext, subOrchestratorInput, groupStatus: dict = None):
+    """
+    Run the steps of one file, or step 1 of one byte range of a split file.
+    groupStatus is the progress of the group of files this file belongs to, if any.
+    """
+    # The input is either the filename or a dict with the filename, the pipeline mode,
+    # the path of the schema of the dataset written by step0, the seed and the options of
+    # the data generated by step1, e.g. {"num_rows": 1000, "value_range": [0, 100]},
+    # the sampling options of step2, step3 and step4, e.g. {"step2": {"sample_size": 100}},
+    # whether to bypass the cached step results and, for a file split by step0,
+    # the size of its header line and its byteRanges
+    if isinstance(subOrchestratorInput, dict):
+        fileNameToProcess: str = subOrchestratorInput.get("filename")
+        pipelineMode: str = subOrchestratorInput.get("pipelineMode") or CHAINED
+        schema: str = subOrchestratorInput.get("schema")
+        seed: str = subOrchestratorInput.get("seed")
+        generation: dict = subOrchestratorInput.get("generation") or {}
+        sampling: dict = subOrchestratorInput.get("sampling") or {}
+        forceRefresh: bool = bool(subOrchestratorInput.get("forceRefresh"))
+        headerSize: int = subOrchestratorInput.get("headerSize") or 0
+        byteRanges: list = subOrchestratorInput.get("byteRanges") or []
+        byteRange: list = subOrchestratorInput.get("byteRange")
+    else:
+        fileNameToProcess: str = subOrchestratorInput
+        pipelineMode: str = CHAINED
+        schema: str = None
+        seed: str = None
+        generation: dict = {}
+        sampling: dict = {}
+        forceRefresh: bool = False
+        headerSize: int = 0
+        byteRanges: list = []
+        byteRange: list = None
 
     if not fileNameToProcess:
         raise Exception("Need the filename to process as input")
+    if pipelineMode not in (CHAINED, FUSED):
+        raise Exception(f"Unknown pipeline mode {pipelineMode}")
     logging.info(f"Input file to be processed : {fileNameToProcess}")
 
-    # function chaining to process the received input file in 4 steps, each step takes input from previous step
-    result1 = yield context.call_activity("step1", fileNameToProcess)
-    result2 = yield context.call_activity("step2", result1)
-    result3 = yield context.call_activity("step3", result2)
-    result4 = yield context.call_activity("step4", result3)
-    return [result1, result2, result3, result4]
+    if byteRange:
+        # One byte range of a split file, only step 1 reads the raw file so it is the only step run per range
+        publish_step(context, fileNameToProcess, "step1", {"range": subOrchestratorInput.get("rangeIndex")})
+        result1 = yield context.call_activity(
+            "step1",
+            {
+                "filename": fileNameToProcess,
+                "schema": schema,
+                "seed": seed,
+                **generation,
+                "force_refresh": forceRefresh,
+                "byte_range": byteRange,
+                "header_size": headerSize,
+                "range_index": subOrchestratorInput.get("rangeIndex"),
+                "range_count": subOrchestratorInput.get("rangeCount"),
+            },
+        )
+        return [result1]
+
+    if byteRanges:
+        # Each byte range of a large file runs as its own sub-orchestration, then their step 1
+        # outputs are merged into the step 1 output of the whole file and the chained steps go on.
+        # The fused mode does not apply, it reads the whole file in one activity.
+        publish_step(context, fileNameToProcess, "step1", {"ranges": len(byteRanges)})
+        range_results = yield context.task_all(
+            [
+                context.call_sub_orchestrator(
+                    "SubOrchestratorFunc",
+                    {
+                        "filename": fileNameToProcess,
+                        "schema": schema,
+                        "seed": seed,
+                        "generation": generation,
+                        "forceRefresh": forceRefresh,
+                        "headerSize": headerSize,
+                        "byteRange": fileRange,
+                        "rangeIndex": rangeIndex,
+                        "rangeCount": len(byteRanges),
+                    },
+                )
+                for rangeIndex, fileRange in enumerate(byteRanges)
+            ]
+        )
+        publish_step(context, fileNameToProcess, "MergeRanges", groupStatus)
+        result1 = yield context.call_activity(
+            "MergeRanges",
+            {"filename": fileNameToProcess, "results": [result[0] for result in range_results]},
+        )
+    elif pipelineMode == FUSED:
+        # run all 4 steps in memory in a single activity, returns the same results as the chained steps
+        publish_step(context, fileNameToProcess, "FusedSteps", groupStatus)
+        results = yield context.call_activity(
+            "FusedSteps",
+            {
+                "filename": fileNameToProcess,
+                "schema": schema,
+                "seed": seed,
+                "generation": generation,
+                "sampling": sampling,
+                "force_refresh": forceRefresh,
+            },
+        )
+        return results
+    else:
+        # function chaining to process the received input file in 4 steps, each step takes input from previous step
+        publish_step(context, fileNameToProcess, "step1", groupStatus)
+        result1 = yield context.call_activity(
+            "step1",
+            {
+                "filename": fileNameToProcess,
+                "schema": schema,
+                "seed": seed,
+                **generation,
+                "force_refresh": forceRefresh,
+            },
+        )
+    results = [result1]
+    for step in ("step2", "step3", "step4"):
+        if not results[-1]:
+            # The activities return None when they fail, the file stops at the failed step
+            # and its results are short of a step, which counts it as failed
+            return results
+        publish_step(context, fileNameToProcess, step, groupStatus)
+        result = yield context.call_activity(
+            step, {**step_input(results[-1]), **sampling.get(step, {}), "force_refresh": forceRefresh}
+        )
+        results.append(result)
+    return results
 
 
 main = df.Orchestrator.create(orchestrator_function)
@@ -0,0 +1,38 @@
+# This function is not intended to be invoked directly. Instead it will be
+# triggered by an orchestrator function.
+# It summarizes the perf profiles saved in the run manifest once every file is processed,
+# and fits the cost model the next runs schedule their files with on them.
+
+import datetime
+import logging
+
+from ..common import (
+    BlobStorageClient,
+    fit_cost_model,
+    get_blob_storage_client,
+    load_cost_model,
+    load_run_profiles,
+    reset_on_auth_error,
+    save_cost_model,
+    summarize_profiles,
+)
+
+
+def main(run: dict) -> dict:
+    utc_timestamp = (
+        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    )
+    logging.info(
+        f"Python SummarizeRun function started at {utc_timestamp} with input args {run}"
+    )
+
+    try:
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        profiles = load_run_profiles(blob_client, run["manifest"])
+        save_cost_model(blob_client, fit_cost_model(profiles, load_cost_model(blob_client)))
+        return summarize_profiles(profiles)
+    except Exception as e:
+        logging.exception("EXCEPTION while summarizing run", exc_info=e)
+        reset_on_auth_error(e)
@@ -1 +1,157 @@
-from .blobstorageclient import *
\ No newline at end of file
+"""
+Code shared by the functions.
+
+The names of the submodules are exported lazily: a submodule is imported the first
+time one of its names is used, so e.g. the orchestrator functions do not import
+pandas or the storage SDK when the worker loads them.
+"""
+
+import importlib
+
+# Public names of each submodule
+_EXPORTS = {
+    "asyncblobstorageclient": (
+        "AsyncBlobStorageClient",
+        "gather_bounded",
+    ),
+    "blobstorageclient": (
+        "COPY_POLL_INITIAL_DELAY",
+        "COPY_POLL_MAX_DELAY",
+        "COPY_TIMEOUT",
+        "DEFAULT_BLOCK_SIZE",
+        "DEFAULT_CHUNK_ROWS",
+        "DEFAULT_ENCODING",
+        "DEFAULT_MAX_CONCURRENCY",
+        "DEFAULT_MOVE_CONCURRENCY",
+        "DEFAULT_RESULTS_PER_PAGE",
+        "DELETE_BATCH_SIZE",
+        "LINE_SEARCH_WINDOW",
+        "SIZE_ESTIMATE_ROWS",
+        "SPOOL_MAX_SIZE",
+        "STATUS",
+        "STATUS_METADATA_KEY",
+        "BlobStorageClient",
+    ),
+    "clientfactory": (
+        "DEFAULT_CHUNK_SIZE",
+        "DEFAULT_POOL_SIZE",
+        "get_async_blob_storage_client",
+        "get_blob_storage_client",
+        "reset_blob_storage_client",
+        "reset_on_auth_error",
+        "use_container_client",
+    ),
+    "compression": (
+        "DEFAULT_LEVELS",
+        "GZIP",
+        "IDENTITY",
+        "ZSTD",
+        "compress",
+        "decompressing_stream",
+        "get_compression",
+    ),
+    "costmodel": (
+        "COST_MODEL_FILENAME",
+        "COST_MODEL_VERSION",
+        "DEFAULT_FIXED_SECONDS",
+        "DEFAULT_SECONDS_PER_BYTE",
+        "MIN_FIT_FILES",
+        "MIN_FIT_SIZE_RATIO",
+        "cost_model_path",
+        "default_cost_model",
+        "estimate_cost",
+        "fit_cost_model",
+        "load_cost_model",
+        "pack_groups",
+        "save_cost_model",
+    ),
+    "dataformats": (
+        "ARROW",
+        "CSV",
+        "DEFAULT_INTERMEDIATE_FORMAT",
+        "FORMAT_CONTENT_TYPES",
+        "FORMAT_EXTENSIONS",
+        "FORMAT_METADATA_KEY",
+        "PARQUET",
+        "PYARROW_ENGINE",
+        "deserialize_dataframe",
+        "format_from_path",
+        "get_intermediate_format",
+        "iter_dataframe_chunks",
+        "serialize_dataframe",
+        "with_format_extension",
+    ),
+    "perf": (
+        "DEFAULT_PERCENTILES",
+        "DEFAULT_SLOWEST_FILES",
+        "PHASE_CACHE",
+        "PHASE_DOWNLOAD",
+        "PHASE_READ",
+        "PHASE_SERIALIZE",
+        "PHASE_TRANSFORM",
+        "PHASE_UPLOAD",
+        "StepProfile",
+        "percentiles",
+        "profile_add",
+        "profile_iter",
+        "profile_span",
+        "profile_step",
+        "run_profiled",
+        "summarize_profiles",
+    ),
+    "runmanifest": (
+        "RESULTS_PART_PREFIX",
+        "STEP_COUNT",
+        "file_profiles",
+        "load_run_profiles",
+        "result_row",
+        "results_part_path",
+        "results_part_paths",
+        "save_results_part",
+    ),
+    "sampling": (
+        "SAMPLING_OPTIONS",
+        "reservoir_sample",
+        "sampling_options",
+    ),
+    "schema": (
+        "CATEGORY",
+        "DATETIME",
+        "DEFAULT_MAX_CATEGORIES",
+        "DEFAULT_MAX_CATEGORY_RATIO",
+        "SCHEMA_FILENAME",
+        "SCHEMA_SAMPLE_ROWS",
+        "SCHEMA_VERSION",
+        "STRING",
+        "infer_schema",
+        "load_schema",
+        "save_schema",
+        "schema_columns",
+        "schema_path",
+        "schema_read_kwargs",
+    ),
+    "stepcache": (
+        "DEFAULT_TTL_SECONDS",
+        "OUTPUT_SUFFIX",
+        "StepCache",
+    ),
+    "streams": (
+        "ChunkIteratorStream",
+    ),
+}
+_SUBMODULES = {name: submodule for submodule, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_SUBMODULES)
+
+
+def __getattr__(name: str):
+    submodule = _SUBMODULES.get(name)
+    if submodule is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{submodule}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(_SUBMODULES))
@@ -0,0 +1,328 @@
+"""
+Asynchronous interaction with Azure Blob Storage, so one worker overlaps the I/O of many files.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from typing import TYPE_CHECKING
+
+from .blobstorageclient import (
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_CHUNK_ROWS,
+    DEFAULT_MAX_CONCURRENCY,
+    SPOOL_MAX_SIZE,
+    _block_id,
+    _charset,
+    _iter_csv_blocks,
+    _spool_stream,
+)
+from .compression import compress, decompressing_stream
+from .dataformats import (
+    CSV,
+    FORMAT_CONTENT_TYPES,
+    FORMAT_METADATA_KEY,
+    PARQUET,
+    deserialize_dataframe,
+    format_from_path,
+    iter_dataframe_chunks,
+    serialize_dataframe,
+)
+from .perf import (
+    PHASE_DOWNLOAD,
+    PHASE_READ,
+    PHASE_SERIALIZE,
+    PHASE_UPLOAD,
+    profile_add,
+    profile_iter,
+    profile_span,
+    run_profiled,
+)
+
+if TYPE_CHECKING:
+    # The storage SDK and pandas are imported where they are first used, as in blobstorageclient
+    import pandas as pd
+    from azure.storage.blob import ContentSettings
+    from azure.storage.blob.aio import BlobClient, ContainerClient
+
+
+def _open_spooled(path: str, properties, spool, read_kwargs: dict) -> tuple:
+    """
+    Decompress a downloaded blob and pick its format.
+    Returns the format and a stream to read the dataframe from.
+    """
+    stream = decompressing_stream(spool, properties.content_settings.content_encoding)
+    data_format = format_from_path(path, properties.metadata)
+    if data_format == CSV:
+        read_kwargs.setdefault("encoding", _charset(properties.content_settings.content_type))
+    elif data_format == PARQUET and stream is not spool:
+        # Parquet needs random access, which decompressing streams do not provide
+        stream = _spool_stream(stream)
+    return data_format, stream
+
+
+def _iter_spooled(path: str, properties, spool, chunksize: int, read_kwargs: dict):
+    data_format, stream = _open_spooled(path, properties, spool, read_kwargs)
+    with spool, stream:
+        for chunk in profile_iter(
+            iter_dataframe_chunks(stream, data_format, chunksize, **read_kwargs), PHASE_READ
+        ):
+            profile_add(rows_in=len(chunk))
+            yield chunk
+
+
+def _read_spooled(path: str, properties, spool, read_kwargs: dict) -> pd.DataFrame:
+    data_format, stream = _open_spooled(path, properties, spool, read_kwargs)
+    with spool, stream, profile_span(PHASE_READ):
+        df = deserialize_dataframe(stream, data_format, **read_kwargs)
+    profile_add(rows_in=len(df))
+    return df
+
+
+async def gather_bounded(awaitables, limit: int) -> list:
+    """
+    Await all the awaitables with at most limit running at a time.
+    Returns their results in order.
+    """
+    slots = asyncio.Semaphore(limit)
+
+    async def run(awaitable):
+        async with slots:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
+
+
+class AsyncBlobStorageClient:
+    """
+    Class to interact with Azure Blob Storage from coroutines.
+
+    Network I/O is awaited on the event loop, while parsing, serializing and
+    compressing dataframes runs in the default executor so it does not block the loop.
+    """
+
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        compression: str = None,
+        compression_level: int = None,
+    ):
+        self.__container_client = container_client
+        self.__block_size = block_size
+        self.__max_concurrency = max_concurrency
+        self.__compression = compression
+        self.__compression_level = compression_level
+
+    async def close(self):
+        await self.__container_client.close()
+
+    async def download_blob_spool(self, path: str, byte_range: tuple = None, header_size: int = 0) -> tuple:
+        """
+        Download a file chunk by chunk into a spooled temporary file, which stays
+        in memory up to SPOOL_MAX_SIZE bytes and spills to disk above.
+        Returns the blob properties and the spool, still compressed if the blob is.
+        With byte_range, a (start, end) tuple, only that range of an uncompressed blob
+        is downloaded, preceded by its first header_size bytes.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        with profile_span(PHASE_DOWNLOAD):
+            # Decompress after the download rather than in the transport, as the sync client does
+            if byte_range is None:
+                stream_downloader = await blob.download_blob(decompress=False)
+            else:
+                start, end = byte_range
+                if header_size:
+                    header_downloader = await blob.download_blob(offset=0, length=header_size, decompress=False)
+                    spool.write(await header_downloader.readall())
+                stream_downloader = await blob.download_blob(offset=start, length=end - start, decompress=False)
+            async for chunk in stream_downloader.chunks():
+                spool.write(chunk)
+        profile_add(bytes_in=spool.tell())
+        spool.seek(0)
+        properties = stream_downloader.properties
+        if byte_range is not None and properties.content_settings.content_encoding:
+            spool.close()
+            raise ValueError(f"Byte ranges of {path} cannot be read, it is compressed")
+        return properties, spool
+
+    async def download_pd_dataframe(self, path: str, **read_kwargs) -> pd.DataFrame:
+        """
+        Download a file from Azure Blob Storage into a pandas dataframe.
+        The format is picked from the blob extension or its format metadata.
+        """
+        properties, spool = await self.download_blob_spool(path)
+        return await run_profiled(_read_spooled, path, properties, spool, read_kwargs)
+
+    async def iter_pd_dataframe(
+        self,
+        path: str,
+        chunksize: int = DEFAULT_CHUNK_ROWS,
+        byte_range: tuple = None,
+        header_size: int = 0,
+        **read_kwargs,
+    ):
+        """
+        Download a file from Azure Blob Storage and return an iterator of pandas dataframes
+        over it. The iterator parses the file as it is consumed, so consume it in an
+        executor, e.g. with run_profiled, to keep the event loop free.
+        With byte_range, only the rows of that line aligned range of a CSV file are read,
+        as BlobStorageClient.iter_pd_dataframe.
+        """
+        properties, spool = await self.download_blob_spool(path, byte_range, header_size)
+        if byte_range is not None and format_from_path(path, properties.metadata) != CSV:
+            spool.close()
+            raise ValueError(f"Byte ranges of {path} cannot be read, it is not CSV")
+        return _iter_spooled(path, properties, spool, chunksize, read_kwargs)
+
+    async def download_pd_dataframes(self, paths: list, max_concurrency: int = None, **read_kwargs) -> list:
+        """
+        Download many files concurrently into pandas dataframes, in the order of the paths.
+        """
+        return await gather_bounded(
+            [self.download_pd_dataframe(path, **read_kwargs) for path in paths],
+            max_concurrency or self.__max_concurrency,
+        )
+
+    async def upload_pd_dataframe(
+        self, df: pd.DataFrame, path: str, metadata: dict = None, data_format: str = None
+    ):
+        """
+        Upload a pandas dataframe to Azure Blob Storage, as BlobStorageClient.upload_pd_dataframe.
+        """
+        from azure.storage.blob import ContentSettings
+
+        data_format = data_format or format_from_path(path)
+        content_settings = ContentSettings(
+            content_type=FORMAT_CONTENT_TYPES[data_format],
+            content_encoding=self.__compression,
+        )
+        profile_add(rows_out=len(df))
+        if data_format == CSV:
+            content_settings.content_type = f"{FORMAT_CONTENT_TYPES[CSV]}; charset=utf-8"
+            blocks = map(self.__compress, _iter_csv_blocks(df, self.__block_size))
+            blocks = profile_iter(blocks, PHASE_SERIALIZE)
+            await self.upload_blocks(blocks, path, metadata, content_settings)
+            return
+        metadata = {**(metadata or {}), FORMAT_METADATA_KEY: data_format}
+        content = await run_profiled(self.__serialize, df, data_format)
+        await self.upload_blob_content(
+            content, path, metadata=metadata, content_settings=content_settings
+        )
+
+    async def upload_pd_dataframes(self, dataframes: dict, max_concurrency: int = None):
+        """
+        Upload many pandas dataframes concurrently, given as a dict of path to dataframe.
+        """
+        await gather_bounded(
+            [self.upload_pd_dataframe(df, path) for path, df in dataframes.items()],
+            max_concurrency or self.__max_concurrency,
+        )
+
+    async def upload_blob_content(
+        self, content, path: str, metadata: dict = None, content_settings: ContentSettings = None
+    ):
+        """
+        Upload a file as text or bytes to Azure Blob Storage.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        with profile_span(PHASE_UPLOAD):
+            await blob.upload_blob(
+                content,
+                overwrite=True,
+                metadata=metadata,
+                content_settings=content_settings,
+                max_concurrency=self.__max_concurrency,
+            )
+        profile_add(bytes_out=len(content))
+
+    async def upload_blocks(
+        self, blocks, path: str, metadata: dict = None, content_settings: ContentSettings = None
+    ):
+        """
+        Upload an iterable of byte blocks as one file to Azure Blob Storage.
+        Blocks are produced in the executor and staged concurrently, with at most
+        max_concurrency blocks held in memory waiting to be staged.
+        A single block is uploaded with one request instead.
+        """
+        from azure.storage.blob import BlobBlock
+
+        blocks = iter(blocks)
+        first_block = await run_profiled(next, blocks, b"")
+        second_block = await run_profiled(next, blocks, None)
+        if second_block is None:
+            await self.upload_blob_content(
+                first_block, path, metadata=metadata, content_settings=content_settings
+            )
+            return
+
+        blocks = chain([first_block, second_block], blocks)
+        del first_block, second_block
+
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        slots = asyncio.Semaphore(self.__max_concurrency)
+        block_list = []
+        tasks = []
+
+        async def stage(block_id: str, block: bytes):
+            try:
+                await blob.stage_block(block_id, block)
+            finally:
+                slots.release()
+
+        with profile_span(PHASE_UPLOAD):
+            try:
+                while True:
+                    await slots.acquire()
+                    block = await run_profiled(next, blocks, None)
+                    if block is None:
+                        break
+                    block_id = _block_id(len(block_list))
+                    tasks.append(asyncio.create_task(stage(block_id, block)))
+                    block_list.append(BlobBlock(block_id=block_id))
+                    profile_add(bytes_out=len(block))
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            await blob.commit_block_list(
+                block_list, metadata=metadata, content_settings=content_settings
+            )
+
+    async def get_blob_properties(self, path: str):
+        """
+        Get the properties of a file in Azure Blob Storage, None if it does not exist.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        try:
+            return await blob.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+    async def delete_blob(self, path: str):
+        """
+        Delete a file in Azure Blob Storage if it exists.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        try:
+            await blob.delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+    def __serialize(self, df: pd.DataFrame, data_format: str) -> bytes:
+        with profile_span(PHASE_SERIALIZE):
+            return self.__compress(serialize_dataframe(df, data_format))
+
+    def __compress(self, data: bytes) -> bytes:
+        if not self.__compression:
+            return data
+        return compress(data, self.__compression, self.__compression_level)
@@ -2,25 +2,138 @@
 Interaction with Azure Blob Storage.
 """
 
-import datetime
-from telnetlib import STATUS
+from __future__ import annotations
+
+import base64
+import shutil
+import threading
 import time
-from io import BytesIO, TextIOWrapper
+from concurrent.futures import ThreadPoolExecutor
+from io import BufferedReader, TextIOWrapper
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # The storage SDK and pandas are imported where they are first used,
+    # so loading a function that only needs part of this module stays fast
+    import pandas as pd
+    from azure.storage.blob import BlobClient, ContainerClient, ContentSettings
 
-import dateutil.parser as dt
-import pandas as pd
-from azure.storage.blob import BlobClient, ContainerClient
+from .dataformats import (
+    CSV,
+    FORMAT_CONTENT_TYPES,
+    FORMAT_METADATA_KEY,
+    PARQUET,
+    deserialize_dataframe,
+    format_from_path,
+    iter_dataframe_chunks,
+    serialize_dataframe,
+)
+from .compression import compress, decompressing_stream
+from .perf import (
+    PHASE_DOWNLOAD,
+    PHASE_READ,
+    PHASE_SERIALIZE,
+    PHASE_UPLOAD,
+    profile_add,
+    profile_iter,
+    profile_span,
+)
+from .streams import ChunkIteratorStream
 
 DEFAULT_ENCODING = "UTF-8-SIG"
+DEFAULT_CHUNK_ROWS = 50_000
+# Blobs that need random access (parquet) spill to disk above this size
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_RESULTS_PER_PAGE = 5000
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 4
+# Rows serialized to estimate the number of rows per block
+SIZE_ESTIMATE_ROWS = 1000
 STATUS = "Success"
+STATUS_METADATA_KEY = "status"
+DEFAULT_MOVE_CONCURRENCY = 32
+# Pending copies are polled with an exponential backoff between these delays in seconds
+COPY_POLL_INITIAL_DELAY = 0.2
+COPY_POLL_MAX_DELAY = 5.0
+# Bytes read at a time when looking for the end of a line in a blob
+LINE_SEARCH_WINDOW = 64 * 1024
+COPY_TIMEOUT = 300
+# Maximum number of sub requests in one blob batch request
+DELETE_BATCH_SIZE = 256
+
+
+def _blob_record(blob) -> dict:
+    """
+    Compact description of a listed blob.
+    """
+    return {
+        "name": blob.name,
+        "size": blob.size,
+        "etag": blob.etag,
+        "last_modified": blob.last_modified.isoformat(),
+    }
+
+
+def _iter_csv_blocks(df: pd.DataFrame, block_size: int):
+    """
+    Serialize a dataframe as CSV in row batches of about block_size bytes each.
+    """
+    sample = df.iloc[:SIZE_ESTIMATE_ROWS].to_csv(index=False, header=False)
+    bytes_per_row = max(1, len(sample.encode("utf-8")) // max(1, min(len(df), SIZE_ESTIMATE_ROWS)))
+    rows_per_block = max(1, block_size // bytes_per_row)
+    yield df.iloc[:rows_per_block].to_csv(index=False).encode("utf-8")
+    for start in range(rows_per_block, len(df), rows_per_block):
+        yield df.iloc[start : start + rows_per_block].to_csv(index=False, header=False).encode("utf-8")
+
+
+def _charset(content_type: str) -> str:
+    """
+    Text encoding from the charset parameter of a content type, e.g. "text/csv; charset=utf-8".
+    """
+    for parameter in (content_type or "").split(";")[1:]:
+        key, _, value = parameter.strip().partition("=")
+        if key.lower() == "charset" and value:
+            return value.strip('"')
+    return DEFAULT_ENCODING
+
+
+def _block_id(index: int) -> str:
+    """
+    Block ids must have the same length for every block of a blob.
+    """
+    return base64.b64encode(f"{index:010d}".encode()).decode()
+
+
+def _spool_stream(stream) -> SpooledTemporaryFile:
+    """
+    Copy a forward-only stream into a seekable spooled temporary file.
+    """
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    shutil.copyfileobj(stream, spool)
+    spool.seek(0)
+    return spool
+
 
 class BlobStorageClient:
     """
     Class to interact with Azure Blob Storage.
     """
 
-    def __init__(self, container_client: ContainerClient):
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        compression: str = None,
+        compression_level: int = None,
+    ):
         self.__container_client = container_client
+        self.__block_size = block_size
+        self.__max_concurrency = max_concurrency
+        self.__compression = compression
+        self.__compression_level = compression_level
 
     def get_csv_files(self, folder: str) -> list:
         """
@@ -32,67 +145,390 @@ class BlobStorageClient:
                 files.append(blob.name)
         return files
 
+    def walk_folder(self, folder: str, suffix: str = ".csv", include_status: bool = False) -> tuple:
+        """
+        List one level of a folder.
+        Returns the sub folder prefixes and the records of the files directly in the folder.
+        """
+        from azure.storage.blob import BlobPrefix
+
+        prefixes = []
+        records = []
+        for item in self.__container_client.walk_blobs(
+            name_starts_with=f"{folder.rstrip('/')}/",
+            delimiter="/",
+            include=["metadata"] if include_status else None,
+        ):
+            if isinstance(item, BlobPrefix):
+                prefixes.append(item.name)
+            elif item.name.endswith(suffix):
+                records.append(self.__blob_record(item, include_status))
+        return prefixes, records
+
+    def list_blob_records(
+        self,
+        prefix: str,
+        suffix: str = ".csv",
+        results_per_page: int = DEFAULT_RESULTS_PER_PAGE,
+        include_status: bool = False,
+    ):
+        """
+        List the files starting with a prefix page by page, following the continuation tokens.
+        Yields a (records, continuation_token) tuple per page, where each record holds
+        the name, size, etag and last modified time of a file, and its processing status
+        if include_status is set.
+        """
+        pages = self.__container_client.list_blobs(
+            name_starts_with=prefix,
+            results_per_page=results_per_page,
+            include=["metadata"] if include_status else None,
+        ).by_page()
+        for page in pages:
+            records = [
+                self.__blob_record(blob, include_status)
+                for blob in page
+                if blob.name.endswith(suffix)
+            ]
+            yield records, pages.continuation_token
+
+    def set_blob_status(self, path: str, status: str = STATUS):
+        """
+        Stamp a file with a processing status in its metadata, keeping its other metadata.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        metadata = blob.get_blob_properties().metadata or {}
+        blob.set_blob_metadata({**metadata, STATUS_METADATA_KEY: status})
+
+    def open_blob_stream(self, path: str, byte_range: tuple = None, header_size: int = 0) -> tuple:
+        """
+        Open a file in Azure Blob Storage for streaming reads.
+        Returns the blob properties and a binary stream that downloads the content
+        one chunk at a time as it is read, decompressing it based on its Content-Encoding.
+        With byte_range, a (start, end) tuple, only that range of an uncompressed blob
+        is read, preceded by its first header_size bytes, e.g. the header line of a CSV file.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        # Decompress here rather than in the transport, so ranged chunks stay raw bytes
+        with profile_span(PHASE_DOWNLOAD):
+            if byte_range is None:
+                stream_downloader = blob.download_blob(decompress=False)
+            else:
+                start, end = byte_range
+                stream_downloader = blob.download_blob(offset=start, length=end - start, decompress=False)
+        properties = stream_downloader.properties
+        chunks = profile_iter(stream_downloader.chunks(), PHASE_DOWNLOAD)
+        if byte_range is not None:
+            if properties.content_settings.content_encoding:
+                raise ValueError(f"Byte ranges of {path} cannot be read, it is compressed")
+            profile_add(bytes_in=stream_downloader.size)
+            if header_size:
+                with profile_span(PHASE_DOWNLOAD):
+                    header = blob.download_blob(offset=0, length=header_size, decompress=False).readall()
+                profile_add(bytes_in=len(header))
+                chunks = chain([header], chunks)
+            return properties, BufferedReader(ChunkIteratorStream(chunks))
+        profile_add(bytes_in=properties.size)
+        stream = BufferedReader(ChunkIteratorStream(chunks))
+        stream = decompressing_stream(stream, properties.content_settings.content_encoding)
+        return properties, stream
+
+    def find_line_end(self, path: str, offset: int, window: int = LINE_SEARCH_WINDOW) -> int:
+        """
+        Offset just past the first newline of a file at or after offset, found with
+        ranged reads of window bytes. None when there is no newline after offset.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        while True:
+            with profile_span(PHASE_DOWNLOAD):
+                content = blob.download_blob(offset=offset, length=window, decompress=False).readall()
+            profile_add(bytes_in=len(content))
+            position = content.find(b"\n")
+            if position >= 0:
+                return offset + position + 1
+            if len(content) < window:
+                return None
+            offset += len(content)
+
     def download_blob_content(self, path: str) -> TextIOWrapper:
         """
         Download a file as text from Azure Blob Storage.
+        The content is streamed, so memory use does not grow with the blob size.
+        """
+        properties, stream = self.open_blob_stream(path)
+        encoding = _charset(properties.content_settings.content_type)
+        return TextIOWrapper(stream, encoding=encoding)
+
+    def download_pd_dataframe(self, path: str, **read_kwargs) -> pd.DataFrame:
+        """
+        Download a file from Azure Blob Storage into a pandas dataframe.
+        The format is picked from the blob extension or its format metadata.
+        """
+        properties, stream = self.open_blob_stream(path)
+        data_format = format_from_path(path, properties.metadata)
+        if data_format == CSV:
+            read_kwargs.setdefault("encoding", _charset(properties.content_settings.content_type))
+        elif data_format == PARQUET:
+            stream = _spool_stream(stream)
+        with stream, profile_span(PHASE_READ):
+            df = deserialize_dataframe(stream, data_format, **read_kwargs)
+        profile_add(rows_in=len(df))
+        return df
+
+    def iter_pd_dataframe(
+        self,
+        path: str,
+        chunksize: int = DEFAULT_CHUNK_ROWS,
+        byte_range: tuple = None,
+        header_size: int = 0,
+        **read_kwargs,
+    ):
+        """
+        Download a file from Azure Blob Storage as an iterator of pandas dataframes,
+        so peak memory is bounded by the chunk size instead of the blob size.
+        With byte_range, only the rows of that line aligned range of a CSV file are read,
+        header_size is the size of its header line.
+        """
+        properties, stream = self.open_blob_stream(path, byte_range, header_size)
+        data_format = format_from_path(path, properties.metadata)
+        if byte_range is not None and data_format != CSV:
+            stream.close()
+            raise ValueError(f"Byte ranges of {path} cannot be read, it is not CSV")
+        if data_format == CSV:
+            read_kwargs.setdefault("encoding", _charset(properties.content_settings.content_type))
+        elif data_format == PARQUET:
+            stream = _spool_stream(stream)
+        with stream:
+            for chunk in profile_iter(
+                iter_dataframe_chunks(stream, data_format, chunksize, **read_kwargs), PHASE_READ
+            ):
+                profile_add(rows_in=len(chunk))
+                yield chunk
+
+    def upload_pd_dataframe(
+        self, df: pd.DataFrame, path: str, metadata: dict = None, data_format: str = None
+    ):
+        """
+        Upload a pandas dataframe to Azure Blob Storage.
+        The format defaults to the one matching the blob extension, CSV otherwise.
+        The content is compressed with the codec of the client, if any, and
+        the codec is recorded in the Content-Encoding of the blob.
+        """
+        from azure.storage.blob import ContentSettings
+
+        data_format = data_format or format_from_path(path)
+        content_settings = ContentSettings(
+            content_type=FORMAT_CONTENT_TYPES[data_format],
+            content_encoding=self.__compression,
+        )
+        profile_add(rows_out=len(df))
+        if data_format == CSV:
+            content_settings.content_type = f"{FORMAT_CONTENT_TYPES[CSV]}; charset=utf-8"
+            blocks = map(self.__compress, _iter_csv_blocks(df, self.__block_size))
+            blocks = profile_iter(blocks, PHASE_SERIALIZE)
+            self.upload_blocks(blocks, path, metadata, content_settings)
+            return
+        metadata = {**(metadata or {}), FORMAT_METADATA_KEY: data_format}
+        with profile_span(PHASE_SERIALIZE):
+            content = self.__compress(serialize_dataframe(df, data_format))
+        self.upload_blob_content(content, path, metadata=metadata, content_settings=content_settings)
+
+    def __compress(self, data: bytes) -> bytes:
+        if not self.__compression:
+            return data
+        return compress(data, self.__compression, self.__compression_level)
+
+    def upload_blob_content(
+        self, content, path: str, metadata: dict = None, content_settings: ContentSettings = None
+    ):
+        """
+        Upload a file as text or bytes to Azure Blob Storage.
         """
         blob: BlobClient = self.__container_client.get_blob_client(path)
-        stream_downloader = blob.download_blob()
-        encoding = stream_downloader.properties.content_settings.content_encoding
-        encoding = encoding if encoding else DEFAULT_ENCODING
-        contents = stream_downloader.readall()
-        stream = TextIOWrapper(BytesIO(contents), encoding=encoding)
-        return stream
+        with profile_span(PHASE_UPLOAD):
+            blob.upload_blob(
+                content,
+                overwrite=True,
+                metadata=metadata,
+                content_settings=content_settings,
+                max_concurrency=self.__max_concurrency,
+            )
+        profile_add(bytes_out=len(content))
 
-    def upload_pd_dataframe(self, df: pd.DataFrame, path: str, metadata: dict = None):
+    def upload_blocks(
+        self, blocks, path: str, metadata: dict = None, content_settings: ContentSettings = None
+    ):
         """
-        Upload a pandas dataframe as a csv file to Azure Blob Storage.
+        Upload an iterable of byte blocks as one file to Azure Blob Storage.
+        Blocks are staged in parallel with stage_block and committed with commit_block_list.
+        At most max_concurrency blocks are held in memory waiting to be staged,
+        so peak memory is about block size x max_concurrency.
+        A single block is uploaded with one request instead.
         """
-        csv_buffer = df.to_csv(index=False)
-        self.upload_blob_content(csv_buffer, path, metadata=metadata)
+        from azure.storage.blob import BlobBlock
+
+        blocks = iter(blocks)
+        first_block = next(blocks, b"")
+        second_block = next(blocks, None)
+        if second_block is None:
+            self.upload_blob_content(
+                first_block, path, metadata=metadata, content_settings=content_settings
+            )
+            return
 
-    def upload_blob_content(self, content: str, path: str, metadata: dict = None):
+        blocks = chain([first_block, second_block], blocks)
+        del first_block, second_block
+
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        slots = threading.BoundedSemaphore(self.__max_concurrency)
+        block_list = []
+        futures = []
+        with profile_span(PHASE_UPLOAD), ThreadPoolExecutor(
+            max_workers=self.__max_concurrency
+        ) as executor:
+            for index, block in enumerate(blocks):
+                slots.acquire()
+                block_id = _block_id(index)
+                future = executor.submit(blob.stage_block, block_id, block)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+                block_list.append(BlobBlock(block_id=block_id))
+                profile_add(bytes_out=len(block))
+            for future in futures:
+                future.result()
+            blob.commit_block_list(block_list, metadata=metadata, content_settings=content_settings)
+
+    def get_blob_properties(self, path: str):
         """
-        Upload a file as text to Azure Blob Storage.
+        Get the properties of a file in Azure Blob Storage, None if it does not exist.
         """
+        from azure.core.exceptions import ResourceNotFoundError
+
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        try:
+            return blob.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+    def delete_blob(self, path: str):
+        """
+        Delete a file in Azure Blob Storage if it exists.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+
         blob: BlobClient = self.__container_client.get_blob_client(path)
-        blob.upload_blob(content, overwrite=True, metadata=metadata)
+        try:
+            blob.delete_blob()
+        except ResourceNotFoundError:
+            pass
 
     def move_blob(self, source_path: str, target_folder: str):
         """
         Move a blob in the container to a target folder.
         """
-        target_path = f"{target_folder}/{source_path}"
-        target_blob: BlobClient = self.__container_client.get_blob_client(target_path)
-        source_url = f"{self.__container_client.url}/{source_path}"
-        target_blob.start_copy_from_url(source_url)
-        self.__wait_for_copy(target_blob)
+        (result,) = self.move_blobs([source_path], target_folder)
+        if not result["moved"]:
+            raise RuntimeError(f"Failed to move {source_path}: {result['error']}")
 
-        source_blob: BlobClient = self.__container_client.get_blob_client(source_path)
-        source_blob.delete_blob()
-
-    def __wait_for_copy(self, blob: BlobClient):
+    def move_blobs(
+        self,
+        source_paths: list,
+        target_folder: str,
+        max_workers: int = DEFAULT_MOVE_CONCURRENCY,
+        timeout: float = COPY_TIMEOUT,
+    ) -> list:
         """
-        Wait for the start_copy_from_url method to be completed
-        as per: https://github.com/Azure/azure-sdk-for-python/issues/7043
+        Move blobs in the container to a target folder.
+        The server side copies are started concurrently, the pending ones are polled
+        together with an exponential backoff and the sources are deleted in batches.
+        Returns a result per blob with its source and target paths, whether it was moved
+        and the error if not. A failed blob does not stop the others.
         """
-        count = 0
-        props = blob.get_blob_properties()
-        while props.copy.status == "pending":
-            count = count + 1
-            if count > 10:
-                raise TimeoutError("Timed out waiting for async copy to complete.")
-            time.sleep(5)
-            props = blob.get_blob_properties()
-        return props
+        target_folder = target_folder.rstrip("/")
+        results = [
+            {"source": path, "target": f"{target_folder}/{path}", "moved": False, "error": None}
+            for path in source_paths
+        ]
+        if not results:
+            return results
+
+        def start_copy(result: dict) -> str:
+            source_url = self.__container_client.get_blob_client(result["source"]).url
+            target_blob: BlobClient = self.__container_client.get_blob_client(result["target"])
+            # Copies within a storage account usually complete before the call returns
+            return target_blob.start_copy_from_url(source_url)["copy_status"]
+
+        def copy_status(result: dict) -> str:
+            target_blob: BlobClient = self.__container_client.get_blob_client(result["target"])
+            return target_blob.get_blob_properties().copy.status
 
-    def __get_blob_status(self, blob_metadata: str) -> str:
-        return None if not blob_metadata else blob_metadata.get(STATUS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = self.__track_copies(executor, start_copy, results)
+            delay = COPY_POLL_INITIAL_DELAY
+            deadline = time.monotonic() + timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    for result in pending:
+                        result["error"] = "Timed out waiting for the copy to complete"
+                    break
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, COPY_POLL_MAX_DELAY)
+                pending = self.__track_copies(executor, copy_status, pending)
 
-    def __get_timestamp(self, f_date: str, f_time: str) -> datetime:
+            copied = [result for result in results if result["error"] is None]
+            self.__delete_sources(executor, copied)
+        return results
+
+    def __track_copies(self, executor: ThreadPoolExecutor, get_status, results: list) -> list:
         """
-        Date looks like this: YYYYMMDD and time look like this: HHMM
-        dt.parse requires the timestamp to be like this: "2020-03-27T08:49:30.000Z"
+        Get the copy status of each result in parallel, record the failed copies
+        and return the results of the copies still pending.
         """
-        timestamp = f"{f_date[:4]}-{f_date[4:6]}-{f_date[6:8]}T{f_time[:2]}:{f_time[2:4]}:00.000Z"
-        return dt.parse(timestamp)
+        pending = []
+        futures = [(result, executor.submit(get_status, result)) for result in results]
+        for result, future in futures:
+            try:
+                status = future.result()
+            except Exception as e:
+                result["error"] = str(e)
+                continue
+            if status == "pending":
+                pending.append(result)
+            elif status != "success":
+                result["error"] = f"Copy {status}"
+        return pending
+
+    def __delete_sources(self, executor: ThreadPoolExecutor, results: list):
+        """
+        Delete the sources of the copied blobs with batch requests,
+        falling back to one request per blob when a batch fails as a whole.
+        Sources that no longer exist count as deleted.
+        """
+        for start in range(0, len(results), DELETE_BATCH_SIZE):
+            batch = results[start : start + DELETE_BATCH_SIZE]
+            try:
+                responses = self.__container_client.delete_blobs(
+                    *[result["source"] for result in batch], raise_on_any_failure=False
+                )
+                for result, response in zip(batch, responses):
+                    if response.status_code in (202, 404):
+                        result["moved"] = True
+                    else:
+                        result["error"] = f"Delete failed with status {response.status_code}"
+            except Exception:
+                futures = [(result, executor.submit(self.delete_blob, result["source"])) for result in batch]
+                for result, future in futures:
+                    try:
+                        future.result()
+                        result["moved"] = True
+                    except Exception as e:
+                        result["error"] = str(e)
+
+    def __blob_record(self, blob, include_status: bool) -> dict:
+        record = _blob_record(blob)
+        if include_status:
+            record["status"] = self.__get_blob_status(blob.metadata)
+        return record
+
+    def __get_blob_status(self, blob_metadata: dict) -> str:
+        return None if not blob_metadata else blob_metadata.get(STATUS_METADATA_KEY)
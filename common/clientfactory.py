@@ -0,0 +1,201 @@
+"""
+Process-wide cache of Azure Blob Storage clients.
+The storage SDK is imported when the first client is created.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+
+from .asyncblobstorageclient import AsyncBlobStorageClient
+from .blobstorageclient import DEFAULT_BLOCK_SIZE, DEFAULT_MAX_CONCURRENCY, BlobStorageClient
+from .compression import get_compression
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+_lock = threading.Lock()
+# connection string -> (BlobServiceClient, requests.Session)
+_service_clients = {}
+# (connection string, container, event loop) -> (AsyncBlobStorageClient, aio BlobServiceClient)
+_async_clients = {}
+# (connection string, container) -> BlobStorageClient
+_clients = {}
+
+
+def _pool_size() -> int:
+    return int(os.getenv("DataStoragePoolSize", DEFAULT_POOL_SIZE))
+
+
+def _chunk_size() -> int:
+    return int(os.getenv("DataStorageChunkSize", DEFAULT_CHUNK_SIZE))
+
+
+def _upload_block_size() -> int:
+    return int(os.getenv("UploadBlockSize", DEFAULT_BLOCK_SIZE))
+
+
+def _upload_max_concurrency() -> int:
+    return int(os.getenv("UploadMaxConcurrency", DEFAULT_MAX_CONCURRENCY))
+
+
+def _create_service_client(connection_string: str):
+    """
+    Create a BlobServiceClient with its own pooled HTTP session, sized by
+    the DataStoragePoolSize app setting. Downloads are fetched in chunks of
+    DataStorageChunkSize bytes, which bounds the memory of streaming reads.
+    """
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+    from azure.storage.blob import BlobServiceClient
+
+    pool_size = _pool_size()
+    chunk_size = _chunk_size()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    transport = RequestsTransport(session=session, session_owner=False)
+    service_client = BlobServiceClient.from_connection_string(
+        connection_string,
+        transport=transport,
+        max_single_get_size=chunk_size,
+        max_chunk_get_size=chunk_size,
+    )
+    return service_client, session
+
+
+def get_blob_storage_client(
+    connection_string: str = None, container: str = None
+) -> BlobStorageClient:
+    """
+    Get the BlobStorageClient shared by every activity in this worker process.
+    Defaults to the DataStorage connection string and DataContainer container.
+    """
+    connection_string = connection_string or os.getenv("DataStorage")
+    container = container or os.getenv("DataContainer")
+    key = (connection_string, container)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            if connection_string not in _service_clients:
+                _service_clients[connection_string] = _create_service_client(
+                    connection_string
+                )
+            service_client, _ = _service_clients[connection_string]
+            compression, compression_level = get_compression()
+            client = BlobStorageClient(
+                service_client.get_container_client(container),
+                block_size=_upload_block_size(),
+                max_concurrency=_upload_max_concurrency(),
+                compression=compression,
+                compression_level=compression_level,
+            )
+            _clients[key] = client
+    return client
+
+
+def use_container_client(
+    container_client, connection_string: str = None, container: str = None
+) -> BlobStorageClient:
+    """
+    Make get_blob_storage_client return a client over the given container client
+    instead of one built from the connection string, e.g. a local stand-in used to
+    run the activities without a storage account.
+    """
+    connection_string = connection_string or os.getenv("DataStorage")
+    container = container or os.getenv("DataContainer")
+    compression, compression_level = get_compression()
+    client = BlobStorageClient(
+        container_client,
+        block_size=_upload_block_size(),
+        max_concurrency=_upload_max_concurrency(),
+        compression=compression,
+        compression_level=compression_level,
+    )
+    with _lock:
+        _clients[(connection_string, container)] = client
+    return client
+
+
+def get_async_blob_storage_client(
+    connection_string: str = None, container: str = None
+) -> AsyncBlobStorageClient:
+    """
+    Get the AsyncBlobStorageClient shared by every async activity running on the
+    current event loop. Must be called from a coroutine, as aio clients are bound
+    to the event loop they were created on.
+    """
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+    connection_string = connection_string or os.getenv("DataStorage")
+    container = container or os.getenv("DataContainer")
+    loop = asyncio.get_running_loop()
+    key = (connection_string, container, loop)
+
+    with _lock:
+        entry = _async_clients.get(key)
+        if entry is None:
+            chunk_size = _chunk_size()
+            service_client = AsyncBlobServiceClient.from_connection_string(
+                connection_string,
+                max_single_get_size=chunk_size,
+                max_chunk_get_size=chunk_size,
+            )
+            compression, compression_level = get_compression()
+            client = AsyncBlobStorageClient(
+                service_client.get_container_client(container),
+                block_size=_upload_block_size(),
+                max_concurrency=_upload_max_concurrency(),
+                compression=compression,
+                compression_level=compression_level,
+            )
+            entry = _async_clients[key] = (client, service_client)
+    return entry[0]
+
+
+def reset_blob_storage_client(connection_string: str = None):
+    """
+    Drop the cached clients for a connection string and close their HTTP session,
+    so the next get_blob_storage_client call builds them from scratch.
+    """
+    connection_string = connection_string or os.getenv("DataStorage")
+    with _lock:
+        for key in [key for key in _clients if key[0] == connection_string]:
+            del _clients[key]
+        entry = _service_clients.pop(connection_string, None)
+        async_entries = [
+            (key[2], _async_clients.pop(key)[1])
+            for key in list(_async_clients)
+            if key[0] == connection_string
+        ]
+    if entry is not None:
+        service_client, session = entry
+        service_client.close()
+        session.close()
+    # Async clients are closed on the event loop they belong to
+    for loop, service_client in async_entries:
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(service_client.close(), loop)
+
+
+def reset_on_auth_error(error: Exception, connection_string: str = None) -> bool:
+    """
+    Reset the cached clients if the error is an authentication failure,
+    e.g. after the storage account keys were rotated.
+    """
+    from azure.core.exceptions import ClientAuthenticationError
+
+    if not isinstance(error, ClientAuthenticationError):
+        return False
+    logging.warning("Authentication failed, resetting cached blob storage clients")
+    reset_blob_storage_client(connection_string)
+    return True
@@ -0,0 +1,61 @@
+"""
+Compression codecs for blob content, identified by the Content-Encoding header.
+"""
+
+import gzip
+import os
+import zlib
+
+GZIP = "gzip"
+ZSTD = "zstd"
+IDENTITY = "identity"
+
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+
+def get_compression() -> tuple:
+    """
+    Codec and level used to compress the step outputs, set per deployment with the
+    DataCompression (none, gzip or zstd) and DataCompressionLevel app settings.
+    Returns (None, None) when outputs are stored uncompressed.
+    """
+    codec = os.getenv("DataCompression", "none").lower()
+    if codec in ("", "none", IDENTITY):
+        return None, None
+    if codec not in DEFAULT_LEVELS:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+    level = os.getenv("DataCompressionLevel")
+    return codec, int(level) if level else DEFAULT_LEVELS[codec]
+
+
+def compress(data: bytes, codec: str, level: int = None) -> bytes:
+    """
+    Compress data as one gzip member or zstd frame. Members and frames can be
+    concatenated, so blocks compressed separately still form a valid file.
+    """
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == GZIP:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if codec == ZSTD:
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def decompressing_stream(stream, content_encoding: str):
+    """
+    Wrap a binary stream to decompress it while it is read, based on the
+    Content-Encoding of the blob. Streams without an encoding are returned as is.
+    """
+    if not content_encoding or content_encoding.lower() == IDENTITY:
+        return stream
+    content_encoding = content_encoding.lower()
+    if content_encoding == GZIP:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
@@ -0,0 +1,135 @@
+"""
+Cost model of the processing time of a file, used to schedule the largest files first
+and to pack small files into groups of about the same processing time.
+
+The model is linear in the size of the file: a fixed number of seconds per file plus
+a number of seconds per byte. It is fitted on the step profiles of the last run and
+saved as a small JSON blob, with defaults until a run was profiled.
+"""
+
+import datetime
+import heapq
+import json
+import logging
+import math
+import os
+
+from .blobstorageclient import BlobStorageClient
+
+COST_MODEL_FILENAME = "cost-model.json"
+COST_MODEL_VERSION = 1
+# Defaults until a run was profiled: about two seconds per file and 20 MB per second
+DEFAULT_FIXED_SECONDS = 2.0
+DEFAULT_SECONDS_PER_BYTE = 1 / (20 * 1024 * 1024)
+# Files with fewer distinct sizes do not fit a line, the previous model is kept
+MIN_FIT_FILES = 2
+# Below this ratio between the largest and the smallest file, sizes are too alike to
+# fit the time per byte, only the fixed time per file is refitted
+MIN_FIT_SIZE_RATIO = 2.0
+
+
+def default_cost_model() -> dict:
+    return {
+        "version": COST_MODEL_VERSION,
+        "fixed_seconds": DEFAULT_FIXED_SECONDS,
+        "seconds_per_byte": DEFAULT_SECONDS_PER_BYTE,
+        "files": 0,
+    }
+
+
+def cost_model_path(subpath: str = None) -> str:
+    """
+    Path of the cost model, in the folder of the file manifests.
+    """
+    subpath = subpath or os.getenv("ManifestDataSubpath", "manifests")
+    return f"{subpath}/{COST_MODEL_FILENAME}"
+
+
+def load_cost_model(blob_client: BlobStorageClient, path: str = None) -> dict:
+    """
+    Load the cost model saved by the last profiled run, the defaults if there is none.
+    """
+    path = path or cost_model_path()
+    try:
+        if blob_client.get_blob_properties(path) is None:
+            return default_cost_model()
+        model = json.load(blob_client.download_blob_content(path))
+        if model.get("version") != COST_MODEL_VERSION:
+            return default_cost_model()
+        return model
+    except Exception as e:
+        logging.warning(f"Ignoring cost model {path}: {e}")
+        return default_cost_model()
+
+
+def save_cost_model(blob_client: BlobStorageClient, model: dict, path: str = None) -> str:
+    """
+    Save a cost model and return its path.
+    """
+    path = path or cost_model_path()
+    blob_client.upload_blob_content(json.dumps(model, indent=2), path)
+    return path
+
+
+def estimate_cost(model: dict, size: int, range_count: int = 1) -> float:
+    """
+    Estimated seconds to process a file of size bytes. The byte ranges of a split
+    file are processed in parallel, so only the share of one range counts.
+    """
+    return model["fixed_seconds"] + model["seconds_per_byte"] * size / max(range_count, 1)
+
+
+def fit_cost_model(profiles: list, previous: dict = None) -> dict:
+    """
+    Fit the cost model on the step profiles of a run, grouped per file as returned by
+    load_run_profiles: the seconds of all the steps of a file against the bytes its
+    step 1 read, with a least squares line. The previous model is kept when the files
+    are too few to fit one, and its time per byte when their sizes are too alike.
+    """
+    previous = previous or default_cost_model()
+    points = []
+    for file_profiles in profiles:
+        size = sum(profile.get("bytes_in") or 0 for profile in file_profiles if profile["step"] == "step1")
+        if size and not any(profile.get("cache_hit") for profile in file_profiles):
+            points.append((size, sum(profile["seconds"] for profile in file_profiles)))
+    if len({size for size, _ in points}) < MIN_FIT_FILES:
+        return previous
+
+    mean_size = sum(size for size, _ in points) / len(points)
+    mean_seconds = sum(seconds for _, seconds in points) / len(points)
+    sizes = [size for size, _ in points]
+    if max(sizes) < MIN_FIT_SIZE_RATIO * min(sizes):
+        seconds_per_byte = previous["seconds_per_byte"]
+    else:
+        variance = sum((size - mean_size) ** 2 for size in sizes)
+        covariance = sum((size - mean_size) * (seconds - mean_seconds) for size, seconds in points)
+        seconds_per_byte = max(covariance / variance, 0.0)
+    return {
+        "version": COST_MODEL_VERSION,
+        "fixed_seconds": max(mean_seconds - seconds_per_byte * mean_size, 0.0),
+        "seconds_per_byte": seconds_per_byte,
+        "files": len(points),
+        "fitted": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def pack_groups(costs: list, capacity: float) -> list:
+    """
+    Pack items that cost less than capacity into balanced groups of about capacity:
+    as many groups as their total cost needs, each item going to the least loaded
+    group, costliest first. Costlier items get a group of their own.
+    Returns the groups as lists of item indexes, costliest group first.
+    """
+    order = sorted(range(len(costs)), key=lambda index: -costs[index])
+    groups = [[index] for index in order if costs[index] >= capacity]
+    small = [index for index in order if costs[index] < capacity]
+    if small:
+        group_count = math.ceil(sum(costs[index] for index in small) / capacity)
+        heap = [(0.0, position) for position in range(group_count)]
+        small_groups = [[] for _ in range(group_count)]
+        for index in small:
+            load, position = heapq.heappop(heap)
+            small_groups[position].append(index)
+            heapq.heappush(heap, (load + costs[index], position))
+        groups.extend(group for group in small_groups if group)
+    return sorted(groups, key=lambda group: -sum(costs[index] for index in group))
@@ -0,0 +1,183 @@
+"""
+Serialization formats for the DataFrames passed between pipeline steps.
+"""
+
+from __future__ import annotations
+
+import os
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CSV = "csv"
+PARQUET = "parquet"
+ARROW = "arrow"
+
+FORMAT_EXTENSIONS = {CSV: ".csv", PARQUET: ".parquet", ARROW: ".arrow"}
+FORMAT_CONTENT_TYPES = {
+    CSV: "text/csv",
+    PARQUET: "application/vnd.apache.parquet",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+FORMAT_METADATA_KEY = "format"
+DEFAULT_INTERMEDIATE_FORMAT = PARQUET
+# read_csv engine parsed with pyarrow.csv, with the column types applied while parsing
+PYARROW_ENGINE = "pyarrow"
+
+
+def get_intermediate_format() -> str:
+    """
+    Format used for the step1 to step3 outputs, set per deployment with the
+    IntermediateDataFormat app setting. Raw inputs and final outputs stay CSV.
+    """
+    data_format = os.getenv("IntermediateDataFormat", DEFAULT_INTERMEDIATE_FORMAT)
+    data_format = data_format.lower()
+    if data_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported intermediate data format: {data_format}")
+    return data_format
+
+
+def format_from_path(path: str, metadata: dict = None) -> str:
+    """
+    Detect the format of a blob from its extension, falling back to the
+    format metadata written by upload_pd_dataframe and finally to CSV.
+    """
+    for data_format, extension in FORMAT_EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return data_format
+    if metadata and metadata.get(FORMAT_METADATA_KEY) in FORMAT_EXTENSIONS:
+        return metadata[FORMAT_METADATA_KEY]
+    return CSV
+
+
+def with_format_extension(path: str, data_format: str) -> str:
+    """
+    Replace the known format extension of a path with the one for data_format.
+    """
+    for extension in FORMAT_EXTENSIONS.values():
+        if path.lower().endswith(extension):
+            path = path[: -len(extension)]
+            break
+    return f"{path}{FORMAT_EXTENSIONS[data_format]}"
+
+
+def serialize_dataframe(df: pd.DataFrame, data_format: str) -> bytes:
+    """
+    Serialize a DataFrame to bytes in the given format.
+    """
+    if data_format == CSV:
+        return df.to_csv(index=False).encode("utf-8")
+    if data_format == PARQUET:
+        buffer = BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    if data_format == ARROW:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise ValueError(f"Unsupported data format: {data_format}")
+
+
+def _arrow_type(dtype: str):
+    import numpy as np
+    import pyarrow as pa
+
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    if dtype in ("string", "str", "object"):
+        return pa.string()
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def _arrow_csv_options(usecols=None, dtype=None, parse_dates=None, encoding=None) -> dict:
+    """
+    Translate the read_csv arguments used with the pyarrow engine to pyarrow.csv options.
+    Unlike read_csv, the types are applied while parsing instead of cast after
+    inference, so e.g. postal codes read as strings keep their leading zeros.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    column_types = {name: _arrow_type(value) for name, value in (dtype or {}).items()}
+    column_types.update({name: pa.timestamp("ns") for name in parse_dates or []})
+    return {
+        "read_options": csv.ReadOptions(encoding=encoding or "utf8"),
+        "convert_options": csv.ConvertOptions(
+            column_types=column_types, include_columns=list(usecols or [])
+        ),
+    }
+
+
+def _iter_arrow_csv(stream, chunksize: int, **read_kwargs):
+    import pyarrow as pa
+    from pyarrow import csv
+
+    batches = []
+    rows = 0
+    for batch in csv.open_csv(stream, **_arrow_csv_options(**read_kwargs)):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunksize:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+def deserialize_dataframe(stream, data_format: str, **read_kwargs) -> pd.DataFrame:
+    """
+    Read a DataFrame in the given format from a binary file-like object.
+    CSV is parsed with pyarrow.csv when read_kwargs has engine="pyarrow".
+    """
+    import pandas as pd
+
+    if data_format == CSV:
+        if read_kwargs.get("engine") == PYARROW_ENGINE:
+            from pyarrow import csv
+
+            del read_kwargs["engine"]
+            return csv.read_csv(stream, **_arrow_csv_options(**read_kwargs)).to_pandas()
+        return pd.read_csv(stream, **read_kwargs)
+    if data_format == PARQUET:
+        return pd.read_parquet(stream, **read_kwargs)
+    if data_format == ARROW:
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(stream).read_pandas(**read_kwargs)
+    raise ValueError(f"Unsupported data format: {data_format}")
+
+
+def iter_dataframe_chunks(stream, data_format: str, chunksize: int, **read_kwargs):
+    """
+    Read a DataFrame in the given format as an iterator of smaller DataFrames.
+    CSV is parsed chunksize rows at a time, or in blocks of at least chunksize rows
+    with the pyarrow engine, and Arrow streams one record batch
+    at a time. Parquet needs a seekable stream and is read one row group at a time.
+    """
+    import pandas as pd
+
+    if data_format == CSV:
+        if read_kwargs.get("engine") == PYARROW_ENGINE:
+            del read_kwargs["engine"]
+            yield from _iter_arrow_csv(stream, chunksize, **read_kwargs)
+            return
+        with pd.read_csv(stream, chunksize=chunksize, **read_kwargs) as reader:
+            yield from reader
+    elif data_format == PARQUET:
+        import fastparquet
+
+        parquet_file = fastparquet.ParquetFile(stream)
+        yield from parquet_file.iter_row_groups(**read_kwargs)
+    elif data_format == ARROW:
+        import pyarrow as pa
+
+        for batch in pa.ipc.open_stream(stream):
+            yield batch.to_pandas(**read_kwargs)
+    else:
+        raise ValueError(f"Unsupported data format: {data_format}")
@@ -0,0 +1,211 @@
+"""
+Lightweight timing of the phases of a step, returned with the step output.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Phase names shared by the steps
+PHASE_DOWNLOAD = "download"
+PHASE_READ = "read"
+PHASE_TRANSFORM = "transform"
+PHASE_SERIALIZE = "serialize"
+PHASE_UPLOAD = "upload"
+PHASE_CACHE = "cache"
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+DEFAULT_SLOWEST_FILES = 5
+
+_current_profile = contextvars.ContextVar("step_profile", default=None)
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    # ru_maxrss is the peak of the whole worker process, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StepProfile:
+    """
+    Wall time per phase of one step run, plus bytes and rows in and out.
+
+    Phase times are exclusive: the time spent in a nested span is counted for the
+    nested phase only, so the phases of a step add up to its total time.
+    The open spans are kept per context, so a span nests under the span open in
+    the same task or, through run_profiled, in the code that ran it in the executor.
+    """
+
+    def __init__(self, step: str, input_path: str = None):
+        self.step = step
+        self.input_path = input_path
+        self.counters = {"bytes_in": 0, "bytes_out": 0, "rows_in": 0, "rows_out": 0}
+        self.__phases = {}
+        self.__stack = contextvars.ContextVar(f"{step}_spans", default=())
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str):
+        frame = [0.0]
+        token = self.__stack.set(self.__stack.get() + (frame,))
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.__stack.reset(token)
+            parents = self.__stack.get()
+            # Spans of executor threads close concurrently
+            with self.__lock:
+                if parents:
+                    parents[-1][0] += elapsed
+                phase = self.__phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+                phase["seconds"] += elapsed - frame[0]
+                phase["calls"] += 1
+
+    def add(self, **counters):
+        with self.__lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self, **extra) -> dict:
+        """
+        JSON serializable summary, as carried in the step outputs.
+        """
+        with self.__lock:
+            phases = {name: dict(phase) for name, phase in self.__phases.items()}
+            counters = dict(self.counters)
+        return {
+            "step": self.step,
+            "input": self.input_path,
+            "seconds": time.perf_counter() - self.__start,
+            "phases": phases,
+            **counters,
+            "peak_rss_mb": _peak_rss_mb(),
+            **extra,
+        }
+
+
+@contextmanager
+def profile_step(step: str, input_path: str = None):
+    """
+    Profile a step run. The spans and counters recorded anywhere in the same
+    context, e.g. by BlobStorageClient, are added to this profile.
+    """
+    profile = StepProfile(step, input_path)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+@contextmanager
+def profile_span(name: str):
+    """
+    Time a phase of the current step, does nothing outside of profile_step.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield None
+        return
+    with profile.span(name):
+        yield profile
+
+
+def profile_add(**counters):
+    """
+    Add to the counters of the current step, e.g. profile_add(bytes_in=1024).
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(**counters)
+
+
+def profile_iter(iterable, name: str):
+    """
+    Iterate while timing each step of the iteration as a phase, e.g. the download
+    of each chunk of a stream that is consumed by another phase.
+    """
+    iterator = iter(iterable)
+    while True:
+        with profile_span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def run_profiled(func, *args, **kwargs):
+    """
+    Run a function in the default executor of the running event loop, in a copy of
+    the current context so the spans and counters it records go to the current step.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(context.run, func, *args, **kwargs)
+    )
+
+
+def percentiles(values: list, points=DEFAULT_PERCENTILES) -> dict:
+    """
+    Nearest rank percentiles and maximum of a list of numbers.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = {f"p{point}": values[max(0, -(-point * len(values) // 100) - 1)] for point in points}
+    summary["max"] = values[-1]
+    return summary
+
+
+def summarize_profiles(profiles: list, slowest: int = DEFAULT_SLOWEST_FILES) -> dict:
+    """
+    Run level summary of the step profiles of many files: percentiles of the time per
+    step and per phase, totals of the counters and the files that took the longest.
+    Profiles are the perf summaries returned by the steps, grouped per file.
+    """
+    step_seconds = {}
+    phase_seconds = {}
+    totals = {"bytes_in": 0, "bytes_out": 0, "rows_in": 0, "rows_out": 0}
+    file_seconds = {}
+    peak_rss_mb = None
+    for file_profiles in profiles:
+        for profile in file_profiles:
+            step = profile["step"]
+            step_seconds.setdefault(step, []).append(profile["seconds"])
+            for phase, timing in profile["phases"].items():
+                phase_seconds.setdefault(step, {}).setdefault(phase, []).append(timing["seconds"])
+            for name in totals:
+                totals[name] += profile.get(name) or 0
+            if profile.get("peak_rss_mb") is not None:
+                peak_rss_mb = max(peak_rss_mb or 0, profile["peak_rss_mb"])
+        if file_profiles:
+            name = file_profiles[0].get("input")
+            file_seconds[name] = file_seconds.get(name, 0.0) + sum(p["seconds"] for p in file_profiles)
+
+    return {
+        "files": len(file_seconds),
+        "steps": {step: percentiles(values) for step, values in step_seconds.items()},
+        "phases": {
+            step: {phase: percentiles(values) for phase, values in phases.items()}
+            for step, phases in phase_seconds.items()
+        },
+        **totals,
+        "peak_rss_mb": peak_rss_mb,
+        "slowest_files": [
+            {"input": name, "seconds": seconds}
+            for name, seconds in sorted(file_seconds.items(), key=lambda item: -item[1])[:slowest]
+        ],
+    }
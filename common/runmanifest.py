@@ -0,0 +1,94 @@
+"""
+Compact manifest of the results of a run, one row per file.
+
+The orchestrator saves the step results of each batch of files as a Parquet part
+next to the file manifest of the run, instead of carrying every result in its
+history and output, and returns aggregate counts and the location of the parts.
+"""
+
+from __future__ import annotations
+
+import json
+
+from .blobstorageclient import BlobStorageClient
+
+RESULTS_PART_PREFIX = "results-"
+STEP_COUNT = 4
+
+
+def results_part_path(manifest_path: str, part: int) -> str:
+    """
+    Path of one part of the run manifest, in the folder of the file manifest of the run.
+    """
+    return f"{manifest_path}/{RESULTS_PART_PREFIX}{part:05d}.parquet"
+
+
+def file_profiles(file_results: list) -> list:
+    """
+    Perf summaries returned by the steps for one file, including those of the
+    byte ranges merged by MergeRanges.
+    """
+    profiles = []
+    for result in file_results or []:
+        if result:
+            profiles.extend(result.get("range_perf") or [])
+            if result.get("perf"):
+                profiles.append(result["perf"])
+    return profiles
+
+
+def result_row(filename: str, file_results: list) -> dict:
+    """
+    Row of the run manifest for one file: whether it went through all the steps and
+    the output, row count and wall time of each step, with the perf profiles as JSON.
+    """
+    file_results = file_results or []
+    row = {
+        "filename": filename,
+        "succeeded": len(file_results) == STEP_COUNT and all(file_results),
+    }
+    for step in range(1, STEP_COUNT + 1):
+        result = (file_results[step - 1] if step <= len(file_results) else None) or {}
+        row[f"step{step}_output"] = result.get(f"step{step}_output_filename")
+        row[f"step{step}_rows"] = result.get("row_count")
+        row[f"step{step}_seconds"] = (result.get("perf") or {}).get("seconds")
+    row["perf"] = json.dumps(file_profiles(file_results))
+    return row
+
+
+def save_results_part(
+    blob_client: BlobStorageClient, manifest_path: str, part: int, filenames: list, results: list
+) -> str:
+    """
+    Save the results of a batch of files as a part of the run manifest and return its path.
+    """
+    import pandas as pd
+
+    path = results_part_path(manifest_path, part)
+    rows = [result_row(filename, file_results) for filename, file_results in zip(filenames, results)]
+    blob_client.upload_pd_dataframe(pd.DataFrame(rows), path)
+    return path
+
+
+def results_part_paths(blob_client: BlobStorageClient, manifest_path: str) -> list:
+    """
+    Paths of the parts of the run manifest saved so far, in order.
+    """
+    prefix = f"{manifest_path}/{RESULTS_PART_PREFIX}"
+    return sorted(
+        record["name"]
+        for records, _ in blob_client.list_blob_records(prefix, suffix=".parquet")
+        for record in records
+    )
+
+
+def load_run_profiles(blob_client: BlobStorageClient, manifest_path: str) -> list:
+    """
+    Perf profiles saved in the run manifest, grouped per file as summarize_profiles takes them.
+    Only the perf column of the parts is read.
+    """
+    profiles = []
+    for path in results_part_paths(blob_client, manifest_path):
+        part = blob_client.download_pd_dataframe(path, columns=["perf"])
+        profiles.extend(json.loads(perf) for perf in part["perf"])
+    return [file_profiles for file_profiles in profiles if file_profiles]
@@ -0,0 +1,136 @@
+"""
+Single pass sampling of DataFrames read as a stream of chunks.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SAMPLING_OPTIONS = ("sample_size", "weight_column", "stratify_by")
+# With stratify_by, rows kept per row of the sample before the rows are split across strata
+STRATIFIED_OVERSAMPLING = 2
+_KEY = "__reservoir_key"
+
+
+def sampling_options(params: dict) -> dict:
+    """
+    Pick the reservoir_sample options out of a step input.
+    """
+    options = {key: params[key] for key in SAMPLING_OPTIONS if params.get(key) is not None}
+    if "sample_size" in options:
+        options["sample_size"] = int(options["sample_size"])
+    return options
+
+
+def _allocate(counts: pd.Series, sample_size: int) -> pd.Series:
+    """
+    Split sample_size across strata in proportion to their row counts,
+    rounding with the largest remainder method.
+    """
+    import numpy as np
+    import pandas as pd
+
+    total = counts.sum()
+    quotas = counts.to_numpy() * min(sample_size, total) / total
+    allocation = np.floor(quotas).astype("int64")
+    shortfall = int(min(sample_size, total) - allocation.sum())
+    if shortfall > 0:
+        allocation[np.argsort(allocation - quotas, kind="stable")[:shortfall]] += 1
+    allocation = pd.Series(allocation, index=counts.index)
+    return allocation
+
+
+def _fill_shortfall(allocation: pd.Series, available: pd.Series, counts: pd.Series) -> pd.Series:
+    """
+    Cap the allocation of each stratum at the rows available for it, and give the rows
+    missing from the rare strata to the largest strata that have rows to spare.
+    """
+    import numpy as np
+
+    capped = allocation.clip(upper=available)
+    shortfall = int(allocation.sum() - capped.sum())
+    if shortfall > 0:
+        spare = (available - capped)[counts.sort_values(ascending=False, kind="stable").index]
+        spare = spare[spare > 0]
+        before = spare.cumsum() - spare
+        capped = capped.add(np.minimum(spare, (shortfall - before).clip(lower=0)), fill_value=0)
+    return capped.astype("int64")
+
+
+def reservoir_sample(
+    chunks,
+    sample_size: int,
+    weight_column: str = None,
+    stratify_by: str = None,
+    random_state=None,
+) -> tuple:
+    """
+    Take a random sample of sample_size rows without replacement in a single pass
+    over an iterable of DataFrames. Memory use depends on sample_size and the chunk
+    size, not on the total number of rows nor on the number of strata.
+
+    Every row gets a random exponential key divided by its weight (1 unless weight_column
+    is given) and the rows with the smallest keys are kept, which is a uniform sample, or
+    a weighted one as in Efraimidis and Spirakis. With stratify_by, the
+    STRATIFIED_OVERSAMPLING * sample_size rows with the smallest keys are kept and the
+    sample is split across strata in proportion to their row counts, taking the rows
+    with the smallest keys of each stratum. A stratum too rare to have its share among
+    the kept rows gets the rows kept for it, the largest strata make up the rest.
+
+    Returns the sample and the exact number of rows read.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(random_state)
+    reservoir_size = sample_size * STRATIFIED_OVERSAMPLING if stratify_by else sample_size
+    empty = None
+    reservoir = None
+    strata_counts = pd.Series(dtype="int64")
+    row_count = 0
+
+    for chunk in chunks:
+        row_count += len(chunk)
+        empty = chunk.iloc[0:0] if empty is None else empty
+        if chunk.empty:
+            continue
+
+        keys = rng.exponential(size=len(chunk))
+        if weight_column:
+            weights = chunk[weight_column].to_numpy(dtype="float64")
+            if (weights < 0).any():
+                raise ValueError(f"Negative weights in column {weight_column}")
+            with np.errstate(divide="ignore"):
+                keys = keys / weights
+        candidates = chunk.assign(**{_KEY: keys})
+
+        if stratify_by:
+            strata_counts = strata_counts.add(
+                chunk[stratify_by].value_counts(dropna=False), fill_value=0
+            )
+
+        if reservoir is not None and len(reservoir) >= reservoir_size:
+            # Only rows with a smaller key than the current largest kept key can enter
+            candidates = candidates[candidates[_KEY] < reservoir[_KEY].max()]
+        combined = candidates if reservoir is None else pd.concat([reservoir, candidates])
+        reservoir = combined.nsmallest(reservoir_size, _KEY)
+
+    if reservoir is None:
+        return (pd.DataFrame() if empty is None else empty), row_count
+
+    if stratify_by and not reservoir.empty:
+        # The kept rows of a stratum are the rows of that stratum with the smallest keys
+        counts = strata_counts.astype("int64")
+        reservoir = reservoir.sort_values(_KEY)
+        strata = reservoir.groupby(stratify_by, sort=False, dropna=False, observed=True)
+        available = strata.size().reindex(counts.index, fill_value=0)
+        allocation = _fill_shortfall(_allocate(counts, sample_size), available, counts)
+        rank = strata.cumcount().to_numpy()
+        quota = allocation.reindex(reservoir[stratify_by]).to_numpy()
+        reservoir = reservoir[rank < quota]
+
+    sample = reservoir.drop(columns=_KEY).reset_index(drop=True)
+    return sample, row_count
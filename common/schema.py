@@ -0,0 +1,139 @@
+"""
+Registry of dataset schemas, stored as a _schema.json blob next to the data files.
+
+A schema is declared once per dataset folder, by GenerateData or inferred by step0,
+so the steps parse the files with fixed column types instead of inferring them on
+every read, and can read only the columns they need.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING
+
+from .blobstorageclient import BlobStorageClient
+from .dataformats import ARROW, CSV, PARQUET, PYARROW_ENGINE
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SCHEMA_FILENAME = "_schema.json"
+SCHEMA_VERSION = 1
+# Rows read from the first file of a dataset to infer its schema
+SCHEMA_SAMPLE_ROWS = 10_000
+# String columns with at most this many distinct values, and at most this fraction
+# of distinct values per row, are read as categoricals
+DEFAULT_MAX_CATEGORIES = 1000
+DEFAULT_MAX_CATEGORY_RATIO = 0.5
+
+CATEGORY = "category"
+DATETIME = "datetime64[ns]"
+STRING = "string"
+
+
+def schema_path(folder: str) -> str:
+    """
+    Path of the schema of the dataset in a folder.
+    """
+    return f"{folder.rstrip('/')}/{SCHEMA_FILENAME}"
+
+
+def _is_datetime(values: pd.Series) -> bool:
+    import pandas as pd
+
+    try:
+        return pd.to_datetime(values, format="ISO8601").notna().all()
+    except (TypeError, ValueError):
+        return False
+
+
+def _column_dtype(values: pd.Series, max_categories: int, max_category_ratio: float) -> str:
+    from pandas.api.types import (
+        is_bool_dtype,
+        is_datetime64_any_dtype,
+        is_float_dtype,
+        is_integer_dtype,
+    )
+
+    if is_bool_dtype(values):
+        return "bool"
+    if is_integer_dtype(values):
+        return "int64"
+    if is_float_dtype(values):
+        return "float64"
+    if is_datetime64_any_dtype(values):
+        return DATETIME
+    values = values.dropna()
+    if not values.empty and _is_datetime(values):
+        return DATETIME
+    distinct = values.nunique()
+    if distinct <= max_categories and distinct <= max_category_ratio * len(values):
+        return CATEGORY
+    return STRING
+
+
+def infer_schema(
+    df: pd.DataFrame,
+    max_categories: int = DEFAULT_MAX_CATEGORIES,
+    max_category_ratio: float = DEFAULT_MAX_CATEGORY_RATIO,
+) -> dict:
+    """
+    Infer the schema of a dataset from a sample of its rows.
+    Numeric columns keep their type, ISO 8601 strings are parsed as timestamps and the
+    other string columns are categoricals when they have few distinct values.
+    """
+    return {
+        "version": SCHEMA_VERSION,
+        "columns": [
+            {"name": name, "dtype": _column_dtype(df[name], max_categories, max_category_ratio)}
+            for name in df.columns
+        ],
+    }
+
+
+def schema_columns(schema: dict) -> list:
+    """
+    Names of the columns of a schema, in file order.
+    """
+    return [column["name"] for column in schema["columns"]]
+
+
+def schema_read_kwargs(schema: dict, data_format: str = CSV, columns: list = None) -> dict:
+    """
+    Keyword arguments of BlobStorageClient.download_pd_dataframe and iter_pd_dataframe
+    that read a file of the dataset with the column types of its schema, projected on
+    columns if given. Parquet and Arrow files carry their own types, only the columns
+    of Parquet files are projected.
+    """
+    if data_format == PARQUET:
+        return {"columns": list(columns)} if columns else {}
+    if data_format == ARROW:
+        return {}
+    selected = [column for column in schema["columns"] if not columns or column["name"] in columns]
+    return {
+        "engine": PYARROW_ENGINE,
+        "usecols": [column["name"] for column in selected],
+        "dtype": {column["name"]: column["dtype"] for column in selected if column["dtype"] != DATETIME},
+        "parse_dates": [column["name"] for column in selected if column["dtype"] == DATETIME],
+    }
+
+
+def load_schema(blob_client: BlobStorageClient, path: str) -> dict:
+    """
+    Load a schema saved by save_schema, None if it does not exist.
+    """
+    if not path or blob_client.get_blob_properties(path) is None:
+        return None
+    schema = json.load(blob_client.download_blob_content(path))
+    if schema.get("version") != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported schema version {schema.get('version')} in {path}")
+    return schema
+
+
+def save_schema(blob_client: BlobStorageClient, folder: str, schema: dict) -> str:
+    """
+    Save the schema of the dataset in a folder and return its path.
+    """
+    path = schema_path(folder)
+    blob_client.upload_blob_content(json.dumps(schema, indent=2), path)
+    return path
@@ -0,0 +1,136 @@
+"""
+Memoization of step results, keyed on the input blob and the step version.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+from .blobstorageclient import BlobStorageClient
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+OUTPUT_SUFFIX = "_output_filename"
+
+
+def _content_version(properties) -> str:
+    """
+    Version of the content of a blob: its Content-MD5 and size when the service recorded
+    one, which setting metadata, e.g. the processing status, leaves unchanged. Blobs
+    uploaded in blocks have no Content-MD5, their ETag changes with their metadata.
+    """
+    content_md5 = properties.content_settings.content_md5
+    if content_md5:
+        return f"md5:{bytes(content_md5).hex()}:{properties.size}"
+    return f"etag:{properties.etag}"
+
+
+class StepCache:
+    """
+    Cache of step results stored as small index blobs.
+
+    An entry is keyed on the content of the input blob, the step name, the step version
+    and the parameters that change the step output, so it is only reused when neither
+    the input nor the step changed. The outputs are written to paths shared by every
+    run on the input, so an entry also records the ETag of each output blob: entries
+    older than the TTL, or whose output blob no longer exists or was overwritten since,
+    e.g. by a run with other parameters, are evicted when they are looked up.
+    """
+
+    def __init__(self, blob_client: BlobStorageClient, ttl_seconds: int = None, subpath: str = None):
+        self.__blob_client = blob_client
+        self.__ttl_seconds = (
+            int(os.getenv("StepCacheTtlSeconds", DEFAULT_TTL_SECONDS))
+            if ttl_seconds is None
+            else ttl_seconds
+        )
+        self.__subpath = subpath or os.getenv("StepCacheSubpath", "cache")
+
+    @property
+    def enabled(self) -> bool:
+        return self.__ttl_seconds > 0
+
+    def key(self, step: str, version: str, input_path: str, params: dict = None) -> str:
+        """
+        Cache key of a step run on an input, None if the input does not exist.
+        """
+        properties = self.__blob_client.get_blob_properties(input_path)
+        if properties is None:
+            return None
+        fingerprint = json.dumps(
+            [step, version, input_path, _content_version(properties), params or {}],
+            sort_keys=True,
+            default=str,
+        )
+        return f"{step}/{hashlib.sha256(fingerprint.encode()).hexdigest()}"
+
+    def lookup(
+        self, step: str, version: str, input_path: str, params: dict = None, force_refresh: bool = False
+    ) -> tuple:
+        """
+        Cache key of a step run on an input and the result cached under it, None on a
+        miss or with force_refresh. The key is returned either way to put the result.
+        """
+        key = self.key(step, version, input_path, params)
+        cached = None if force_refresh else self.get(key)
+        if cached:
+            logging.info(f"{step} result for {input_path} found in the cache")
+        return key, cached
+
+    def get(self, key: str) -> dict:
+        """
+        Result cached under a key, None on a miss.
+        """
+        if not self.enabled or key is None:
+            return None
+        path = self.__index_path(key)
+        try:
+            if self.__blob_client.get_blob_properties(path) is None:
+                return None
+            entry = json.load(self.__blob_client.download_blob_content(path))
+            created = datetime.datetime.fromisoformat(entry["created"])
+            age = datetime.datetime.now(datetime.timezone.utc) - created
+            outputs = entry.get("outputs")
+            outputs_unchanged = (
+                outputs is not None
+                and None not in outputs.values()
+                and outputs == self.__output_etags(entry["result"])
+            )
+            if age.total_seconds() > self.__ttl_seconds or not outputs_unchanged:
+                self.__blob_client.delete_blob(path)
+                return None
+            return entry["result"]
+        except Exception as e:
+            logging.warning(f"Ignoring step cache entry {path}: {e}")
+            return None
+
+    def put(self, key: str, result: dict):
+        """
+        Cache the result of a step under a key.
+        """
+        if not self.enabled or key is None:
+            return
+        try:
+            entry = {
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "result": result,
+                "outputs": self.__output_etags(result),
+            }
+            self.__blob_client.upload_blob_content(json.dumps(entry), self.__index_path(key))
+        except Exception as e:
+            logging.warning(f"Could not write step cache entry {key}: {e}")
+
+    def __output_etags(self, result: dict) -> dict:
+        """
+        ETag of each output blob of a result, None for an output that does not exist.
+        """
+        etags = {}
+        for name, value in result.items():
+            if name.endswith(OUTPUT_SUFFIX) and value:
+                properties = self.__blob_client.get_blob_properties(value)
+                etags[value] = properties.etag if properties is not None else None
+        return etags
+
+    def __index_path(self, key: str) -> str:
+        return f"{self.__subpath}/{key}.json"
@@ -0,0 +1,33 @@
+"""
+File-like wrappers used to stream blob content without buffering it whole.
+"""
+
+import io
+
+
+class ChunkIteratorStream(io.RawIOBase):
+    """
+    Read-only binary stream over an iterator of byte chunks,
+    such as StorageStreamDownloader.chunks().
+    Only the chunk currently being read is held in memory.
+    """
+
+    def __init__(self, chunks):
+        self.__chunks = iter(chunks)
+        self.__chunk = memoryview(b"")
+        self.__offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.__offset >= len(self.__chunk):
+            try:
+                self.__chunk = memoryview(next(self.__chunks))
+            except StopIteration:
+                return 0
+            self.__offset = 0
+        size = min(len(buffer), len(self.__chunk) - self.__offset)
+        buffer[:size] = self.__chunk[self.__offset : self.__offset + size]
+        self.__offset += size
+        return size
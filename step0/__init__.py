@@ -3,13 +3,219 @@
 # 
 
 import logging
-from ..common import BlobStorageClient
+from ..common import (
+    CSV,
+    SCHEMA_SAMPLE_ROWS,
+    STATUS,
+    BlobStorageClient,
+    estimate_cost,
+    format_from_path,
+    get_blob_storage_client,
+    infer_schema,
+    load_cost_model,
+    reset_on_auth_error,
+    save_schema,
+    schema_path,
+)
 import datetime
+import json
 import os
-from azure.storage.blob import BlobServiceClient
+from concurrent.futures import ThreadPoolExecutor
 
+MANIFEST_COLUMNS = ["name", "size", "etag", "last_modified", "header_size", "byte_ranges", "cost"]
+DEFAULT_PAGE_SIZE = 5000
+MAX_LISTING_THREADS = 16
+# Files larger than this many bytes are split into byte ranges processed in parallel
+DEFAULT_SPLIT_SIZE = 1024 * 1024 * 1024
 
-def main(rawDataPath: dict) -> list:
+
+def list_shard(blob_client: BlobStorageClient, prefix: str, include_status: bool = False) -> list:
+    """
+    List the files of one prefix shard page by page.
+    """
+    records = []
+    for page, continuation_token in blob_client.list_blob_records(
+        prefix, include_status=include_status
+    ):
+        records.extend(page)
+        logging.info(
+            f"Listed {len(page)} files under {prefix}, continuation token {continuation_token}"
+        )
+    return records
+
+
+def list_files(
+    blob_client: BlobStorageClient,
+    folder: str,
+    shard_prefixes: list = None,
+    include_status: bool = False,
+) -> list:
+    """
+    List the files of a folder in parallel across prefix shards.
+    The shards are the given name prefixes, or else the sub folders of the folder.
+    """
+    folder = folder.rstrip("/")
+    if shard_prefixes:
+        prefixes = [f"{folder}/{prefix}" for prefix in shard_prefixes]
+        records = []
+    else:
+        prefixes, records = blob_client.walk_folder(folder, include_status=include_status)
+
+    with ThreadPoolExecutor(max_workers=MAX_LISTING_THREADS) as executor:
+        for shard_records in executor.map(
+            lambda prefix: list_shard(blob_client, prefix, include_status), prefixes
+        ):
+            records.extend(shard_records)
+
+    # Overlapping shard prefixes list the same file more than once
+    unique_records = {record["name"]: record for record in records}
+    return [unique_records[name] for name in sorted(unique_records)]
+
+
+def watermark_path(folder: str) -> str:
+    """
+    Path of the last modified watermark of the incremental runs on a folder.
+    """
+    watermark_subpath = os.getenv("WatermarkDataSubpath", "watermarks")
+    return f"{watermark_subpath}/{folder.strip('/')}.json"
+
+
+def load_watermark(blob_client: BlobStorageClient, folder: str) -> str:
+    """
+    Last modified time of the newest file processed by the previous incremental runs,
+    None before the first run.
+    """
+    path = watermark_path(folder)
+    if blob_client.get_blob_properties(path) is None:
+        return None
+    return json.load(blob_client.download_blob_content(path))["last_modified"]
+
+
+def select_new_files(records: list, watermark: str) -> list:
+    """
+    Keep the files not yet stamped as processed and modified after the watermark.
+    Stamping a file updates its last modified time, hence the status check.
+    """
+    watermark = datetime.datetime.fromisoformat(watermark) if watermark else None
+    return [
+        record
+        for record in records
+        if record.get("status") != STATUS
+        and (watermark is None or datetime.datetime.fromisoformat(record["last_modified"]) > watermark)
+    ]
+
+
+def get_split_size(requested=None) -> int:
+    """
+    Size in bytes above which files are split into byte ranges, set per run with
+    splitSize or with the SplitSizeBytes app setting. 0 disables the split.
+    """
+    if requested is None:
+        requested = os.getenv("SplitSizeBytes", DEFAULT_SPLIT_SIZE)
+    return int(requested)
+
+
+def line_ranges(blob_client: BlobStorageClient, path: str, size: int, split_size: int) -> tuple:
+    """
+    Split a CSV file into byte ranges of about split_size bytes that start and end on
+    line boundaries, found with small ranged reads around each nominal boundary.
+    Returns the size of the header line and the [start, end] ranges of the rows after it.
+    """
+    header_size = blob_client.find_line_end(path, 0)
+    if header_size is None:
+        return None, []
+    boundaries = [header_size]
+    while boundaries[-1] + split_size < size:
+        # Start one byte early so a boundary that falls just after a newline is kept
+        line_end = blob_client.find_line_end(path, boundaries[-1] + split_size - 1)
+        if line_end is None or line_end >= size:
+            break
+        boundaries.append(line_end)
+    boundaries.append(size)
+    return header_size, [[start, end] for start, end in zip(boundaries, boundaries[1:])]
+
+
+def split_large_files(blob_client: BlobStorageClient, records: list, split_size: int) -> int:
+    """
+    Add the header size and the line aligned byte ranges to the records of the
+    uncompressed CSV files larger than split_size, so each range is processed on
+    its own. Returns the number of files split.
+    """
+    large_records = [record for record in records if split_size and record["size"] > split_size]
+
+    def split(record: dict) -> bool:
+        properties = blob_client.get_blob_properties(record["name"])
+        if (
+            format_from_path(record["name"], properties.metadata) != CSV
+            or properties.content_settings.content_encoding
+        ):
+            return False
+        header_size, byte_ranges = line_ranges(blob_client, record["name"], record["size"], split_size)
+        if len(byte_ranges) < 2:
+            return False
+        record["header_size"] = header_size
+        record["byte_ranges"] = json.dumps(byte_ranges)
+        logging.info(f"Split {record['name']} into {len(byte_ranges)} byte ranges")
+        return True
+
+    with ThreadPoolExecutor(max_workers=MAX_LISTING_THREADS) as executor:
+        return sum(executor.map(split, large_records))
+
+
+def order_by_cost(records: list, model: dict) -> list:
+    """
+    Add the estimated processing seconds of each file to its record and order the
+    records costliest first, so the largest files start first instead of deciding
+    the end of the run when they come last.
+    """
+    for record in records:
+        range_count = len(json.loads(record["byte_ranges"])) if record.get("byte_ranges") else 1
+        record["cost"] = estimate_cost(model, record["size"], range_count)
+    return sorted(records, key=lambda record: (-record["cost"], record["name"]))
+
+
+def ensure_schema(blob_client: BlobStorageClient, folder: str, records: list) -> str:
+    """
+    Path of the schema of the dataset in a folder. When none was declared, e.g. by
+    GenerateData, it is inferred from the first rows of the first file and saved.
+    None when there is no file to infer it from.
+    """
+    path = schema_path(folder)
+    if blob_client.get_blob_properties(path) is not None:
+        return path
+    if not records:
+        return None
+    chunks = blob_client.iter_pd_dataframe(records[0]["name"], chunksize=SCHEMA_SAMPLE_ROWS)
+    sample = next(chunks, None)
+    chunks.close()
+    if sample is None:
+        return None
+    logging.info(f"Inferring the schema of {folder} from {records[0]['name']}")
+    return save_schema(blob_client, folder, infer_schema(sample))
+
+
+def write_manifest(
+    blob_client: BlobStorageClient, records: list, manifest_path: str, page_size: int
+) -> list:
+    """
+    Write the file records as manifest pages of page_size files each.
+    Returns the paths of the pages.
+    """
+    import pandas as pd
+
+    pages = [records[i : i + page_size] for i in range(0, len(records), page_size)]
+    page_paths = [f"{manifest_path}/files-{i:05d}.csv" for i in range(len(pages))]
+
+    def upload_page(args):
+        page, page_path = args
+        blob_client.upload_pd_dataframe(pd.DataFrame(page, columns=MANIFEST_COLUMNS), page_path)
+
+    with ThreadPoolExecutor(max_workers=MAX_LISTING_THREADS) as executor:
+        list(executor.map(upload_page, zip(pages, page_paths)))
+    return page_paths
+
+
+def main(rawDataPath: dict) -> dict:
     utc_timestamp = (
         datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
     )
@@ -19,17 +225,57 @@ def main(rawDataPath: dict) -> list:
 
     try:
         f_path = rawDataPath["rawDataPath"]
-        # Create the BlobServiceClient object which will be used to create a container client
-        blob_service_client = BlobServiceClient.from_connection_string(
-            os.getenv("DataStorage")
-        )
-        container_client = blob_service_client.get_container_client(
-            os.getenv("DataContainer")
+        run_id = rawDataPath.get("runId") or utc_timestamp
+        page_size = int(rawDataPath.get("pageSize", DEFAULT_PAGE_SIZE))
+        manifest_subpath = os.getenv("ManifestDataSubpath", "manifests")
+        manifest_path = f"{manifest_subpath}/{run_id}"
+
+        # Reuse the pooled container client shared by all activities in this worker
+        blob_client: BlobStorageClient = get_blob_storage_client()
+
+        incremental = bool(rawDataPath.get("incremental"))
+        records = list_files(
+            blob_client, f_path, rawDataPath.get("shardPrefixes"), include_status=incremental
         )
-        blob_client: BlobStorageClient = BlobStorageClient(container_client)
+        logging.info(f"Files found: {len(records)}")
+
+        # The steps parse the files with the column types of the dataset schema
+        schema = ensure_schema(blob_client, f_path, records)
+
+        # In incremental mode only new or changed files are processed. The watermark saved
+        # once the run succeeded is the newest last modified time seen so far.
+        watermark = None
+        if incremental:
+            previous_watermark = load_watermark(blob_client, f_path)
+            last_modified = [record["last_modified"] for record in records]
+            if previous_watermark:
+                last_modified.append(previous_watermark)
+            watermark = max(last_modified, key=datetime.datetime.fromisoformat, default=None)
+            records = select_new_files(records, previous_watermark)
+            logging.info(f"New or changed files since {previous_watermark}: {len(records)}")
+
+        # Large files are split into line aligned byte ranges so that more than one
+        # worker reads them, the ranges are listed with the file in the manifest
+        split_count = split_large_files(blob_client, records, get_split_size(rawDataPath.get("splitSize")))
+        logging.info(f"Files split into byte ranges: {split_count}")
+
+        # Schedule the files largest first with the cost model fitted on the previous runs
+        records = order_by_cost(records, load_cost_model(blob_client))
 
-        files = blob_client.get_csv_files(f_path)
-        logging.info("Files found: %s", files)
-        return files
+        # Return a reference to the manifest instead of the list of files,
+        # which keeps the activity output small in the orchestration history
+        pages = write_manifest(blob_client, records, manifest_path, page_size)
+        return {
+            "manifest": manifest_path,
+            "pages": pages,
+            "fileCount": len(records),
+            "splitCount": split_count,
+            "totalBytes": sum(record["size"] for record in records),
+            "totalCost": sum(record["cost"] for record in records),
+            "rawDataPath": f_path,
+            "schema": schema,
+            "watermark": watermark,
+        }
     except Exception as e:
         logging.exception("EXCEPTION while getting list", exc_info=e)
+        reset_on_auth_error(e)
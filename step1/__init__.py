@@ -3,15 +3,50 @@
 
 
 import datetime
+import hashlib
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-from azure.storage.blob import BlobServiceClient
+from ..common import (
+    PHASE_CACHE,
+    PHASE_TRANSFORM,
+    AsyncBlobStorageClient,
+    BlobStorageClient,
+    StepCache,
+    get_async_blob_storage_client,
+    get_blob_storage_client,
+    format_from_path,
+    get_intermediate_format,
+    load_schema,
+    profile_span,
+    profile_step,
+    reset_on_auth_error,
+    run_profiled,
+    schema_columns,
+    schema_read_kwargs,
+    with_format_extension,
+)
 
-from ..common import BlobStorageClient
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Bump when the step logic changes, so cached results are no longer reused
+STEP_VERSION = "2"
+# Default rows of the step 1 output of a file, shared between its byte ranges when step0 split it
+STEP1_ROWS = 1_00_000
+# Default range of the generated values, the high end is excluded
+STEP1_VALUE_RANGE = (0, 99999)
+# Rows generated per random stream, outputs of more rows are filled in parallel chunks.
+# The chunks do not depend on the number of threads, so neither does the output
+FILL_CHUNK_ROWS = 1 << 16
+# Rows drawn at a time into a chunk, so the values drawn before they are copied into
+# the output array stay small enough for the CPU cache
+FILL_BLOCK_ROWS = 1 << 12
+MAX_FILL_THREADS = min(8, os.cpu_count() or 1)
 
 
 @dataclass
@@ -19,45 +54,295 @@ class output:
     step1_output_filename: str
     col_count: int
     row_count: int
+    perf: dict = None
+
+
+def output_path(filename: str, range_index: int = None) -> str:
+    """
+    Path of the step 1 output for an input file, or for one byte range of it.
+    """
+    output_subpath = os.getenv("Step1DataSubpath")
+    basename = filename.split("/")[-1]
+    if range_index is not None:
+        root, extension = os.path.splitext(basename)
+        basename = f"{root}-range{range_index:05d}{extension}"
+    return with_format_extension(f"{output_subpath}/data_{basename}", get_intermediate_format())
+
+
+def range_rows(range_index: int = None, range_count: int = None, num_rows: int = STEP1_ROWS) -> int:
+    """
+    Rows of the step 1 output generated for one byte range of a split file,
+    the ranges together generate the num_rows rows of the whole file.
+    """
+    if range_index is None:
+        return num_rows
+    if range_count is None or not 0 <= range_index < range_count:
+        raise ValueError(f"Invalid step 1 range_index {range_index} of range_count {range_count}")
+    return num_rows // range_count + (range_index < num_rows % range_count)
+
+
+def generation_options(params: dict) -> dict:
+    """
+    Rows and value range of the data generated for a file, from the num_rows and
+    value_range step parameters, STEP1_ROWS and STEP1_VALUE_RANGE by default.
+    """
+    num_rows = params.get("num_rows")
+    num_rows = STEP1_ROWS if num_rows is None else int(num_rows)
+    value_range = params.get("value_range")
+    value_range = STEP1_VALUE_RANGE if value_range is None else value_range
+    if num_rows < 0 or len(value_range) != 2:
+        raise ValueError(f"Invalid step 1 num_rows {num_rows} or value_range {value_range}")
+    low, high = (int(value) for value in value_range)
+    if low >= high:
+        raise ValueError(f"Invalid step 1 value_range {[low, high]}, the low end must be below the high end")
+    return {"num_rows": num_rows, "value_range": (low, high)}
+
+
+def cache_params(params: dict) -> dict:
+    """
+    Parameters of the step 1 result in the step cache, a byte range of a split file is cached on its own.
+    """
+    cached_params = {"format": get_intermediate_format(), **generation_options(params)}
+    if params.get("seed") not in (None, ""):
+        cached_params["seed"] = str(params["seed"])
+    if params.get("byte_range"):
+        cached_params.update(
+            byte_range=params["byte_range"],
+            header_size=params.get("header_size"),
+            range_count=params.get("range_count"),
+        )
+    return cached_params
+
+
+def shape_read_kwargs(filename: str, schema: dict = None) -> dict:
+    """
+    Read arguments of the input file. With the schema of its dataset, only the
+    first column is parsed to count the rows, the column names come from the schema.
+    """
+    if not schema:
+        return {}
+    return schema_read_kwargs(schema, format_from_path(filename), columns=schema_columns(schema)[:1])
+
+
+def read_input_shape(
+    blob_client: BlobStorageClient,
+    filename: str,
+    schema: dict = None,
+    byte_range: list = None,
+    header_size: int = 0,
+) -> tuple:
+    """
+    Stream the input file from the blob storage in chunks and return its columns
+    and row count, so large raw files are counted without holding them in memory.
+    With byte_range, only the rows of that line aligned range of the file are read.
+    """
+    chunks = blob_client.iter_pd_dataframe(
+        filename,
+        byte_range=byte_range,
+        header_size=header_size,
+        **shape_read_kwargs(filename, schema),
+    )
+    return input_shape(chunks, schema)
+
+
+def input_shape(chunks, schema: dict = None) -> tuple:
+    """
+    Columns and row count of a file read as an iterator of dataframes,
+    the columns are taken from the schema of its dataset if given.
+    """
+    columns = schema_columns(schema) if schema else None
+    row_count = 0
+    for chunk in chunks:
+        columns = chunk.columns if columns is None else columns
+        row_count += chunk.shape[0]
+    return columns, row_count
+
+
+def seed_sequence(filename: str, seed=None, range_index: int = None) -> "np.random.SeedSequence":
+    """
+    Seed of the data generated for a file, or for one byte range of it, drawn from
+    its path and the seed of the run if any. The same file and seed always generate
+    the same data, also when the activity is replayed or retried.
+    """
+    import numpy as np
+
+    entropy = [int.from_bytes(hashlib.sha256(filename.encode("utf-8")).digest()[:16], "little")]
+    if seed not in (None, ""):
+        entropy.append(int(seed))
+    spawn_key = () if range_index is None else (int(range_index),)
+    return np.random.SeedSequence(entropy, spawn_key=spawn_key)
+
+
+def _fill(out: "np.ndarray", seed: "np.random.SeedSequence", value_range: tuple):
+    """
+    Fill a chunk of the output array with the stream of seed, FILL_BLOCK_ROWS rows at a time.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, len(out), FILL_BLOCK_ROWS):
+        block = out[start : start + FILL_BLOCK_ROWS]
+        block[...] = rng.integers(*value_range, size=block.shape)
+
 
+def transform(
+    columns,
+    num_rows: int = STEP1_ROWS,
+    value_range: tuple = STEP1_VALUE_RANGE,
+    seed=None,
+    chunk_rows: int = FILL_CHUNK_ROWS,
+    max_workers: int = MAX_FILL_THREADS,
+) -> "pd.DataFrame":
+    """
+    Do "something" with the file.
+    In this example we are generating num_rows rows of random integers in value_range for
+    the input columns. seed is a SeedSequence, e.g. from seed_sequence, or its entropy.
+    The rows are filled into one preallocated array, chunk_rows rows per stream spawned
+    from the seed, by a pool of threads as NumPy releases the GIL while it draws them.
+    Each stream draws FILL_BLOCK_ROWS rows at a time and copies them into the array.
+    """
+    # Imported on the first call rather than when the worker loads the function
+    import numpy as np
+    import pandas as pd
 
-def main(filename: str) -> output:
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    data = np.empty((num_rows, len(columns)), dtype=np.int64)
+    starts = range(0, num_rows, chunk_rows)
+    chunks = [data[start : start + chunk_rows] for start in starts]
+    chunk_seeds = seed.spawn(len(chunks))
+    if len(chunks) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for _ in executor.map(_fill, chunks, chunk_seeds, [value_range] * len(chunks)):
+                pass
+    else:
+        for chunk, chunk_seed in zip(chunks, chunk_seeds):
+            _fill(chunk, chunk_seed, value_range)
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def read_input(filename) -> dict:
+    """
+    Parameters of the step, logging the start of the step.
+    The input is either the filename or a dict with the filename, the path of the
+    schema of its dataset, the seed of the run, the num_rows and value_range of the
+    generated data, the force_refresh flag and, for one byte range of a file split
+    by step0, the byte_range, header_size, range_index and range_count.
+    """
+    params = filename if isinstance(filename, dict) else {"filename": filename}
     utc_timestamp = (
         datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
     )
     logging.info(
-        f"Python Step 1 function started at {utc_timestamp} with filename {filename}"
+        f"Python Step 1 function started at {utc_timestamp} with filename {params['filename']}"
     )
+    return params
 
-    try:
-        # Create the BlobServiceClient object which will be used to create a container client
-        blob_service_client = BlobServiceClient.from_connection_string(
-            os.getenv("DataStorage")
-        )
-        container_client = blob_service_client.get_container_client(
-            os.getenv("DataContainer")
-        )
-        output_subpath = os.getenv("Step1DataSubpath")
-        output_filename = f"{output_subpath}/data_{filename.split('/')[-1]}"
-        blob_client: BlobStorageClient = BlobStorageClient(container_client)
-
-        # Download the file from the blob storage
-        input_data = blob_client.download_blob_content(filename)
-
-        # Read the file into a pandas dataframe and do "something" to it.
-        #  In this example we are generating 100,000 random numbers and saving them to a CSV file.
-        csv_file = pd.read_csv(input_data)
-        col_count = csv_file.shape[1]
-        row_count = csv_file.shape[0]
-        rand_data_step_1 = pd.DataFrame(
-            np.random.randint(0, 99999, size=(1_00_000, col_count)),
-            columns=csv_file.columns,
-        )
-        blob_client.upload_pd_dataframe(rand_data_step_1, output_filename)
 
-        # Return the output of the function
-        return asdict(
-            output(step1_output_filename=output_filename, col_count=col_count, row_count=row_count)
+def transform_kwargs(params: dict) -> dict:
+    """
+    Arguments of transform for the file, or the byte range of it, of the step parameters.
+    """
+    options = generation_options(params)
+    return {
+        "num_rows": range_rows(params.get("range_index"), params.get("range_count"), options["num_rows"]),
+        "value_range": options["value_range"],
+        "seed": seed_sequence(params["filename"], params.get("seed"), params.get("range_index")),
+    }
+
+
+def build_result(output_filename: str, columns, row_count: int, profile) -> dict:
+    return asdict(
+        output(
+            step1_output_filename=output_filename,
+            col_count=len(columns),
+            row_count=row_count,
+            perf=profile.summary(),
         )
+    )
+
+
+def main(filename) -> output:
+    params = read_input(filename)
+    filename = params["filename"]
+    try:
+        with profile_step("step1", filename) as profile:
+            # Reuse the pooled container client shared by all activities in this worker
+            blob_client: BlobStorageClient = get_blob_storage_client()
+            output_filename = output_path(filename, params.get("range_index"))
+
+            # Reuse the cached result if neither the input file nor this step changed
+            cache = StepCache(blob_client)
+            with profile_span(PHASE_CACHE):
+                cache_key, cached = cache.lookup(
+                    "step1", STEP_VERSION, filename, cache_params(params), params.get("force_refresh")
+                )
+            if cached:
+                return {**cached, "perf": profile.summary(cache_hit=True)}
+
+            # Read the shape of the input file and generate the step 1 data from it
+            schema = load_schema(blob_client, params.get("schema"))
+            columns, row_count = read_input_shape(
+                blob_client, filename, schema, params.get("byte_range"), params.get("header_size") or 0
+            )
+            with profile_span(PHASE_TRANSFORM):
+                rand_data_step_1 = transform(columns, **transform_kwargs(params))
+            blob_client.upload_pd_dataframe(rand_data_step_1, output_filename)
+
+            # Return the output of the function
+            result = build_result(output_filename, columns, row_count, profile)
+            cache.put(cache_key, result)
+            return result
+    except Exception as e:
+        logging.exception("EXCEPTION while running Step1", exc_info=e)
+        reset_on_auth_error(e)
+
+
+async def main_async(filename) -> output:
+    """
+    Asynchronous variant of main. The blob I/O is awaited, so one worker overlaps
+    the downloads and uploads of many files, while the data is generated in the executor.
+    """
+    params = read_input(filename)
+    filename = params["filename"]
+    try:
+        with profile_step("step1", filename) as profile:
+            blob_client: BlobStorageClient = get_blob_storage_client()
+            async_blob_client: AsyncBlobStorageClient = get_async_blob_storage_client()
+            output_filename = output_path(filename, params.get("range_index"))
+
+            # Reuse the cached result if neither the input file nor this step changed,
+            # the small cache blobs are read with the sync client in the executor
+            cache = StepCache(blob_client)
+            with profile_span(PHASE_CACHE):
+                cache_key, cached = await run_profiled(
+                    cache.lookup,
+                    "step1",
+                    STEP_VERSION,
+                    filename,
+                    cache_params(params),
+                    params.get("force_refresh"),
+                )
+            if cached:
+                return {**cached, "perf": profile.summary(cache_hit=True)}
+
+            # Download the input file, then read its shape and generate the step 1 data in the executor
+            schema = await run_profiled(load_schema, blob_client, params.get("schema"))
+            chunks = await async_blob_client.iter_pd_dataframe(
+                filename,
+                byte_range=params.get("byte_range"),
+                header_size=params.get("header_size") or 0,
+                **shape_read_kwargs(filename, schema),
+            )
+            columns, row_count = await run_profiled(input_shape, chunks, schema)
+            with profile_span(PHASE_TRANSFORM):
+                rand_data_step_1 = await run_profiled(transform, columns, **transform_kwargs(params))
+            await async_blob_client.upload_pd_dataframe(rand_data_step_1, output_filename)
+
+            # Return the output of the function
+            result = build_result(output_filename, columns, row_count, profile)
+            await run_profiled(cache.put, cache_key, result)
+            return result
     except Exception as e:
         logging.exception("EXCEPTION while running Step1", exc_info=e)
+        reset_on_auth_error(e)
@@ -10,12 +10,33 @@ import datetime
 import logging
 import os
 from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-from azure.storage.blob import BlobServiceClient
+from ..common import (
+    CSV,
+    PHASE_CACHE,
+    PHASE_TRANSFORM,
+    AsyncBlobStorageClient,
+    BlobStorageClient,
+    StepCache,
+    get_async_blob_storage_client,
+    get_blob_storage_client,
+    profile_span,
+    profile_step,
+    reservoir_sample,
+    reset_on_auth_error,
+    run_profiled,
+    sampling_options,
+    with_format_extension,
+)
 
-from ..common import BlobStorageClient
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Bump when the step logic changes, so cached results are no longer reused
+STEP_VERSION = "1"
+# Default number of rows sampled
+SAMPLE_SIZE = 5
 
 
 @dataclass
@@ -23,9 +44,31 @@ class output:
     step4_output_filename: str
     col_count: int
     row_count: int
+    perf: dict = None
 
 
-def main(name: dict) -> str:
+def output_path(filename: str) -> str:
+    """
+    Path of the step 4 output for an input file.
+    """
+    output_subpath = os.getenv("Step4DataSubpath")
+    return with_format_extension(
+        f"{output_subpath}/final_{filename.split('/')[-1]}", CSV
+    )
+
+
+def transform(chunks, sample_size: int = SAMPLE_SIZE, **sampling_kwargs) -> tuple:
+    """
+    Take a random sample of sample_size rows in a single pass over the chunks of the input.
+    Returns the sample and the row count of the input.
+    """
+    return reservoir_sample(chunks, sample_size, **sampling_kwargs)
+
+
+def read_input(name: dict) -> tuple:
+    """
+    Input file and sampling options of the step, logging the start of the step.
+    """
     filename = name["step3_output_filename"]
     utc_timestamp = (
         datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
@@ -33,32 +76,98 @@ def main(name: dict) -> str:
     logging.info(
         f"Python Step 4 function started at {utc_timestamp} with input {filename}"
     )
-    try:
-        # Create the BlobServiceClient object which will be used to create a container client
+    return filename, sampling_options(name)
 
-        blob_service_client = BlobServiceClient.from_connection_string(
-            os.getenv("DataStorage")
-        )
-        container_client = blob_service_client.get_container_client(
-            os.getenv("DataContainer")
-        )
-        output_subpath = os.getenv("Step4DataSubpath")
-        output_filename = f"{output_subpath}/final_{filename.split('/')[-1]}"
-        blob_client: BlobStorageClient = BlobStorageClient(container_client)
-
-        # Download the file from the blob storage
-        input_data = blob_client.download_blob_content(filename)
-
-        # Take a sample of the data and save it to a CSV file for next step
-        csv_file = pd.read_csv(input_data)
-        sample = csv_file.sample(n=5)
-        row_count = csv_file.shape[0]
-        col_count = sample.shape[1]
-        blob_client.upload_pd_dataframe(sample, output_filename)
-
-        # Return the output of the function
-        return asdict(
-            output(step4_output_filename=output_filename, col_count=col_count, row_count=row_count)
+
+def cache_params(options: dict) -> dict:
+    """
+    Parameters of the step 4 result in the step cache, its output is always CSV.
+    """
+    return {**options}
+
+
+def build_result(output_filename: str, sample: "pd.DataFrame", row_count: int, profile) -> dict:
+    return asdict(
+        output(
+            step4_output_filename=output_filename,
+            col_count=sample.shape[1],
+            row_count=row_count,
+            perf=profile.summary(),
         )
+    )
+
+
+def main(name: dict) -> str:
+    filename, options = read_input(name)
+    try:
+        with profile_step("step4", filename) as profile:
+            # Reuse the pooled container client shared by all activities in this worker
+            blob_client: BlobStorageClient = get_blob_storage_client()
+            output_filename = output_path(filename)
+
+            # Reuse the cached result if neither the input file nor this step changed
+            cache = StepCache(blob_client)
+            with profile_span(PHASE_CACHE):
+                cache_key, cached = cache.lookup(
+                    "step4", STEP_VERSION, filename, cache_params(options), name.get("force_refresh")
+                )
+            if cached:
+                return {**cached, "perf": profile.summary(cache_hit=True)}
+
+            # Stream the output of the previous step from the blob storage
+            chunks = blob_client.iter_pd_dataframe(filename)
+
+            # Take a sample of the data and save it to a CSV file
+            with profile_span(PHASE_TRANSFORM):
+                sample, row_count = transform(chunks, **options)
+            blob_client.upload_pd_dataframe(sample, output_filename)
+
+            # Return the output of the function
+            result = build_result(output_filename, sample, row_count, profile)
+            cache.put(cache_key, result)
+            return result
+    except Exception as e:
+        logging.exception("EXCEPTION while running Step4", exc_info=e)
+        reset_on_auth_error(e)
+
+
+async def main_async(name: dict) -> str:
+    """
+    Asynchronous variant of main. The blob I/O is awaited, so one worker overlaps
+    the downloads and uploads of many files, while the sampling runs in the executor.
+    """
+    filename, options = read_input(name)
+    try:
+        with profile_step("step4", filename) as profile:
+            blob_client: BlobStorageClient = get_blob_storage_client()
+            async_blob_client: AsyncBlobStorageClient = get_async_blob_storage_client()
+            output_filename = output_path(filename)
+
+            # Reuse the cached result if neither the input file nor this step changed,
+            # the small cache blobs are read with the sync client in the executor
+            cache = StepCache(blob_client)
+            with profile_span(PHASE_CACHE):
+                cache_key, cached = await run_profiled(
+                    cache.lookup,
+                    "step4",
+                    STEP_VERSION,
+                    filename,
+                    cache_params(options),
+                    name.get("force_refresh"),
+                )
+            if cached:
+                return {**cached, "perf": profile.summary(cache_hit=True)}
+
+            # Download the output of the previous step, then parse and sample it in the executor
+            chunks = await async_blob_client.iter_pd_dataframe(filename)
+            with profile_span(PHASE_TRANSFORM):
+                sample, row_count = await run_profiled(transform, chunks, **options)
+            await async_blob_client.upload_pd_dataframe(sample, output_filename)
+
+            # Return the output of the function
+            result = build_result(output_filename, sample, row_count, profile)
+            await run_profiled(cache.put, cache_key, result)
+            return result
     except Exception as e:
         logging.exception("EXCEPTION while running Step4", exc_info=e)
+        reset_on_auth_error(e)
@@ -0,0 +1,11 @@
+"""
+The function folders are imported as the Functions host does, with tools.apploader,
+so the app root has to be importable when pytest is run from any folder.
+"""
+
+import sys
+from pathlib import Path
+
+APP_ROOT = str(Path(__file__).resolve().parent.parent)
+if APP_ROOT not in sys.path:
+    sys.path.insert(0, APP_ROOT)
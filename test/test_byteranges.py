@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from tools.apploader import load_function
+from tools.localstorage import LocalContainerClient
+
+common = load_function("common")
+step0 = load_function("step0")
+step1 = load_function("step1")
+
+
+@pytest.fixture
+def blob_client(tmp_path):
+    return common.use_container_client(LocalContainerClient(str(tmp_path)))
+
+
+def upload_csv(blob_client, path: str, rows: int, trailing_newline: bool = True) -> bytes:
+    lines = ["id,name,value"] + [f"{row},name{row % 7},{row * 31 % 1000}" for row in range(rows)]
+    content = ("\n".join(lines) + ("\n" if trailing_newline else "")).encode()
+    blob_client.upload_blob_content(content, path)
+    return content
+
+
+def range_row_counts(content: bytes, byte_ranges: list) -> list:
+    # A range holds whole lines, the last one may lack its newline at the end of the file
+    return [len(content[start:end].splitlines()) for start, end in byte_ranges]
+
+
+@pytest.mark.parametrize("split_size", [1, 64, 100, 1000, 4096])
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_line_ranges_cover_every_row_once(blob_client, split_size, trailing_newline):
+    content = upload_csv(blob_client, "raw/data.csv", 500, trailing_newline)
+    header_size, byte_ranges = step0.line_ranges(blob_client, "raw/data.csv", len(content), split_size)
+    assert header_size == len(b"id,name,value\n")
+    assert byte_ranges[0][0] == header_size
+    assert byte_ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(byte_ranges, byte_ranges[1:]):
+        assert end == start
+        assert content[start - 1 : start] == b"\n"
+    assert all(start < end for start, end in byte_ranges)
+    assert sum(range_row_counts(content, byte_ranges)) == 500
+
+
+def test_line_ranges_are_about_split_size(blob_client):
+    content = upload_csv(blob_client, "raw/data.csv", 5_000)
+    header_size, byte_ranges = step0.line_ranges(blob_client, "raw/data.csv", len(content), 10_000)
+    longest_line = max(len(line) + 1 for line in content.splitlines())
+    assert len(byte_ranges) == -(-(len(content) - header_size) // 10_000)
+    for start, end in byte_ranges[:-1]:
+        assert 10_000 <= end - start < 10_000 + longest_line
+
+
+def test_line_ranges_of_a_file_without_rows(blob_client):
+    blob_client.upload_blob_content(b"id,name,value", "raw/empty.csv")
+    assert step0.line_ranges(blob_client, "raw/empty.csv", 13, 4) == (None, [])
+
+
+def test_split_large_files_only_splits_large_csv_files(blob_client):
+    large = upload_csv(blob_client, "raw/large.csv", 2_000)
+    small = upload_csv(blob_client, "raw/small.csv", 10)
+    records = [{"name": "raw/large.csv", "size": len(large)}, {"name": "raw/small.csv", "size": len(small)}]
+    assert step0.split_large_files(blob_client, records, 8_000) == 1
+    byte_ranges = json.loads(records[0]["byte_ranges"])
+    assert records[0]["header_size"] == byte_ranges[0][0]
+    assert sum(range_row_counts(large, byte_ranges)) == 2_000
+    assert "byte_ranges" not in records[1]
+    assert step0.split_large_files(blob_client, records[1:], 0) == 0
+
+
+def test_step1_reads_the_rows_of_each_range_once(blob_client):
+    content = upload_csv(blob_client, "raw/data.csv", 3_000)
+    header_size, byte_ranges = step0.line_ranges(blob_client, "raw/data.csv", len(content), 7_000)
+    assert len(byte_ranges) > 1
+    row_counts = []
+    for byte_range in byte_ranges:
+        columns, row_count = step1.read_input_shape(
+            blob_client, "raw/data.csv", byte_range=byte_range, header_size=header_size
+        )
+        assert list(columns) == ["id", "name", "value"]
+        row_counts.append(row_count)
+    assert row_counts == range_row_counts(content, byte_ranges)
+    assert sum(row_counts) == 3_000
+
+
+@pytest.mark.parametrize("num_rows", [0, 1, 7, 100_000])
+@pytest.mark.parametrize("range_count", [1, 3, 8])
+def test_range_rows_add_up_to_the_rows_of_the_file(num_rows, range_count):
+    rows = [step1.range_rows(range_index, range_count, num_rows) for range_index in range(range_count)]
+    assert sum(rows) == num_rows
+    assert max(rows) - min(rows) <= 1
+
+
+def test_range_rows_rejects_a_range_outside_of_the_file():
+    with pytest.raises(ValueError):
+        step1.range_rows(3, 3, 10)
@@ -0,0 +1,80 @@
+import random
+
+import pandas as pd
+
+from tools.apploader import load_function
+
+costmodel = load_function("common.costmodel")
+manifest_page = load_function("ManifestPage")
+
+
+def group_costs(groups: list, costs: list) -> list:
+    return [sum(costs[index] for index in group) for group in groups]
+
+
+def test_pack_groups_places_every_item_once():
+    costs = [random.Random(seed).uniform(0.1, 5) for seed in range(200)]
+    groups = costmodel.pack_groups(costs, 10)
+    assert sorted(index for group in groups for index in group) == list(range(200))
+
+
+def test_pack_groups_uses_as_many_groups_as_the_total_cost_needs():
+    costs = [1.0] * 95
+    groups = costmodel.pack_groups(costs, 10)
+    assert len(groups) == 10
+    assert sorted(len(group) for group in groups) == [9] * 5 + [10] * 5
+
+
+def test_pack_groups_balances_the_groups():
+    costs = [random.Random(seed).uniform(0.1, 2) for seed in range(500)]
+    loads = group_costs(costmodel.pack_groups(costs, 20), costs)
+    # Costliest first to the least loaded group leaves groups within one item of each other
+    assert max(loads) - min(loads) <= max(costs)
+    assert max(loads) <= 20 + max(costs)
+
+
+def test_pack_groups_gives_costly_items_a_group_of_their_own():
+    costs = [12.0, 1.0, 30.0, 2.0, 10.0]
+    groups = costmodel.pack_groups(costs, 10)
+    assert groups[0] == [2]
+    assert groups[1] == [0]
+    assert groups[2] == [4]
+    assert groups[3] == [3, 1]
+
+
+def test_pack_groups_returns_the_costliest_group_first():
+    costs = [random.Random(seed).uniform(0.1, 15) for seed in range(100)]
+    loads = group_costs(costmodel.pack_groups(costs, 10), costs)
+    assert loads == sorted(loads, reverse=True)
+
+
+def test_pack_groups_of_no_items():
+    assert costmodel.pack_groups([], 10) == []
+
+
+def test_work_items_pack_small_files_and_keep_split_files():
+    page = pd.DataFrame(
+        {
+            "name": ["big.csv", "split.csv", "a.csv", "b.csv", "c.csv"],
+            "header_size": [None, 10, None, None, None],
+            "byte_ranges": [None, "[[10, 20], [20, 30]]", None, None, None],
+            "cost": [50.0, 40.0, 3.0, 4.0, 5.0],
+        }
+    )
+    items = manifest_page.work_items(page, group_cost=10)
+    assert items[0] == "big.csv"
+    assert items[1] == {"filename": "split.csv", "headerSize": 10, "byteRanges": [[10, 20], [20, 30]]}
+    # 12 seconds of small files need two groups, a group of a single file is its filename
+    assert items[2:] == [{"filenames": ["b.csv", "a.csv"]}, "c.csv"]
+
+
+def test_work_items_without_group_cost_are_single_files_costliest_first():
+    page = pd.DataFrame(
+        {
+            "name": ["a.csv", "b.csv", "c.csv"],
+            "header_size": [None] * 3,
+            "byte_ranges": [None] * 3,
+            "cost": [1.0, 3.0, 2.0],
+        }
+    )
+    assert manifest_page.work_items(page) == ["b.csv", "c.csv", "a.csv"]
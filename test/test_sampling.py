@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.apploader import load_function
+
+sampling = load_function("common.sampling")
+
+
+def chunked(data: pd.DataFrame, chunk_rows: int = 700):
+    return (data.iloc[start : start + chunk_rows] for start in range(0, len(data), chunk_rows))
+
+
+def test_sample_size_and_row_count():
+    data = pd.DataFrame({"id": np.arange(10_000)})
+    sample, row_count = sampling.reservoir_sample(chunked(data), 100, random_state=1)
+    assert row_count == 10_000
+    assert len(sample) == 100
+    assert sample["id"].is_unique
+    assert sample["id"].between(0, 9_999).all()
+    # The random keys of the reservoir are dropped from the sample
+    assert list(sample.columns) == ["id"]
+
+
+def test_sample_of_fewer_rows_than_sample_size_keeps_every_row():
+    data = pd.DataFrame({"id": np.arange(42)})
+    sample, row_count = sampling.reservoir_sample(chunked(data, 10), 100, random_state=1)
+    assert row_count == 42
+    assert sorted(sample["id"]) == list(range(42))
+
+
+def test_sample_is_reproducible_with_a_random_state():
+    data = pd.DataFrame({"id": np.arange(5_000)})
+    first, _ = sampling.reservoir_sample(chunked(data), 50, random_state=7)
+    second, _ = sampling.reservoir_sample(chunked(data), 50, random_state=7)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_sample_is_uniform_across_chunks():
+    # Every chunk is equally likely, the first chunks are not favoured over the last ones
+    data = pd.DataFrame({"id": np.arange(10_000)})
+    sample, _ = sampling.reservoir_sample(chunked(data, 1_000), 2_000, random_state=3)
+    per_chunk = np.bincount(sample["id"] // 1_000, minlength=10)
+    assert per_chunk.min() > 150 and per_chunk.max() < 250
+
+
+def test_weighted_sample_favours_heavy_rows():
+    data = pd.DataFrame({"id": np.arange(1_000), "weight": np.where(np.arange(1_000) < 10, 1_000.0, 1.0)})
+    sample, _ = sampling.reservoir_sample(chunked(data), 10, weight_column="weight", random_state=2)
+    assert (sample["id"] < 10).sum() >= 8
+
+
+def test_weighted_sample_skips_zero_weights():
+    data = pd.DataFrame({"id": np.arange(1_000), "weight": (np.arange(1_000) % 2).astype(float)})
+    sample, _ = sampling.reservoir_sample(chunked(data), 100, weight_column="weight", random_state=2)
+    assert len(sample) == 100
+    assert (sample["weight"] > 0).all()
+
+
+def test_weighted_sample_rejects_negative_weights():
+    data = pd.DataFrame({"id": np.arange(10), "weight": [1.0] * 9 + [-1.0]})
+    with pytest.raises(ValueError):
+        sampling.reservoir_sample(chunked(data), 5, weight_column="weight", random_state=2)
+
+
+def test_stratified_sample_is_proportional_to_the_strata():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({"stratum": rng.choice(["a", "b", "c"], 20_000, p=[0.6, 0.3, 0.1])})
+    sample, row_count = sampling.reservoir_sample(chunked(data), 1_000, stratify_by="stratum", random_state=4)
+    assert row_count == 20_000
+    expected = sampling._allocate(data["stratum"].value_counts(), 1_000)
+    assert sample["stratum"].value_counts().sort_index().to_dict() == expected.sort_index().to_dict()
+
+
+def test_stratified_sample_of_high_cardinality_strata_keeps_the_sample_size():
+    data = pd.DataFrame({"stratum": np.arange(20_000) // 2})
+    sample, _ = sampling.reservoir_sample(chunked(data), 100, stratify_by="stratum", random_state=5)
+    assert len(sample) == 100
+    assert sample.index.is_unique
+
+
+def test_stratified_sample_makes_up_rare_strata_with_the_largest():
+    # The single row of the rare stratum is unlikely to be among the kept rows,
+    # the sample keeps its size either way and only the largest stratum grows
+    data = pd.DataFrame({"stratum": ["a"] * 9_000 + ["b"] * 999 + ["c"]})
+    sample, _ = sampling.reservoir_sample(chunked(data), 100, stratify_by="stratum", random_state=6)
+    counts = sample["stratum"].value_counts()
+    assert len(sample) == 100
+    assert counts["b"] == 10
+    assert counts["a"] + counts.get("c", 0) == 90
+
+
+def test_stratified_sample_keeps_missing_values_as_a_stratum():
+    data = pd.DataFrame({"stratum": ["a", None] * 5_000})
+    sample, _ = sampling.reservoir_sample(chunked(data), 100, stratify_by="stratum", random_state=8)
+    assert sample["stratum"].isna().sum() == 50
+    assert (sample["stratum"] == "a").sum() == 50
+
+
+def test_sampling_options_only_keeps_the_given_options():
+    assert sampling.sampling_options({"sample_size": "5", "stratify_by": None, "filename": "x"}) == {
+        "sample_size": 5
+    }
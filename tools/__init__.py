@@ -0,0 +1,3 @@
+"""
+Tooling to run and measure the function app outside the Azure Functions host.
+"""
@@ -0,0 +1,23 @@
+"""
+Import the function folders outside the Azure Functions host.
+"""
+
+import importlib
+import sys
+import types
+from pathlib import Path
+
+APP_PACKAGE = "__app__"
+APP_ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_function(name: str, root: Path = APP_ROOT):
+    """
+    Import a function folder as the Functions host does, as a submodule of the
+    __app__ package, so the relative imports between function folders resolve.
+    """
+    if APP_PACKAGE not in sys.modules:
+        package = types.ModuleType(APP_PACKAGE)
+        package.__path__ = [str(root)]
+        sys.modules[APP_PACKAGE] = package
+    return importlib.import_module(f"{APP_PACKAGE}.{name}")
@@ -0,0 +1,265 @@
+"""
+Benchmark the pipeline against a local directory instead of a storage account.
+
+Each case of the matrix of file, row and column counts runs in a fresh process:
+GenerateData writes the input files, step0 lists them and every file goes through
+the SubOrchestratorFunc chain of step1 to step4. The results are saved as JSON and
+can be compared with a baseline to catch regressions, e.g.
+
+    python -m tools.benchmark --files 1 8 --rows 10000 100000 --columns 10 \
+        --output benchmark.json --baseline previous.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from .apploader import APP_ROOT, load_function
+from .localstorage import LocalContainerClient
+
+DEFAULT_TOLERANCE = 0.2
+BENCHMARK_SETTINGS = {
+    "DataStorage": "UseLocalDirectory",
+    "DataContainer": "benchmark",
+    "Step1DataSubpath": "step1",
+    "Step2DataSubpath": "step2",
+    "Step3DataSubpath": "step3",
+    "Step4DataSubpath": "step4",
+    # Measure the steps themselves rather than the step result cache
+    "StepCacheTtlSeconds": "0",
+}
+
+
+class _Task:
+    def __init__(self, run):
+        self.run = run
+
+
+class _SequentialContext:
+    """
+    Minimal orchestration context that runs each activity or sub-orchestration when the orchestrator yields it.
+    """
+
+    def __init__(self, orchestration_input, call_activity):
+        self.__input = orchestration_input
+        self.__call_activity = call_activity
+
+    def get_input(self):
+        return self.__input
+
+    def call_activity(self, name: str, input_=None) -> _Task:
+        return _Task(lambda: self.__call_activity(name, input_))
+
+    def call_sub_orchestrator(self, name: str, input_=None, instance_id: str = None) -> _Task:
+        return _Task(
+            lambda: run_orchestration(load_function(name).orchestrator_function, input_, self.__call_activity)
+        )
+
+    def task_all(self, tasks: list) -> _Task:
+        return _Task(lambda: [task.run() for task in tasks])
+
+    def set_custom_status(self, status):
+        # Nobody queries the status of a benchmark run
+        pass
+
+
+def run_orchestration(orchestrator_function, orchestration_input, call_activity):
+    """
+    Drive a generator based orchestrator function, running its activities and
+    sub-orchestrations one at a time.
+    """
+    orchestration = orchestrator_function(_SequentialContext(orchestration_input, call_activity))
+    value = None
+    while True:
+        try:
+            task = orchestration.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value = task.run()
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process and its finished child processes in MiB.
+    """
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(
+    num_files: int, num_rows: int, num_columns: int, pipeline_mode: str, seed: int, group_cost: float = 0
+) -> dict:
+    """
+    Run the pipeline once over generated files and measure it, with group_cost small files are
+    packed in groups by ManifestPage as in the orchestrator.
+    """
+    for key, value in BENCHMARK_SETTINGS.items():
+        os.environ.setdefault(key, value)
+    common = load_function("common")
+
+    step_seconds = {}
+
+    def call_activity(name: str, activity_input):
+        start = time.perf_counter()
+        result = load_function(name).main(activity_input)
+        step_seconds[name] = step_seconds.get(name, 0.0) + time.perf_counter() - start
+        if result is None:
+            raise RuntimeError(f"Activity {name} failed on {activity_input}")
+        return result
+
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as root:
+        container_client = LocalContainerClient(root)
+        common.use_container_client(container_client)
+
+        generated = call_activity(
+            "GenerateData",
+            {
+                "rawDataPath": "raw",
+                "numFiles": num_files,
+                "numRows": num_rows,
+                "numColumns": num_columns,
+                "seed": seed,
+            },
+        )
+        input_bytes = container_client.bytes_written
+        container_client.bytes_read = container_client.bytes_written = 0
+
+        start = time.perf_counter()
+        manifest = call_activity("step0", {"rawDataPath": generated["rawDataPath"], "runId": "benchmark"})
+        items = [item for page in manifest["pages"] for item in call_activity("ManifestPage", {"page": page, "groupCost": group_cost})]
+        # A work item is a filename, a group of small files or a file split in byte ranges,
+        # each gets the same sub-orchestration input as in the orchestrator
+        item_input = load_function("OrchestratorFunc").item_input
+        sub_orchestrator = load_function("SubOrchestratorFunc")
+        file_options = {"pipelineMode": pipeline_mode, "schema": manifest.get("schema"), "seed": seed}
+        for item in items:
+            run_orchestration(sub_orchestrator.orchestrator_function, item_input(item, file_options), call_activity)
+        processing_seconds = time.perf_counter() - start
+        transferred_bytes = container_client.bytes_read + container_client.bytes_written
+
+    return {
+        "numFiles": num_files,
+        "numRows": num_rows,
+        "numColumns": num_columns,
+        "pipelineMode": pipeline_mode,
+        "inputBytes": input_bytes,
+        "transferredBytes": transferred_bytes,
+        "processingSeconds": processing_seconds,
+        "rowsPerSecond": num_files * num_rows / processing_seconds,
+        "bytesPerSecond": transferred_bytes / processing_seconds,
+        "stepSeconds": step_seconds,
+        "peakRssMb": peak_rss_mb(),
+    }
+
+
+def run_matrix(
+    files: list, rows: list, columns: list, pipeline_modes: list, seed: int, group_cost: float = 0
+) -> list:
+    """
+    Run every case in its own process, so the peak RSS of a case is not inflated by the previous ones.
+    """
+    results = []
+    for num_files, num_rows, num_columns, pipeline_mode in itertools.product(files, rows, columns, pipeline_modes):
+        case = {
+            "num_files": num_files,
+            "num_rows": num_rows,
+            "num_columns": num_columns,
+            "pipeline_mode": pipeline_mode,
+            "seed": seed,
+            "group_cost": group_cost,
+        }
+        logging.warning(f"Running benchmark case {case}")
+        completed = subprocess.run(
+            [sys.executable, "-m", "tools.benchmark", "--case", json.dumps(case)],
+            cwd=APP_ROOT,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        results.append(json.loads(completed.stdout))
+    return results
+
+
+def _case_key(case: dict) -> tuple:
+    return case["numFiles"], case["numRows"], case["numColumns"], case["pipelineMode"]
+
+
+def find_regressions(results: list, baseline: list, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Cases whose rows per second dropped by more than tolerance compared with the baseline.
+    """
+    baseline_cases = {_case_key(case): case for case in baseline}
+    regressions = []
+    for case in results:
+        previous = baseline_cases.get(_case_key(case))
+        if previous and case["rowsPerSecond"] < previous["rowsPerSecond"] * (1 - tolerance):
+            regressions.append(
+                {
+                    "case": _case_key(case),
+                    "rowsPerSecond": case["rowsPerSecond"],
+                    "baselineRowsPerSecond": previous["rowsPerSecond"],
+                }
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--columns", type=int, nargs="+", default=[10])
+    parser.add_argument("--pipeline-mode", nargs="+", default=["chained"], choices=["chained", "fused"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--group-cost", type=float, default=0, help="groupCost of the orchestrator input")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_case(**json.loads(args.case))))
+        return 0
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "cases": run_matrix(args.files, args.rows, args.columns, args.pipeline_mode, args.seed, args.group_cost),
+    }
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    for case in results["cases"]:
+        print(
+            f"{case['numFiles']:>4} files x {case['numRows']:>8} rows x {case['numColumns']:>3} columns "
+            f"{case['pipelineMode']:<8} {case['rowsPerSecond']:>12,.0f} rows/s "
+            f"{case['bytesPerSecond'] / 1024 / 1024:>8,.1f} MiB/s {case['peakRssMb']:>8,.0f} MiB peak RSS"
+        )
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results["cases"], json.load(baseline)["cases"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
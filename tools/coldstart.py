@@ -0,0 +1,159 @@
+"""
+Measure the cold start cost of each function: the time to import its folder in a
+fresh interpreter, as the Python worker does when it loads the function app, and
+the heavy third party modules that the import pulls in.
+
+Each function is imported several times, each time in a new process, and the
+median is reported. The results are saved as JSON and can be compared with a
+baseline to catch regressions, e.g.
+
+    python -m tools.coldstart --repeat 5 --output coldstart.json --baseline previous.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from .apploader import APP_ROOT, load_function
+
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+# Differences below this many seconds are noise rather than regressions
+MIN_REGRESSION_SECONDS = 0.02
+# Third party modules that are slow to import, reported when a function import loads them
+HEAVY_MODULES = (
+    "aiohttp",
+    "azure.storage.blob",
+    "fastparquet",
+    "mimesis",
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "requests",
+)
+
+
+def function_names(root=APP_ROOT) -> list:
+    """
+    Names of the function folders, the folders with a function.json.
+    """
+    return sorted(path.parent.name for path in root.glob("*/function.json"))
+
+
+def measure_import(name: str) -> dict:
+    """
+    Import a function folder in this process and measure it, runs in a fresh process.
+    """
+    modules_before = set(sys.modules)
+    start = time.perf_counter()
+    load_function(name)
+    import_seconds = time.perf_counter() - start
+    loaded = set(sys.modules) - modules_before
+    return {
+        "importSeconds": import_seconds,
+        "modules": len(loaded),
+        "heavyModules": [module for module in HEAVY_MODULES if module in loaded],
+    }
+
+
+def run_function(name: str, repeat: int) -> dict:
+    """
+    Import a function repeat times, each in a new interpreter, and keep the medians.
+    The process time includes the interpreter startup.
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-m", "tools.coldstart", "--function", name],
+            cwd=APP_ROOT,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        run = json.loads(completed.stdout)
+        run["processSeconds"] = time.perf_counter() - start
+        runs.append(run)
+    return {
+        "function": name,
+        "importSeconds": statistics.median(run["importSeconds"] for run in runs),
+        "processSeconds": statistics.median(run["processSeconds"] for run in runs),
+        "modules": runs[-1]["modules"],
+        "heavyModules": runs[-1]["heavyModules"],
+    }
+
+
+def find_regressions(results: list, baseline: list, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Functions whose import got slower by more than tolerance compared with the baseline,
+    or that now import heavy modules they did not import before.
+    """
+    baseline_functions = {function["function"]: function for function in baseline}
+    regressions = []
+    for function in results:
+        previous = baseline_functions.get(function["function"])
+        if not previous:
+            continue
+        slower = function["importSeconds"] - previous["importSeconds"]
+        new_modules = sorted(set(function["heavyModules"]) - set(previous["heavyModules"]))
+        if (slower > previous["importSeconds"] * tolerance and slower > MIN_REGRESSION_SECONDS) or new_modules:
+            regressions.append(
+                {
+                    "function": function["function"],
+                    "importSeconds": function["importSeconds"],
+                    "baselineImportSeconds": previous["importSeconds"],
+                    "newHeavyModules": new_modules,
+                }
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", nargs="+", help="functions to measure (default: all)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", default="coldstart.json")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--function", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.function:
+        print(json.dumps(measure_import(args.function)))
+        return 0
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "functions": [run_function(name, args.repeat) for name in args.functions or function_names()],
+    }
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    for function in results["functions"]:
+        print(
+            f"{function['function']:<20} {function['importSeconds'] * 1000:>8,.0f} ms import "
+            f"{function['processSeconds'] * 1000:>8,.0f} ms process {function['modules']:>5} modules "
+            f"{', '.join(function['heavyModules']) or '-'}"
+        )
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results["functions"], json.load(baseline)["functions"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Run the orchestration graph without the Durable Functions host.
+
+The generator based orchestrator functions run in this process and their activities
+run on a process pool sized to the machine, e.g. to backfill a large batch on one VM:
+
+    python -m tools.localrunner --input '{"rawDataPath": "raw", "numFiles": 0, "numRows": 0}'
+
+Orchestrators are driven live rather than replayed from a history. Activity inputs
+and results go through JSON as they would with the host, so the same code runs
+unchanged in both.
+"""
+
+import argparse
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from azure.durable_functions.models.Task import TaskState
+
+from .apploader import load_function
+
+_NO_INPUT = object()
+
+
+def _init_worker(local_root: str):
+    """
+    Process pool initializer, points the activities at a local directory if one is given.
+    """
+    if local_root:
+        from .localstorage import LocalContainerClient
+
+        load_function("common").use_container_client(LocalContainerClient(local_root))
+
+
+def _run_activity(name: str, activity_input: str) -> str:
+    """
+    Run an activity in a pool process, with its input and result serialized as JSON.
+    """
+    result = load_function(name).main(json.loads(activity_input))
+    return json.dumps(result)
+
+
+class LocalTask:
+    """
+    Task yielded by an orchestrator function, completed by the runner.
+    It has the state, result and is_completed of the tasks of the SDK, so code
+    that only runs against the host is caught here: the result of a failed task
+    is its exception, as with the host.
+    """
+
+    def __init__(self):
+        self.state = TaskState.RUNNING
+        self.result = None
+        self._sequence = None
+        self.__callbacks = []
+
+    @property
+    def is_completed(self) -> bool:
+        return self.state is not TaskState.RUNNING
+
+    def add_done_callback(self, callback):
+        if self.is_completed:
+            callback(self)
+        else:
+            self.__callbacks.append(callback)
+
+    def complete(self, sequence: int, result=None, exception: Exception = None):
+        if self.is_completed:
+            return
+        self.state = TaskState.SUCCEEDED if exception is None else TaskState.FAILED
+        self.result = result if exception is None else exception
+        self._sequence = sequence
+        callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class _LocalContext:
+    """
+    The part of DurableOrchestrationContext used by the orchestrator functions.
+    """
+
+    def __init__(self, runner: "LocalRunner", orchestration: "_Orchestration"):
+        self.__runner = runner
+        self.__orchestration = orchestration
+
+    @property
+    def instance_id(self) -> str:
+        return self.__orchestration.instance_id
+
+    @property
+    def is_replaying(self) -> bool:
+        return False
+
+    @property
+    def current_utc_datetime(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def get_input(self):
+        return self.__orchestration.input
+
+    def call_activity(self, name: str, input_=None) -> LocalTask:
+        return self.__runner.schedule_activity(name, input_)
+
+    def call_sub_orchestrator(self, name: str, input_=None, instance_id: str = None) -> LocalTask:
+        return self.__runner.start_orchestration(name, input_, instance_id)
+
+    def task_all(self, activities: list) -> LocalTask:
+        return self.__runner.when_all(activities)
+
+    def task_any(self, activities: list) -> LocalTask:
+        return self.__runner.when_any(activities)
+
+    def continue_as_new(self, input_):
+        self.__orchestration.continue_input = input_
+
+    def set_custom_status(self, status):
+        self.__orchestration.custom_status = status
+        logging.info(f"Orchestration {self.instance_id} status: {status}")
+
+
+class _Orchestration:
+    def __init__(self, name: str, orchestration_input, instance_id: str, task: LocalTask):
+        self.name = name
+        self.input = orchestration_input
+        self.instance_id = instance_id
+        self.task = task
+        self.generator = None
+        self.continue_input = _NO_INPUT
+        self.custom_status = None
+
+
+class LocalRunner:
+    """
+    Runs an orchestrator function and everything it schedules to completion.
+
+    Activities run on a pool of max_workers processes, with at most max_concurrency
+    of them submitted at a time. Orchestrators only wait on tasks, so they all run
+    in the calling process.
+    """
+
+    def __init__(self, max_workers: int = None, max_concurrency: int = None, local_root: str = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.local_root = local_root
+        self.orchestrations = {}
+        self.__sequence = itertools.count()
+        self.__ready = collections.deque()
+        self.__queued = collections.deque()
+        self.__running = {}
+        self.__executor = None
+
+    def run(self, name: str, orchestration_input=None, instance_id: str = None):
+        """
+        Run an orchestrator function and return its output.
+        """
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=_init_worker, initargs=(self.local_root,)
+        ) as executor:
+            self.__executor = executor
+            task = self.start_orchestration(name, orchestration_input, instance_id)
+            while not task.is_completed:
+                while self.__ready:
+                    self.__advance(*self.__ready.popleft())
+                self.__dispatch()
+                if task.is_completed:
+                    break
+                if not self.__running:
+                    raise RuntimeError("The orchestrations wait on tasks that never complete")
+                done, _ = wait(self.__running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    activity_task, activity_name = self.__running.pop(future)
+                    try:
+                        activity_task.complete(next(self.__sequence), json.loads(future.result()))
+                    except Exception as e:
+                        logging.exception(f"Activity {activity_name} failed", exc_info=e)
+                        activity_task.complete(next(self.__sequence), exception=e)
+        if task.state is TaskState.FAILED:
+            raise task.result
+        return task.result
+
+    def start_orchestration(self, name: str, orchestration_input=None, instance_id: str = None) -> LocalTask:
+        task = LocalTask()
+        orchestration = _Orchestration(name, orchestration_input, instance_id or uuid.uuid4().hex, task)
+        self.orchestrations[orchestration.instance_id] = orchestration
+        self.__start(orchestration)
+        return task
+
+    def schedule_activity(self, name: str, activity_input=None) -> LocalTask:
+        task = LocalTask()
+        self.__queued.append((task, name, json.dumps(activity_input)))
+        return task
+
+    def when_all(self, tasks: list) -> LocalTask:
+        task = LocalTask()
+        remaining = [len(tasks)]
+
+        def child_done(child: LocalTask):
+            if child.state is TaskState.FAILED:
+                task.complete(next(self.__sequence), exception=child.result)
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                task.complete(next(self.__sequence), [child.result for child in tasks])
+
+        if not tasks:
+            task.complete(next(self.__sequence), [])
+        for child in tasks:
+            child.add_done_callback(child_done)
+        return task
+
+    def when_any(self, tasks: list) -> LocalTask:
+        task = LocalTask()
+        # Children completed earlier win in completion order, as with the host
+        completed = sorted((child for child in tasks if child.is_completed), key=lambda child: child._sequence)
+        if completed:
+            task.complete(next(self.__sequence), completed[0])
+            return task
+        for child in tasks:
+            child.add_done_callback(lambda child: task.complete(next(self.__sequence), child))
+        return task
+
+    def __start(self, orchestration: _Orchestration):
+        module = load_function(orchestration.name)
+        orchestration.generator = module.orchestrator_function(_LocalContext(self, orchestration))
+        self.__ready.append((orchestration, None, None))
+
+    def __advance(self, orchestration: _Orchestration, value, exception: Exception):
+        try:
+            if exception is not None:
+                yielded = orchestration.generator.throw(exception)
+            else:
+                yielded = orchestration.generator.send(value)
+        except StopIteration as stop:
+            if orchestration.continue_input is not _NO_INPUT:
+                # Restart with the new input, as the host does with a fresh history
+                orchestration.input = orchestration.continue_input
+                orchestration.continue_input = _NO_INPUT
+                self.__start(orchestration)
+            else:
+                orchestration.task.complete(next(self.__sequence), stop.value)
+            return
+        except Exception as e:
+            orchestration.task.complete(next(self.__sequence), exception=e)
+            return
+        yielded.add_done_callback(
+            lambda task: self.__ready.append(
+                (orchestration, None, task.result)
+                if task.state is TaskState.FAILED
+                else (orchestration, task.result, None)
+            )
+        )
+
+    def __dispatch(self):
+        while self.__queued and len(self.__running) < self.max_concurrency:
+            task, name, activity_input = self.__queued.popleft()
+            future = self.__executor.submit(_run_activity, name, activity_input)
+            self.__running[future] = (task, name)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="orchestration input as JSON")
+    source.add_argument("--input-file", help="file with the orchestration input as JSON")
+    parser.add_argument("--orchestrator", default="OrchestratorFunc")
+    parser.add_argument("--max-workers", type=int, help="activity processes (default: CPU count)")
+    parser.add_argument("--max-concurrency", type=int, help="activities running at a time (default: --max-workers)")
+    parser.add_argument("--local-root", help="directory used instead of the DataStorage storage account")
+    parser.add_argument("--output", help="file to write the orchestration output to")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.input_file:
+        with open(args.input_file) as input_file:
+            orchestration_input = json.load(input_file)
+    else:
+        orchestration_input = json.loads(args.input)
+
+    runner = LocalRunner(args.max_workers, args.max_concurrency, args.local_root)
+    output = runner.run(args.orchestrator, orchestration_input)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
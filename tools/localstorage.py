@@ -0,0 +1,295 @@
+"""
+Directory-backed stand-in for the azure.storage.blob ContainerClient used by BlobStorageClient.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobPrefix, BlobProperties, ContentSettings
+
+META_DIR = ".blobmeta"
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class LocalContainerClient:
+    """
+    Container whose blobs are files under a root directory. The blob metadata,
+    content settings and ETag are kept in JSON sidecar files under .blobmeta.
+    Counts the bytes read and written, so benchmarks can report throughput.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.url = self.root.as_uri()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        # blob name -> {block id: bytes} staged by stage_block until commit_block_list
+        self._staged = {}
+
+    def get_blob_client(self, blob: str) -> "LocalBlobClient":
+        return LocalBlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with: str = None, include=None, results_per_page: int = None, **kwargs):
+        names = [name for name in self._names() if name.startswith(name_starts_with or "")]
+        with_metadata = bool(include and "metadata" in include)
+        return _BlobList(self, names, results_per_page or 5000, with_metadata)
+
+    def walk_blobs(self, name_starts_with: str = None, include=None, delimiter: str = "/", **kwargs):
+        prefix = name_starts_with or ""
+        with_metadata = bool(include and "metadata" in include)
+        seen_prefixes = set()
+        for name in self._names():
+            if not name.startswith(prefix):
+                continue
+            head, separator, _ = name[len(prefix) :].partition(delimiter)
+            if not separator:
+                yield self.get_blob_client(name)._properties(with_metadata)
+            elif head not in seen_prefixes:
+                seen_prefixes.add(head)
+                yield BlobPrefix(None, prefix=f"{prefix}{head}{delimiter}", delimiter=delimiter)
+
+    def delete_blobs(self, *blobs, raise_on_any_failure: bool = True, **kwargs):
+        responses = []
+        for blob in blobs:
+            try:
+                self.get_blob_client(blob).delete_blob()
+                responses.append(_Response(202))
+            except ResourceNotFoundError:
+                if raise_on_any_failure:
+                    raise
+                responses.append(_Response(404))
+        return iter(responses)
+
+    def close(self):
+        pass
+
+    def _names(self) -> list:
+        names = []
+        for path in self.root.rglob("*"):
+            relative = path.relative_to(self.root)
+            if path.is_file() and relative.parts[0] != META_DIR and not path.name.endswith(".tmp"):
+                names.append(relative.as_posix())
+        return sorted(names)
+
+    def _path(self, name: str) -> Path:
+        return self.root / name
+
+    def _meta_path(self, name: str) -> Path:
+        return self.root / META_DIR / f"{name}.json"
+
+
+class LocalBlobClient:
+    """
+    Blob of a LocalContainerClient, implementing the BlobClient methods used by BlobStorageClient.
+    """
+
+    def __init__(self, container: LocalContainerClient, name: str):
+        self.container = container
+        self.blob_name = name
+        self.url = f"{container.url}/{quote(name)}"
+
+    def exists(self) -> bool:
+        return self.container._path(self.blob_name).is_file()
+
+    def upload_blob(
+        self, data, overwrite: bool = False, metadata: dict = None, content_settings: ContentSettings = None, **kwargs
+    ):
+        if not overwrite and self.exists():
+            raise ResourceExistsError(f"The blob {self.blob_name} already exists")
+        if isinstance(data, str):
+            data = data.encode(kwargs.get("encoding") or "utf-8")
+        elif not isinstance(data, (bytes, bytearray, memoryview)):
+            data = data.read()
+        # As the service, compute the Content-MD5 of blobs uploaded with a single request
+        self._write(bytes(data), metadata, content_settings, content_md5=True)
+
+    def stage_block(self, block_id: str, data, **kwargs):
+        with self.container._lock:
+            self.container._staged.setdefault(self.blob_name, {})[block_id] = bytes(data)
+
+    def commit_block_list(self, block_list, metadata: dict = None, content_settings: ContentSettings = None, **kwargs):
+        with self.container._lock:
+            staged = self.container._staged.pop(self.blob_name, {})
+        self._write(b"".join(staged[block.id] for block in block_list), metadata, content_settings)
+
+    def download_blob(self, offset: int = None, length: int = None, **kwargs) -> "LocalDownloader":
+        properties = self.get_blob_properties()
+        start = offset or 0
+        end = properties.size if length is None else min(properties.size, start + length)
+        return LocalDownloader(self, properties, start, end)
+
+    def get_blob_properties(self, **kwargs) -> BlobProperties:
+        if not self.exists():
+            raise ResourceNotFoundError(f"The blob {self.blob_name} does not exist")
+        return self._properties(True)
+
+    def set_blob_metadata(self, metadata: dict = None, **kwargs):
+        sidecar = self._sidecar()
+        sidecar.update(metadata=metadata or {}, etag=_new_etag())
+        self._write_sidecar(sidecar)
+        os.utime(self.container._path(self.blob_name))
+
+    def delete_blob(self, **kwargs):
+        path = self.container._path(self.blob_name)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"The blob {self.blob_name} does not exist")
+        self.container._meta_path(self.blob_name).unlink(missing_ok=True)
+
+    def start_copy_from_url(self, source_url: str, **kwargs) -> dict:
+        source_name = unquote(source_url[len(self.container.url) :].lstrip("/"))
+        source = self.container.get_blob_client(source_name)
+        if not source.exists():
+            raise ResourceNotFoundError(f"The blob {source_name} does not exist")
+        target_path = self.container._path(self.blob_name)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.container._path(source_name), target_path)
+        sidecar = {**source._sidecar(), "etag": _new_etag(), "copy_status": "success"}
+        self._write_sidecar(sidecar)
+        return {"copy_status": "success", "etag": sidecar["etag"]}
+
+    def _properties(self, with_metadata: bool) -> BlobProperties:
+        path = self.container._path(self.blob_name)
+        stat = path.stat()
+        sidecar = self._sidecar()
+        properties = BlobProperties()
+        properties.name = self.blob_name
+        properties.container = self.container.root.name
+        properties.size = stat.st_size
+        properties.etag = sidecar.get("etag") or f'"{int(stat.st_mtime_ns):x}"'
+        properties.last_modified = datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+        properties.metadata = sidecar.get("metadata", {}) if with_metadata else {}
+        properties.content_settings = ContentSettings(
+            content_type=sidecar.get("content_type"),
+            content_encoding=sidecar.get("content_encoding"),
+            content_md5=base64.b64decode(sidecar["content_md5"]) if sidecar.get("content_md5") else None,
+        )
+        properties.copy.status = sidecar.get("copy_status")
+        return properties
+
+    def _write(self, data: bytes, metadata: dict, content_settings: ContentSettings, content_md5: bool = False):
+        path = self.container._path(self.blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        temporary_path.write_bytes(data)
+        os.replace(temporary_path, path)
+        self._write_sidecar(
+            {
+                "metadata": metadata or {},
+                "content_type": content_settings.content_type if content_settings else None,
+                "content_encoding": content_settings.content_encoding if content_settings else None,
+                "content_md5": base64.b64encode(hashlib.md5(data).digest()).decode() if content_md5 else None,
+                "etag": _new_etag(),
+            }
+        )
+        with self.container._lock:
+            self.container.bytes_written += len(data)
+
+    def _sidecar(self) -> dict:
+        try:
+            return json.loads(self.container._meta_path(self.blob_name).read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _write_sidecar(self, sidecar: dict):
+        meta_path = self.container._meta_path(self.blob_name)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta_path.write_text(json.dumps(sidecar))
+
+
+class LocalDownloader:
+    """
+    Stand-in for StorageStreamDownloader over a byte range of a local blob.
+    """
+
+    def __init__(self, blob: LocalBlobClient, properties: BlobProperties, start: int, end: int):
+        self.__blob = blob
+        self.__start = start
+        self.__end = end
+        self.properties = properties
+        self.size = end - start
+
+    def chunks(self):
+        with open(self.__blob.container._path(self.__blob.blob_name), "rb") as file:
+            file.seek(self.__start)
+            remaining = self.size
+            while remaining > 0:
+                chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                with self.__blob.container._lock:
+                    self.__blob.container.bytes_read += len(chunk)
+                yield chunk
+
+    def readall(self) -> bytes:
+        return b"".join(self.chunks())
+
+    def readinto(self, stream) -> int:
+        size = 0
+        for chunk in self.chunks():
+            stream.write(chunk)
+            size += len(chunk)
+        return size
+
+
+class _BlobList:
+    """
+    Listing result that iterates over blobs or, with by_page, over pages of blobs.
+    """
+
+    def __init__(self, container: LocalContainerClient, names: list, results_per_page: int, with_metadata: bool):
+        self.__container = container
+        self.__names = names
+        self.__results_per_page = results_per_page
+        self.__with_metadata = with_metadata
+        self.continuation_token = None
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self):
+        return _BlobPages(self.__container, self.__names, self.__results_per_page, self.__with_metadata)
+
+
+class _BlobPages:
+    def __init__(self, container: LocalContainerClient, names: list, results_per_page: int, with_metadata: bool):
+        self.__container = container
+        self.__names = names
+        self.__results_per_page = results_per_page
+        self.__with_metadata = with_metadata
+        self.__offset = 0
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> list:
+        if self.__offset >= len(self.__names):
+            raise StopIteration
+        names = self.__names[self.__offset : self.__offset + self.__results_per_page]
+        self.__offset += len(names)
+        self.continuation_token = self.__names[self.__offset] if self.__offset < len(self.__names) else None
+        return [self.__container.get_blob_client(name)._properties(self.__with_metadata) for name in names]
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+def _new_etag() -> str:
+    return f'"{uuid.uuid4().hex}"'
@@ -1,5 +1,7 @@
+import datetime
 import os
 import time
+from io import BytesIO
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,16 +12,20 @@ import requests
 import streamlit as st
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
-from pandas_profiling import ProfileReport
 from plotly.subplots import make_subplots
 from streamlit_pandas_profiling import st_profile_report
 
 from blobstorageclient import BlobStorageClient
+from preview import PreviewCache, blob_preview, dataframe_preview, profile_report, upload_preview
 
 load_dotenv()
 
 DATASTORAGE = os.getenv("DATASTORAGE")
 DATACONTAINER = os.getenv("DATACONTAINER")
+# The run status is polled every second while it changes, backing off up to 30 seconds
+POLL_MIN_SECONDS = 1.0
+POLL_MAX_SECONDS = 30.0
+POLL_BACKOFF = 1.5
 
 try:
     blob_service_client = BlobServiceClient.from_connection_string(DATASTORAGE)
@@ -41,25 +47,65 @@ st.sidebar.title("Workflow selector")
 st.sidebar.markdown("Select the workflow accordingly:")
 
 
-@st.cache(allow_output_mutation=True)
-def gen_profile_report(df, *report_args, **report_kwargs):
-    return df.profile_report(*report_args, **report_kwargs)
+@st.cache_resource
+def get_preview_cache() -> PreviewCache:
+    """
+    Previews shared by all the sessions of the app, keyed on the blob ETag or upload digest.
+    """
+    return PreviewCache()
+
+
+def poll_interval(interval: float, changed: bool) -> float:
+    """
+    Poll again soon while the run status changes, and back off while it does not.
+    """
+    if changed:
+        return POLL_MIN_SECONDS
+    return min(interval * POLL_BACKOFF, POLL_MAX_SECONDS)
+
+
+def format_progress(progress: dict) -> str:
+    """
+    One line summary of the custom status published by OrchestratorFunc.
+    """
+    eta = progress.get("etaSeconds")
+    return (
+        f"**{progress.get('phase', 'starting')}** - "
+        f"{progress.get('filesDone', 0):,} of {progress.get('filesTotal', 0):,} files done, "
+        f"{progress.get('filesFailed', 0):,} failed, {progress.get('inFlight', 0):,} in flight - "
+        f"{progress.get('rowsPerSecond', 0):,.0f} rows/s - "
+        f"ETA {datetime.timedelta(seconds=eta) if eta is not None else 'unknown'}"
+    )
 
 
 def check_az_func(url):
-    JOB_STATUS = "Running"
-    while JOB_STATUS == "Running" or JOB_STATUS == "Pending":
-        time.sleep(5)
-        r = requests.get(url)
-        # st.write(f"Job Status: {JOB_STATUS}")
-        st.json(r.json())
-        JOB_STATUS = r.json()["runtimeStatus"]
-        if JOB_STATUS == "failed":
-            st.error(f"Job failed. Please check logs")
+    # The progress is updated in place, the output is shown once the run ended
+    progress_bar = st.progress(0.0)
+    progress_text = st.empty()
+    interval = POLL_MIN_SECONDS
+    last_progress = None
+    while True:
+        r = requests.get(url, params={"showInput": "false"})
+        status = r.json()
+        progress = status.get("customStatus") or {}
+        if progress != last_progress:
+            files_total = progress.get("filesTotal") or 0
+            progress_bar.progress(min(progress.get("filesDone", 0) / files_total, 1.0) if files_total else 0.0)
+            progress_text.markdown(format_progress(progress))
+
+        JOB_STATUS = status["runtimeStatus"]
+        if JOB_STATUS in ("Failed", "Terminated", "Canceled"):
+            st.error(f"Job {JOB_STATUS.lower()}. Please check logs")
+            st.json(status)
             break
-        elif JOB_STATUS == "succeeded":
+        elif JOB_STATUS == "Completed":
             st.info(f"Job succeeded")
-            st.json(r.json())
+            st.json(status.get("output"))
+            break
+
+        time.sleep(interval)
+        interval = poll_interval(interval, progress != last_progress)
+        last_progress = progress
 
 
 def run_azfunc(rawDataPath="raw"):
@@ -73,11 +119,13 @@ def run_azfunc(rawDataPath="raw"):
     check_az_func(url=r.json()["statusQueryGetUri"])
 
 
-def gen_pandas_stats(df):
-    st.write("Number of columns in the dataset: ", df.shape[1])
-    st.write("Number of rows in the dataset: ", df.shape[0])
-    st.write(df.head(5))
-    pr = gen_profile_report(df, explorative=True)
+def gen_pandas_stats(key, preview):
+    st.write("Number of columns in the dataset: ", preview.column_count)
+    st.write("Number of rows in the dataset: ", preview.row_count)
+    st.write(preview.head)
+    if preview.row_count > len(preview.sample):
+        st.caption(f"The report is built on a random sample of {len(preview.sample):,} rows")
+    pr = profile_report(key, preview, get_preview_cache(), explorative=True)
     with st.expander("REPORT", expanded=True):
         st_profile_report(pr)
 
@@ -85,7 +133,7 @@ def gen_pandas_stats(df):
 def main():
     st.sidebar.markdown("**1.** Select the **Data**:")
 
-    data = st.sidebar.selectbox("Data", ["Uploaded Data", "Sample Data"])
+    data = st.sidebar.selectbox("Data", ["Uploaded Data", "Sample Data", "Blob Data"])
 
     st.sidebar.markdown("**2.** Select the **Validate/Clean**:")
 
@@ -100,22 +148,32 @@ def main():
         "Save", ["Save results to Azure Blob Storage", "Save to CSV locally"]
     )
 
-    dataframe = pd.DataFrame()
+    # The whole dataset is only read when it is saved, the preview works on its head and a sample
+    load_dataframe = pd.DataFrame
     filename = ""
     st.subheader("Step - 1: Upload the data")
     if data == "Uploaded Data":
         uploaded_file = st.file_uploader("Choose a file")
         if uploaded_file is not None:
             filename = uploaded_file.name
-            # Can be used wherever a "file-like" object is accepted:
-            dataframe = pd.read_csv(uploaded_file)
-            gen_pandas_stats(dataframe)
+            content = uploaded_file.getvalue()
+            load_dataframe = lambda: pd.read_csv(BytesIO(content))
+            gen_pandas_stats(*upload_preview(content, get_preview_cache()))
 
     elif data == "Sample Data":
         st.subheader("Sample Data generated with 100 rows")
         filename = "random_data.csv"
         dataframe = blob_client.gen_data()
-        gen_pandas_stats(dataframe)
+        load_dataframe = lambda: dataframe
+        gen_pandas_stats(*dataframe_preview(dataframe, get_preview_cache()))
+
+    elif data == "Blob Data":
+        folder = st.text_input("Folder", "raw")
+        path = st.selectbox("File", blob_client.get_csv_files(folder))
+        if path:
+            filename = path.split("/")[-1]
+            load_dataframe = lambda: pd.concat(blob_client.iter_pd_dataframe(path), ignore_index=True)
+            gen_pandas_stats(*blob_preview(blob_client, path, get_preview_cache()))
 
     st.subheader("Step - 2: Clean the Data")
     if st.button(label=f"Run - {validateclean}", key="run-azfunc"):
@@ -129,6 +187,7 @@ def main():
         # TODO: Add code to call Azure ML to score the data
     st.subheader("Step - 4: Choose the output")
     if st.button(label=f"Download - {save}", key="download-file"):
+        dataframe = load_dataframe()
         if save == "Save results to Azure Blob Storage":
             try:
                 blob_client.upload_pd_dataframe(
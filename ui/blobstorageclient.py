@@ -3,6 +3,7 @@ Interaction with Azure Blob Storage.
 """
 
 import datetime
+import io
 import time
 from io import BytesIO, TextIOWrapper
 
@@ -12,9 +13,37 @@ from azure.storage.blob import BlobClient, ContainerClient
 from mimesis import Address, Datetime, Person
 
 DEFAULT_ENCODING = "UTF-8-SIG"
+DEFAULT_CHUNK_ROWS = 50_000
 STATUS = "Success"
 
 
+class ChunkIteratorStream(io.RawIOBase):
+    """
+    Read-only binary stream over an iterator of byte chunks,
+    such as StorageStreamDownloader.chunks().
+    """
+
+    def __init__(self, chunks):
+        self.__chunks = iter(chunks)
+        self.__chunk = memoryview(b"")
+        self.__offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.__offset >= len(self.__chunk):
+            try:
+                self.__chunk = memoryview(next(self.__chunks))
+            except StopIteration:
+                return 0
+            self.__offset = 0
+        size = min(len(buffer), len(self.__chunk) - self.__offset)
+        buffer[:size] = self.__chunk[self.__offset : self.__offset + size]
+        self.__offset += size
+        return size
+
+
 class BlobStorageClient:
     """
     Class to interact with Azure Blob Storage.
@@ -45,6 +74,30 @@ class BlobStorageClient:
         stream = TextIOWrapper(BytesIO(contents), encoding=encoding)
         return stream
 
+    def get_blob_properties(self, path: str):
+        """
+        Get the properties of a file in Azure Blob Storage.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        return blob.get_blob_properties()
+
+    def download_blob_range(self, path: str, offset: int = 0, length: int = None) -> bytes:
+        """
+        Download a byte range of a file from Azure Blob Storage, e.g. its first bytes.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        return blob.download_blob(offset=offset, length=length).readall()
+
+    def iter_pd_dataframe(self, path: str, chunksize: int = DEFAULT_CHUNK_ROWS, **read_kwargs):
+        """
+        Download a CSV file from Azure Blob Storage as an iterator of pandas dataframes,
+        streaming it chunk by chunk so memory does not grow with the blob size.
+        """
+        blob: BlobClient = self.__container_client.get_blob_client(path)
+        stream = io.BufferedReader(ChunkIteratorStream(blob.download_blob().chunks()))
+        with pd.read_csv(stream, chunksize=chunksize, encoding=DEFAULT_ENCODING, **read_kwargs) as reader:
+            yield from reader
+
     def upload_pd_dataframe(self, df: pd.DataFrame, path: str, metadata: dict = None):
         """
         Upload a pandas dataframe as a csv file to Azure Blob Storage.
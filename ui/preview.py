@@ -0,0 +1,177 @@
+"""
+Fast previews of the datasets shown in the app.
+
+The head of a blob is parsed from a ranged read of its first bytes, the profile report
+runs on a bounded reservoir sample instead of the whole dataset, and both are cached
+per blob ETag or upload digest in a least recently used cache bounded in memory.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from blobstorageclient import DEFAULT_CHUNK_ROWS, DEFAULT_ENCODING, BlobStorageClient
+
+HEAD_BYTES = 1024 * 1024
+HEAD_ROWS = 5
+SAMPLE_ROWS = 10_000
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+@dataclass
+class Preview:
+    """
+    Head, sample and size of a dataset, and the profile report of the sample once built.
+    """
+
+    head: pd.DataFrame
+    sample: pd.DataFrame
+    row_count: int
+    column_count: int
+    report: object = None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory held by the preview. The profile report keeps its own copy of the sample.
+        """
+        head_bytes = int(self.head.memory_usage(deep=True).sum())
+        sample_bytes = int(self.sample.memory_usage(deep=True).sum())
+        return head_bytes + sample_bytes * (2 if self.report is not None else 1)
+
+
+class PreviewCache:
+    """
+    Least recently used cache of previews, evicting the oldest ones once the
+    previews hold more than max_bytes. The last preview added is always kept.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Preview:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            self.__entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, preview: Preview):
+        """
+        Add or update a preview, e.g. once its report is built, and evict the oldest ones.
+        """
+        with self.__lock:
+            self.__entries[key] = (preview, preview.nbytes)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > 1 and self.nbytes > self.max_bytes:
+                self.__entries.popitem(last=False)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size in self.__entries.values())
+
+
+def reservoir_sample(chunks, sample_size: int = SAMPLE_ROWS, random_state: int = None) -> tuple:
+    """
+    Uniform sample of at most sample_size rows of a dataset read as an iterator of
+    dataframes, holding at most one chunk and the sample in memory.
+    Each row gets a random key and the rows with the smallest keys are kept.
+    Returns the sample, in the order of the dataset, and the number of rows.
+    """
+    rng = np.random.default_rng(random_state)
+    sample = None
+    keys = np.empty(0)
+    row_count = 0
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        chunk_keys = rng.random(len(chunk))
+        chunk.index = pd.RangeIndex(row_count, row_count + len(chunk))
+        row_count += len(chunk)
+        sample = chunk if sample is None else pd.concat([sample, chunk])
+        keys = np.concatenate([keys, chunk_keys])
+        if len(sample) > sample_size:
+            kept = np.argpartition(keys, sample_size)[:sample_size]
+            sample, keys = sample.iloc[kept], keys[kept]
+    if sample is None:
+        return pd.DataFrame(), 0
+    return sample.sort_index().reset_index(drop=True), row_count
+
+
+def read_head(
+    blob_client: BlobStorageClient, path: str, head_bytes: int = HEAD_BYTES, rows: int = HEAD_ROWS
+) -> pd.DataFrame:
+    """
+    First rows of a CSV blob, parsed from a ranged read of its first head_bytes bytes
+    cut at the last complete line.
+    """
+    content = blob_client.download_blob_range(path, 0, head_bytes)
+    if len(content) == head_bytes:
+        content = content[: content.rfind(b"\n") + 1]
+    return pd.read_csv(BytesIO(content), nrows=rows, encoding=DEFAULT_ENCODING)
+
+
+def blob_preview(blob_client: BlobStorageClient, path: str, cache: PreviewCache) -> tuple:
+    """
+    Preview of a CSV blob, cached on its ETag so a changed blob gets a new preview.
+    Returns the cache key and the preview.
+    """
+    key = f"blob:{path}:{blob_client.get_blob_properties(path).etag}"
+    preview = cache.get(key)
+    if preview is None:
+        head = read_head(blob_client, path)
+        sample, row_count = reservoir_sample(blob_client.iter_pd_dataframe(path))
+        preview = Preview(head, sample, row_count, head.shape[1])
+        cache.put(key, preview)
+    return key, preview
+
+
+def upload_preview(data: bytes, cache: PreviewCache) -> tuple:
+    """
+    Preview of an uploaded CSV file, cached on the SHA-256 digest of its content.
+    Returns the cache key and the preview.
+    """
+    key = f"upload:{hashlib.sha256(data).hexdigest()}"
+    preview = cache.get(key)
+    if preview is None:
+        head = pd.read_csv(BytesIO(data), nrows=HEAD_ROWS)
+        with pd.read_csv(BytesIO(data), chunksize=DEFAULT_CHUNK_ROWS) as chunks:
+            sample, row_count = reservoir_sample(chunks)
+        preview = Preview(head, sample, row_count, head.shape[1])
+        cache.put(key, preview)
+    return key, preview
+
+
+def dataframe_preview(df: pd.DataFrame, cache: PreviewCache) -> tuple:
+    """
+    Preview of a dataframe already in memory, cached on a digest of its values.
+    Returns the cache key and the preview.
+    """
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df).values.tobytes()).hexdigest()
+    key = f"dataframe:{digest}"
+    preview = cache.get(key)
+    if preview is None:
+        sample, row_count = reservoir_sample([df])
+        preview = Preview(df.head(HEAD_ROWS), sample, row_count, df.shape[1])
+        cache.put(key, preview)
+    return key, preview
+
+
+def profile_report(key: str, preview: Preview, cache: PreviewCache, **report_kwargs):
+    """
+    Profile report of the sample of a preview, built once and cached with it.
+    """
+    if preview.report is None:
+        # pandas_profiling is slow to import, only load it when a report is needed
+        from pandas_profiling import ProfileReport
+
+        preview.report = ProfileReport(preview.sample, **report_kwargs)
+        cache.put(key, preview)
+    return preview.report